@@ -0,0 +1,102 @@
+"""
+Compare the single-pass CellRewriter with the per-pattern search/sub loop that
+test-cookbooks.py used to run, over the code cells of every notebook in the repo.
+
+    python bench_cell_rewriter.py --repeat 20
+"""
+import argparse
+import glob
+import re
+import time
+
+import nbformat
+
+from cell_rewriter import build_cookbook_rewriter
+
+API_KEY_REGEX = r'os\.environ\["LANGCHAIN_API_KEY"\] = [\"\']([^\"\']+)["\']'
+HUB_API_KEY_REGEX = r'os\.environ\["LANGCHAIN_HUB_API_KEY"\] = [\"\']([^\"\']+)["\']'
+ENDPOINT_REGEX = r'os\.environ\["LANGCHAIN_ENDPOINT"\] = [\"\']([^\"\']+)["\']'
+HUB_API_URL_REGEX = r'os\.environ\["LANGCHAIN_HUB_API_URL"\] = [\"\']([^\"\']+)["\']'
+PROJECT_ENV_REGEX = r'os\.environ\["LANGCHAIN_PROJECT"\] = [\"\']([^\"\']+)["\']'
+PROJECT_NAME_REGEX = r"YOUR PROJECT NAME"
+HUB_HANDLE_REGEX = r"YOUR HUB HANDLE"
+OPENAI_API_KEY_REGEX = r'os\.environ\["OPENAI_API_KEY"\] = [\"\']([^\"\']+)["\']'
+
+SETTINGS = {
+    "api_key": "ls-test-key",
+    "endpoint": "https://api.smith.langchain.com",
+    "project": "SYSTEM-TEST",
+    "hub_api_key": "ls-test-key",
+    "hub_api_url": "https://api.hub.langchain.com",
+    "hub_handle": "infra-guy",
+    "openai_api_key": "sk-test-key",
+}
+
+
+def legacy_rewrite(
+    source,
+    api_key,
+    endpoint,
+    project,
+    hub_api_key,
+    hub_api_url,
+    hub_handle,
+    openai_api_key,
+):
+    rewrites = [
+        (API_KEY_REGEX, f"os.environ[\"LANGCHAIN_API_KEY\"] = '{api_key}'"),
+        (ENDPOINT_REGEX, f'os.environ["LANGCHAIN_ENDPOINT"] = "{endpoint}"'),
+        (PROJECT_ENV_REGEX, f"os.environ[\"LANGCHAIN_PROJECT\"] = '{project}'"),
+        (PROJECT_NAME_REGEX, project),
+        (HUB_API_KEY_REGEX, f"os.environ[\"LANGCHAIN_HUB_API_KEY\"] = '{hub_api_key}'"),
+        (HUB_API_URL_REGEX, f"os.environ[\"LANGCHAIN_HUB_API_URL\"] = '{hub_api_url}'"),
+        (HUB_HANDLE_REGEX, hub_handle),
+        (OPENAI_API_KEY_REGEX, f"os.environ[\"OPENAI_API_KEY\"] = '{openai_api_key}'"),
+    ]
+    for pattern, replacement in rewrites:
+        if re.search(pattern, source):
+            source = re.sub(pattern, replacement, source)
+    return source
+
+
+def _load_sources():
+    sources = []
+    for file in glob.glob("../**/*.ipynb", recursive=True):
+        with open(file) as ff:
+            nb = nbformat.read(ff, nbformat.NO_CONVERT)
+        sources.extend(cell.source for cell in nb.cells if cell.cell_type == "code")
+    return sources
+
+
+def _time(fn, sources, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for source in sources:
+            fn(source)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    sources = _load_sources()
+    rewriter = build_cookbook_rewriter(**SETTINGS)
+    mismatches = sum(
+        rewriter.rewrite(source) != legacy_rewrite(source, **SETTINGS)
+        for source in sources
+    )
+    legacy = _time(lambda s: legacy_rewrite(s, **SETTINGS), sources, args.repeat)
+    single_pass = _time(rewriter.rewrite, sources, args.repeat)
+    print(f"{len(sources)} code cells, {sum(map(len, sources)) / 1e6:.2f}MB of source")
+    print(f"search/sub per pattern: {legacy * 1e3:8.2f}ms")
+    print(f"single pass:            {single_pass * 1e3:8.2f}ms")
+    print(f"speedup:                {legacy / single_pass:8.2f}x")
+    print(f"cells with different output: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import re
+
+_ENV_ASSIGNMENT = r'os\.environ\["(?P<env>{names})"\] = [\"\'][^\"\']+["\']'
+
+
+class CellRewriter:
+    """
+    Rewrites secrets and placeholders in notebook code cells in a single pass.
+
+    Two kinds of rewrites can be registered:
+
+    - env assignments: `os.environ["NAME"] = "..."` has its value replaced
+    - literals: a placeholder string such as `YOUR PROJECT NAME` is replaced verbatim
+
+    All registered rewrites are compiled into one alternation, so each cell is
+    scanned once no matter how many placeholders there are. Matches are dispatched
+    on the matched name, and replacement values are inserted as-is rather than
+    being interpreted as regex replacement templates. Most cells contain none of
+    the placeholders, so a plain substring check on each rewrite's fixed text
+    skips the regex entirely for them.
+    """
+
+    def __init__(self):
+        self._env = {}
+        self._literals = {}
+        self._pattern = None
+        self._anchors = ()
+
+    def register_env(self, name, value, quote="'"):
+        """Replace the value assigned to `os.environ[name]`."""
+        self._env[name] = f'os.environ["{name}"] = {quote}{value}{quote}'
+        self._pattern = None
+        return self
+
+    def register_literal(self, placeholder, value):
+        """Replace every occurrence of `placeholder`."""
+        self._literals[placeholder] = value
+        self._pattern = None
+        return self
+
+    def _compile(self):
+        alternatives = []
+        if self._env:
+            names = "|".join(
+                re.escape(name) for name in sorted(self._env, key=len, reverse=True)
+            )
+            alternatives.append(_ENV_ASSIGNMENT.format(names=names))
+        if self._literals:
+            literals = "|".join(
+                re.escape(literal)
+                for literal in sorted(self._literals, key=len, reverse=True)
+            )
+            alternatives.append(f"(?P<literal>{literals})")
+        self._anchors = (('os.environ["',) if self._env else ()) + tuple(
+            self._literals
+        )
+        return re.compile("|".join(alternatives)) if alternatives else None
+
+    def _replacement(self, match):
+        env = match.group("env") if self._env else None
+        if env is not None:
+            return self._env[env]
+        return self._literals[match.group("literal")]
+
+    def rewrite(self, source):
+        if self._pattern is None:
+            self._pattern = self._compile()
+            if self._pattern is None:
+                return source
+        if not any(anchor in source for anchor in self._anchors):
+            return source
+        return self._pattern.sub(self._replacement, source)
+
+
+def build_cookbook_rewriter(
+    api_key,
+    endpoint,
+    project,
+    hub_api_key,
+    hub_api_url,
+    hub_handle,
+    openai_api_key,
+    placeholders=None,
+):
+    """
+    The rewrites applied to every cookbook before it runs, plus any extra
+    `{placeholder: value}` literals.
+    """
+    rewriter = (
+        CellRewriter()
+        .register_env("LANGCHAIN_API_KEY", api_key)
+        .register_env("LANGCHAIN_ENDPOINT", endpoint, quote='"')
+        .register_env("LANGCHAIN_PROJECT", project)
+        .register_env("LANGCHAIN_HUB_API_KEY", hub_api_key)
+        .register_env("LANGCHAIN_HUB_API_URL", hub_api_url)
+        .register_env("OPENAI_API_KEY", openai_api_key)
+        .register_literal("YOUR PROJECT NAME", project)
+        .register_literal("YOUR HUB HANDLE", hub_handle)
+    )
+    for placeholder, value in (placeholders or {}).items():
+        rewriter.register_literal(placeholder, value)
+    return rewriter
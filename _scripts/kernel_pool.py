@@ -0,0 +1,222 @@
+import contextlib
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+
+from jupyter_client.manager import KernelManager
+
+# Heavy modules most cookbooks import. Loading them once per kernel instead of once per
+# notebook is where most of the savings for small notebooks come from.
+DEFAULT_PREIMPORTS = (
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "langsmith",
+    "openai",
+    "pandas",
+)
+
+# Snapshot the pristine kernel state into a module that survives `%reset`, so every
+# notebook starts from the same environment variables and working directory.
+_SNAPSHOT_CODE = """
+import os as _os, sys as _sys, types as _types
+_state = _types.ModuleType("_cookbook_kernel")
+_state.environ = dict(_os.environ)
+_state.cwd = _os.getcwd()
+_sys.modules["_cookbook_kernel"] = _state
+del _os, _sys, _types, _state
+"""
+
+_PREIMPORT_CODE = """
+for _module in {modules!r}:
+    try:
+        __import__(_module)
+    except ImportError:
+        pass
+del _module
+"""
+
+# langsmith caches what it reads from the environment (project, endpoint, API key)
+# and the tracer keeps a global client built from it. Preimported modules survive the
+# reset, so these are cleared too, or LANGCHAIN_PROJECT and LANGCHAIN_ENDPOINT set by
+# one notebook would apply to the next. Pending traces are sent first.
+_ENV_CACHES = (
+    ("langsmith.utils", ("get_env_var", "get_tracer_project", "get_host_url")),
+    ("langsmith.client", ("_parse_url",)),
+)
+_CACHED_CLIENTS = ("langsmith.run_trees", "langchain_core.tracers.langchain")
+
+_RESET_CODE = """
+import os as _os, sys as _sys
+_tracers = _sys.modules.get("langchain_core.tracers.langchain")
+if _tracers is not None:
+    _tracers.wait_for_all_tracers()
+_state = _sys.modules["_cookbook_kernel"]
+_os.environ.clear()
+_os.environ.update(_state.environ)
+_os.chdir(_state.cwd)
+for _name, _functions in {env_caches!r}:
+    for _function in _functions:
+        getattr(getattr(_sys.modules.get(_name), _function, None), "cache_clear", int)()
+for _name in {cached_clients!r}:
+    if hasattr(_sys.modules.get(_name), "_CLIENT"):
+        _sys.modules[_name]._CLIENT = None
+get_ipython().reset(new_session=True)
+""".format(env_caches=_ENV_CACHES, cached_clients=_CACHED_CLIENTS)
+
+
+class KernelError(RuntimeError):
+    """Raised when setup code fails to run in a kernel."""
+
+
+def run_code(km, code, timeout=60):
+    """
+    Run setup code in a kernel outside of any notebook and return what it printed.
+    """
+    stdout = []
+
+    def output_hook(msg):
+        if msg["msg_type"] == "stream" and msg["content"]["name"] == "stdout":
+            stdout.append(msg["content"]["text"])
+
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kc.wait_for_ready(timeout=timeout)
+        reply = kc.execute_interactive(
+            code, timeout=timeout, store_history=False, output_hook=output_hook
+        )
+    finally:
+        kc.stop_channels()
+    if reply["content"]["status"] != "ok":
+        raise KernelError(
+            f"{reply['content'].get('ename')}: {reply['content'].get('evalue')}"
+        )
+    return "".join(stdout)
+
+
+def set_kernel_env(km, env, timeout=60):
+    """Set environment variables inside a running kernel."""
+    run_code(km, f"import os as _os\n_os.environ.update({dict(env)!r})\ndel _os", timeout)
+
+
+def start_kernel(env=None, preimports=(), kernel_name="python3", timeout=60):
+    """
+    Start a kernel and run the setup code on it. Returns the kernel manager along
+    with the number of seconds spent launching the kernel and importing modules.
+    """
+    start = time.perf_counter()
+    km = KernelManager(kernel_name=kernel_name)
+    km.start_kernel(env={**os.environ, **(env or {})})
+    try:
+        run_code(km, _SNAPSHOT_CODE, timeout)
+        launched = time.perf_counter()
+        if preimports:
+            run_code(km, _PREIMPORT_CODE.format(modules=tuple(preimports)), timeout)
+    except Exception:
+        km.shutdown_kernel(now=True)
+        raise
+    end = time.perf_counter()
+    return km, {"launch": launched - start, "imports": end - launched}
+
+
+@contextlib.contextmanager
+def fresh_kernel(env=None, kernel_name="python3", timeout=60):
+    """
+    Start a cold kernel for a single notebook run and shut it down afterwards.
+    """
+    km, startup = start_kernel(env=env, kernel_name=kernel_name, timeout=timeout)
+    try:
+        yield km, startup
+    finally:
+        km.shutdown_kernel(now=True)
+
+
+class KernelPool:
+    """
+    A pool of pre-started kernels with common modules already imported.
+
+    Kernels are reset between notebooks: the user namespace is cleared and the
+    environment variables and working directory are restored to what they were
+    when the kernel was started, and langsmith's cached settings and tracing client
+    are dropped. Imported modules are kept, which is the point of the pool, so any
+    other module-level state a notebook mutates is shared with the notebooks that
+    run after it on the same kernel.
+    """
+
+    def __init__(
+        self,
+        size=1,
+        env=None,
+        preimports=DEFAULT_PREIMPORTS,
+        kernel_name="python3",
+        timeout=60,
+    ):
+        self.size = size
+        self.env = env
+        self.preimports = preimports
+        self.kernel_name = kernel_name
+        self.timeout = timeout
+        self.cold_starts = []
+        self._unreported = {}
+        self._idle = queue.Queue()
+        self._kernels = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(self._start_kernel())
+            self._started = True
+        # Make sure kernels are not left behind when a pool worker process exits
+        multiprocessing.util.Finalize(self, self.shutdown, exitpriority=10)
+
+    def _start_kernel(self):
+        km, startup = start_kernel(
+            env=self.env,
+            preimports=self.preimports,
+            kernel_name=self.kernel_name,
+            timeout=self.timeout,
+        )
+        self.cold_starts.append(startup)
+        self._unreported[km] = startup
+        self._kernels.append(km)
+        return km
+
+    def _replace(self, km):
+        with contextlib.suppress(Exception):
+            km.shutdown_kernel(now=True)
+        self._kernels.remove(km)
+        self._unreported.pop(km, None)
+        return self._start_kernel()
+
+    @contextlib.contextmanager
+    def kernel(self):
+        """
+        Check out a warm kernel. The reported startup cost is zero unless this is
+        the first use of the kernel or it had to be replaced after dying.
+        """
+        self.start()
+        km = self._idle.get()
+        if not km.is_alive():
+            km = self._replace(km)
+        startup = self._unreported.pop(km, {"launch": 0.0, "imports": 0.0})
+        try:
+            yield km, startup
+        finally:
+            try:
+                run_code(km, _RESET_CODE, self.timeout)
+            except Exception:
+                km = self._replace(km)
+            self._idle.put(km)
+
+    def shutdown(self):
+        for km in self._kernels:
+            with contextlib.suppress(Exception):
+                km.shutdown_kernel(now=True)
+        self._kernels = []
@@ -0,0 +1,103 @@
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), ".notebook-cache")
+REQUIREMENTS_FILE = os.path.join(os.path.dirname(__file__), "requirements.txt")
+
+
+class NotebookCache:
+    """
+    An on-disk record of notebooks that ran successfully, keyed by a hash of their
+    code cells, the run settings, the runner requirements and the Python version.
+
+    Entries are small JSON files. Reading an entry bumps its modification time, and
+    the least recently used entries are evicted once the cache grows past
+    `max_entries` files or `max_bytes` on disk. The directory is safe to share
+    between the runner's worker processes.
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_CACHE_DIR,
+        requirements_file=REQUIREMENTS_FILE,
+        max_entries=1024,
+        max_bytes=16 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        hasher = hashlib.sha256()
+        with contextlib.suppress(FileNotFoundError):
+            with open(requirements_file, "rb") as f:
+                hasher.update(f.read())
+        hasher.update(sys.version.encode())
+        self._environment_digest = hasher.digest()
+
+    def key(self, nb, context=None, volatile=()):
+        """
+        Hash the code cells of an already rewritten notebook. Markdown and outputs
+        are ignored since they cannot change whether the notebook runs. `context`
+        holds the run settings outside the cells that the outcome depends on, like
+        the stand-in mode and the environment set in the kernel, so a pass replayed
+        from cassettes never stands in for a live run. Strings in `volatile`, like
+        the stand-in server's URL with its random port, are hashed as a fixed
+        marker so they don't change the key from one run to the next.
+        """
+
+        def stable(text):
+            for value in volatile:
+                text = text.replace(value, "<volatile>")
+            return text.encode()
+
+        hasher = hashlib.sha256(self._environment_digest)
+        hasher.update(stable(json.dumps(context or {}, sort_keys=True)))
+        for cell in nb.cells:
+            if cell.cell_type == "code":
+                source = stable(cell.source)
+                hasher.update(len(source).to_bytes(8, "little"))
+                hasher.update(source)
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                record = json.load(f)
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return record
+
+    def put(self, key, record):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({**record, "cached_at": time.time()}, f)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (
+            len(entries) > self.max_entries or total_bytes > self.max_bytes
+        ):
+            _, size, path = entries.pop(0)
+            total_bytes -= size
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
@@ -0,0 +1,249 @@
+import csv
+import hashlib
+import json
+import os
+import time
+
+from kernel_pool import run_code
+
+# Installed once per kernel. IPython's pre/post_run_cell events time every cell and
+# read the kernel's current RSS before and after it, and the `send` methods of
+# requests and httpx are wrapped to count HTTP calls by destination. The lifetime
+# peak RSS is not used, as a pooled kernel carries it over from earlier notebooks.
+# State lives in a module so it survives `%reset`.
+# HTTP calls made by background threads, such as the LangSmith tracer flushing runs,
+# are counted towards whichever cell is running when they are sent.
+_INSTALL_CODE = r'''
+import sys as _sys
+if "_cookbook_profiler" not in _sys.modules:
+    def _install():
+        import functools, inspect, os, sys, time, types
+        from urllib.parse import urlsplit
+
+        state = types.ModuleType("_cookbook_profiler")
+        state.records = []
+        state.calls = {"langsmith": 0, "llm": 0, "other": 0}
+        state.cell = None
+        llm_hosts = {"api.openai.com", "api.anthropic.com"}
+
+        def rss_mb():
+            try:
+                with open("/proc/self/statm") as f:
+                    pages = int(f.read().split()[1])
+                return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+            except (OSError, ValueError):
+                pass
+            try:
+                import psutil
+            except ImportError:
+                return None
+            return psutil.Process().memory_info().rss / 2**20
+
+        def host(url):
+            return urlsplit(str(url)).hostname or ""
+
+        def count(request):
+            url = str(request.url)
+            llm_bases = [
+                os.environ[var]
+                for var in ("OPENAI_API_BASE", "ANTHROPIC_BASE_URL")
+                if os.environ.get(var)
+            ]
+            langsmith_base = os.environ.get("LANGCHAIN_ENDPOINT")
+            if host(url) in llm_hosts or any(url.startswith(b) for b in llm_bases):
+                state.calls["llm"] += 1
+            elif "smith.langchain" in host(url) or (
+                langsmith_base and url.startswith(langsmith_base)
+            ):
+                state.calls["langsmith"] += 1
+            else:
+                state.calls["other"] += 1
+
+        def patch(cls):
+            send = cls.send
+            if inspect.iscoroutinefunction(send):
+                @functools.wraps(send)
+                async def wrapped(self, request, *args, **kwargs):
+                    count(request)
+                    return await send(self, request, *args, **kwargs)
+            else:
+                @functools.wraps(send)
+                def wrapped(self, request, *args, **kwargs):
+                    count(request)
+                    return send(self, request, *args, **kwargs)
+            cls.send = wrapped
+
+        try:
+            import requests
+            patch(requests.Session)
+        except ImportError:
+            pass
+        try:
+            import httpx
+            patch(httpx.Client)
+            patch(httpx.AsyncClient)
+        except ImportError:
+            pass
+
+        def pre_run_cell(*args):
+            state.cell = (time.perf_counter(), dict(state.calls), rss_mb())
+
+        def post_run_cell(result):
+            if state.cell is None or result.execution_count is None:
+                return
+            started, calls, rss_before = state.cell
+            state.cell = None
+            rss_after = rss_mb()
+            state.records.append(
+                {
+                    "execution_count": result.execution_count,
+                    "seconds": time.perf_counter() - started,
+                    "rss_mb": rss_after,
+                    "rss_delta_mb": None
+                    if rss_after is None or rss_before is None
+                    else rss_after - rss_before,
+                    **{
+                        f"{kind}_calls": state.calls[kind] - calls[kind]
+                        for kind in state.calls
+                    },
+                }
+            )
+
+        ip = get_ipython()
+        ip.events.register("pre_run_cell", pre_run_cell)
+        ip.events.register("post_run_cell", post_run_cell)
+        sys.modules["_cookbook_profiler"] = state
+
+    _install()
+    del _install
+_sys.modules["_cookbook_profiler"].records.clear()
+del _sys
+'''
+
+_COLLECT_CODE = """
+import json as _json, sys as _sys
+print(_json.dumps(_sys.modules["_cookbook_profiler"].records))
+del _json, _sys
+"""
+
+CSV_FIELDS = [
+    "notebook",
+    "cell_index",
+    "cell_id",
+    "execution_count",
+    "seconds",
+    "rss_mb",
+    "rss_delta_mb",
+    "langsmith_calls",
+    "llm_calls",
+    "other_calls",
+    "first_line",
+]
+
+
+def begin(km):
+    """Install the profiler in a kernel if needed and clear previous records."""
+    run_code(km, _INSTALL_CODE)
+
+
+def collect(km, filename, nb_out):
+    """
+    Fetch the records for the last notebook from the kernel and match them to
+    the cells that produced them.
+    """
+    records = {
+        record["execution_count"]: record
+        for record in json.loads(run_code(km, _COLLECT_CODE))
+    }
+    cells = []
+    for index, cell in enumerate(nb_out.cells):
+        if cell.cell_type != "code" or cell.get("execution_count") not in records:
+            continue
+        record = records[cell.execution_count]
+        cells.append(
+            {
+                "notebook": filename,
+                "cell_index": index,
+                # Stable across edits to other cells, used to match baseline reports
+                "cell_id": hashlib.sha1(cell.source.encode()).hexdigest()[:12],
+                **record,
+                "first_line": cell.source.strip().split("\n", 1)[0][:80],
+            }
+        )
+    return cells
+
+
+def write_report(path, results):
+    """Write the full report as JSON and the per-cell rows as CSV next to it."""
+    report = {
+        "generated_at": time.time(),
+        "notebooks": [
+            {key: value for key, value in result.items() if key != "cells"}
+            for result in results
+        ],
+        "cells": [cell for result in results for cell in result.get("cells", [])],
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.splitext(path)[0] + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for cell in report["cells"]:
+            writer.writerow({field: cell.get(field) for field in CSV_FIELDS})
+    return report
+
+
+def print_slowest(report, top=10):
+    cells = sorted(report["cells"], key=lambda cell: cell["seconds"], reverse=True)
+    if not cells:
+        return
+    print(f"Top {min(top, len(cells))} slowest cells:")
+    for cell in cells[:top]:
+        delta = cell.get("rss_delta_mb")
+        memory = f"{delta:+7.0f}MB" if delta is not None else " " * 9
+        print(
+            f"  {cell['seconds']:8.1f}s  {memory}"
+            f"  {cell['langsmith_calls']:4d} langsmith  {cell['llm_calls']:4d} llm"
+            f"  {cell['notebook']}[{cell['cell_index']}] {cell['first_line']}"
+        )
+
+
+def find_regressions(report, baseline_path, threshold=0.25, min_seconds=1.0):
+    """
+    Compare a report with a previous one. Notebooks and cells count as regressed
+    when they got slower by more than `threshold` (relative) and `min_seconds`.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def _slower(current, previous):
+        return current - previous > max(min_seconds, previous * threshold)
+
+    regressions = []
+    previous_notebooks = {
+        notebook["notebook"]: notebook
+        for notebook in baseline["notebooks"]
+        if notebook["status"] == "passed"
+    }
+    for notebook in report["notebooks"]:
+        previous = previous_notebooks.get(notebook["notebook"])
+        if (
+            notebook["status"] == "passed"
+            and previous
+            and _slower(notebook["seconds"], previous["seconds"])
+        ):
+            regressions.append(
+                f"{notebook['notebook']}: {previous['seconds']:.1f}s ->"
+                f" {notebook['seconds']:.1f}s"
+            )
+    previous_cells = {
+        (cell["notebook"], cell["cell_id"]): cell for cell in baseline["cells"]
+    }
+    for cell in report["cells"]:
+        previous = previous_cells.get((cell["notebook"], cell["cell_id"]))
+        if previous and _slower(cell["seconds"], previous["seconds"]):
+            regressions.append(
+                f"{cell['notebook']}[{cell['cell_index']}] {cell['first_line']}:"
+                f" {previous['seconds']:.1f}s -> {cell['seconds']:.1f}s"
+            )
+    return regressions
@@ -0,0 +1,243 @@
+"""
+A local stand-in for LangSmith, the hub and the LLM providers used by the cookbooks.
+
+In "record" mode requests are proxied to the real services and the responses are
+saved to one cassette per notebook. In "replay" mode the responses are served from
+the cassettes, so notebooks run without network access and with deterministic
+results. Requests are routed by path:
+
+    /_nb/<cassette>/langsmith/...  -> LangSmith API
+    /_nb/<cassette>/hub/...        -> LangChain hub API
+    /_nb/<cassette>/openai/...     -> https://api.openai.com
+    /_nb/<cassette>/anthropic/...  -> https://api.anthropic.com
+
+Use `standin_env` to get the environment variables that point a notebook at it.
+"""
+import base64
+import collections
+import hashlib
+import http.server
+import json
+import os
+import re
+import threading
+import urllib.error
+import urllib.request
+
+DEFAULT_CASSETTE_DIR = os.path.join(os.path.dirname(__file__), "cassettes")
+
+UUID_REGEX = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE
+)
+TIMESTAMP_REGEX = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?"
+)
+
+# Trace ingestion is fire-and-forget from the notebook's point of view and depends on
+# client-generated run ids, so it is acknowledged in replay instead of recorded.
+INGEST_REGEX = re.compile(r"^(POST /runs(/batch|/multipart)?|PATCH /runs/\{uuid\})$")
+
+_HOP_BY_HOP_HEADERS = {
+    "connection",
+    "content-length",
+    "content-encoding",
+    "host",
+    "keep-alive",
+    "transfer-encoding",
+    "accept-encoding",
+}
+
+
+def _scrub(text):
+    return TIMESTAMP_REGEX.sub("{timestamp}", UUID_REGEX.sub("{uuid}", text))
+
+
+def cassette_name(notebook):
+    """A filesystem and URL safe cassette name for a notebook path."""
+    name = os.path.splitext(os.path.normpath(notebook))[0].lstrip("./")
+    return re.sub(r"[^A-Za-z0-9_.-]+", "__", name)
+
+
+class Cassette:
+    """
+    Recorded interactions for one notebook.
+
+    A cassette opened with `load=False` starts out empty, so recording a notebook
+    again replaces its old recording when it is saved instead of adding to it.
+
+    Each interaction is looked up by its scrubbed route (method plus path with ids
+    replaced) and a hash of its scrubbed body. If no interaction matches exactly,
+    the next unused interaction for the same route is served, in recorded order.
+    """
+
+    def __init__(self, path, load=True):
+        self.path = path
+        self.interactions = []
+        if load and os.path.exists(path):
+            with open(path) as f:
+                self.interactions = json.load(f)
+        self._unused = collections.defaultdict(collections.deque)
+        for index, interaction in enumerate(self.interactions):
+            self._unused[interaction["route"]].append(index)
+        self._lock = threading.Lock()
+
+    def record(self, route, body_hash, status, content_type, body):
+        try:
+            encoded = {"text": body.decode()}
+        except UnicodeDecodeError:
+            encoded = {"base64": base64.b64encode(body).decode()}
+        with self._lock:
+            self.interactions.append(
+                {
+                    "route": route,
+                    "body_hash": body_hash,
+                    "status": status,
+                    "content_type": content_type,
+                    **encoded,
+                }
+            )
+
+    def replay(self, route, body_hash):
+        with self._lock:
+            unused = self._unused[route]
+            if not unused:
+                return None
+            index = next(
+                (i for i in unused if self.interactions[i]["body_hash"] == body_hash),
+                unused[0],
+            )
+            unused.remove(index)
+        interaction = self.interactions[index]
+        if "base64" in interaction:
+            body = base64.b64decode(interaction["base64"])
+        else:
+            body = interaction["text"].encode()
+        return interaction["status"], interaction["content_type"], body
+
+    def save(self):
+        if not self.interactions:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(self.path, "w") as f:
+            json.dump(self.interactions, f, indent=1)
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, mode, upstreams, cassette_dir=DEFAULT_CASSETTE_DIR, port=0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown stand-in mode {mode!r}, use 'record' or 'replay'")
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.mode = mode
+        self.upstreams = upstreams
+        self.cassette_dir = cassette_dir
+        self._cassettes = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def cassette(self, name):
+        with self._lock:
+            if name not in self._cassettes:
+                self._cassettes[name] = Cassette(
+                    os.path.join(self.cassette_dir, f"{name}.json"),
+                    load=self.mode == "replay",
+                )
+            return self._cassettes[name]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.mode == "record":
+            for cassette in self._cassettes.values():
+                cassette.save()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        match = re.match(r"^/_nb/([^/]+)/([^/]+)(/.*)?$", self.path)
+        if not match or match.group(2) not in self.server.upstreams:
+            return self._send(404, "application/json", b'{"detail": "Unknown route"}')
+        name, service, rest = match.group(1), match.group(2), match.group(3) or "/"
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        path, _, query = rest.partition("?")
+        route = f"{self.command} {_scrub(path.rstrip('/') or '/')}"
+        if query:
+            route += "?" + _scrub("&".join(sorted(query.split("&"))))
+        body_hash = hashlib.sha256(_scrub(body.decode(errors="replace")).encode())
+        body_hash = body_hash.hexdigest()[:16]
+        is_ingest = service == "langsmith" and INGEST_REGEX.match(route)
+        cassette = self.server.cassette(name)
+
+        if self.server.mode == "replay":
+            recorded = None if is_ingest else cassette.replay(route, body_hash)
+            if recorded is not None:
+                return self._send(*recorded)
+            if is_ingest:
+                return self._send(202, "application/json", b"{}")
+            detail = json.dumps({"detail": f"No recorded response for {route} in {name}"})
+            return self._send(404, "application/json", detail.encode())
+
+        status, content_type, response = self._forward(service, rest, body)
+        if not is_ingest:
+            cassette.record(route, body_hash, status, content_type, response)
+        self._send(status, content_type, response)
+
+    def _forward(self, service, rest, body):
+        url = self.server.upstreams[service].rstrip("/") + rest
+        headers = {
+            key: value
+            for key, value in self.headers.items()
+            if key.lower() not in _HOP_BY_HOP_HEADERS
+        }
+        request = urllib.request.Request(
+            url, data=body or None, headers=headers, method=self.command
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                return (
+                    response.status,
+                    response.headers.get("Content-Type", ""),
+                    response.read(),
+                )
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get("Content-Type", ""), e.read()
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _handle
+
+
+def standin_env(server_url, notebook):
+    """Environment variables pointing a notebook's clients at the stand-in."""
+    base = f"{server_url}/_nb/{cassette_name(notebook)}"
+    return {
+        "LANGCHAIN_ENDPOINT": f"{base}/langsmith",
+        "LANGSMITH_ENDPOINT": f"{base}/langsmith",
+        "LANGCHAIN_HUB_API_URL": f"{base}/hub",
+        "OPENAI_API_BASE": f"{base}/openai/v1",
+        "OPENAI_BASE_URL": f"{base}/openai/v1",
+        "ANTHROPIC_API_URL": f"{base}/anthropic",
+        "ANTHROPIC_BASE_URL": f"{base}/anthropic",
+    }
@@ -1,14 +1,25 @@
 import argparse
+import concurrent.futures
 import contextlib
+import copy
 import os
 import glob
+import random
 import re
+import sys
 import time
 
 import nbformat
-from nbconvert.preprocessors import ExecutePreprocessor
+from nbclient import NotebookClient
+from nbclient.exceptions import CellExecutionError, CellTimeoutError
 from langsmith import Client
 
+from cell_rewriter import build_cookbook_rewriter
+from kernel_pool import KernelPool, fresh_kernel, set_kernel_env
+from notebook_cache import DEFAULT_CACHE_DIR, NotebookCache
+import profiling
+from standin_server import DEFAULT_CASSETTE_DIR, StandInServer, standin_env
+
 filter_list = {
     "llm_run_etl.ipynb",
     "lilac.ipynb",
@@ -19,88 +30,108 @@ filter_list = {
     "multimodal.ipynb",
     "tool-selection.ipynb",
 }
-API_KEY_REGEX = r'os\.environ\["LANGCHAIN_API_KEY"\] = [\"\']([^\"\']+)["\']'
-HUB_API_KEY_REGEX = r'os\.environ\["LANGCHAIN_HUB_API_KEY"\] = [\"\']([^\"\']+)["\']'
-ENDPOINT_REGEX = r'os\.environ\["LANGCHAIN_ENDPOINT"\] = [\"\']([^\"\']+)["\']'
-HUB_API_URL_REGEX = r'os\.environ\["LANGCHAIN_HUB_API_URL"\] = [\"\']([^\"\']+)["\']'
-PROJECT_ENV_REGEX = r'os\.environ\["LANGCHAIN_PROJECT"\] = [\"\']([^\"\']+)["\']'
-PROJECT_NAME_REGEX = r"YOUR PROJECT NAME"
-HUB_HANDLE_REGEX = r"YOUR HUB HANDLE"
-OPENAI_API_KEY_REGEX = r'os\.environ\["OPENAI_API_KEY"\] = [\"\']([^\"\']+)["\']'
+MAX_RETRIES = 4
+# Status codes only count next to something that says they are HTTP statuses, so a
+# `KeyError: 500` is still treated as a bug in the notebook
+TRANSIENT_ERROR_REGEX = re.compile(
+    r"(?:(?i:status)(?:[ _]code)?|HTTP(?:/[\d.]+)?|Error code)[:=]?\s*"
+    r"(?:429|50[0234])\b"
+    r"|\b(?:429|50[0234]) (?:Client Error|Server Error|Too Many Requests|Bad Gateway"
+    r"|Service Unavailable|Gateway Timeout|Internal Server Error)"
+    r"|Too Many Requests|RateLimit|Timeout|ConnectionError"
+    r"|APIConnectionError|InternalServerError|ServiceUnavailable"
+)
 
 
-def _run_notebook(
-    filename,
-    api_key,
-    endpoint,
-    project,
-    hub_api_key,
-    hub_api_url,
-    hub_handle,
-    openai_api_key,
-):
+def _load_notebook(filename, rewriter):
     """
-    Execute a notebook via nbconvert and collect output. Also replace important env variables
+    Read a notebook and replace important env variables in its code cells
     """
     with open(filename) as ff:
         nb_in = nbformat.read(ff, nbformat.NO_CONVERT)
     for cell in nb_in.cells:
         if cell.cell_type == "code":
-            if re.search(API_KEY_REGEX, cell.source):
-                cell.source = re.sub(
-                    API_KEY_REGEX,
-                    f"os.environ[\"LANGCHAIN_API_KEY\"] = '{api_key}'",
-                    cell.source,
-                )
-            if re.search(ENDPOINT_REGEX, cell.source):
-                cell.source = re.sub(
-                    ENDPOINT_REGEX,
-                    f'os.environ["LANGCHAIN_ENDPOINT"] = "{endpoint}"',
-                    cell.source,
-                )
-            if re.search(PROJECT_ENV_REGEX, cell.source):
-                cell.source = re.sub(
-                    PROJECT_ENV_REGEX,
-                    f"os.environ[\"LANGCHAIN_PROJECT\"] = '{project}'",
-                    cell.source,
-                )
-            if re.search(PROJECT_NAME_REGEX, cell.source):
-                cell.source = re.sub(PROJECT_NAME_REGEX, project, cell.source)
-            if re.search(HUB_API_KEY_REGEX, cell.source):
-                cell.source = re.sub(
-                    HUB_API_KEY_REGEX,
-                    f"os.environ[\"LANGCHAIN_HUB_API_KEY\"] = '{hub_api_key}'",
-                    cell.source,
-                )
-            if re.search(HUB_API_URL_REGEX, cell.source):
-                cell.source = re.sub(
-                    HUB_API_URL_REGEX,
-                    f"os.environ[\"LANGCHAIN_HUB_API_URL\"] = '{hub_api_url}'",
-                    cell.source,
-                )
-            if re.search(HUB_HANDLE_REGEX, cell.source):
-                cell.source = re.sub(HUB_HANDLE_REGEX, hub_handle, cell.source)
-            if re.search(OPENAI_API_KEY_REGEX, cell.source):
-                cell.source = re.sub(
-                    OPENAI_API_KEY_REGEX,
-                    f"os.environ[\"OPENAI_API_KEY\"] = '{openai_api_key}'",
-                    cell.source,
-                )
+            cell.source = rewriter.rewrite(cell.source)
+    return nb_in
+
+
+def _is_transient(error):
+    """
+    Whether a cell failure looks like a rate limit, server error or timeout that is
+    worth retrying, as opposed to a bug in the notebook.
+    """
+    if isinstance(error, CellTimeoutError):
+        return True
+    return bool(
+        TRANSIENT_ERROR_REGEX.search(
+            f"{getattr(error, 'ename', '')}: {getattr(error, 'evalue', '')}"
+        )
+    )
+
+
+def _backoff(retry):
+    """
+    Roughly 1, 2, 4, 8 seconds, jittered so parallel workers hitting the same rate
+    limit don't all retry at once.
+    """
+    return random.uniform(0.5, 1.0) * 2 ** (retry + 1)
+
+
+def _run_notebook(
+    filename, nb_in, kernels=fresh_kernel, profile=False, kernel_env=None
+):
+    """
+    Execute a notebook cell by cell and collect output, along with per-cell
+    timings, memory use and HTTP call counts when `profile` is set.
+    `kernel_env` is set in the kernel before the first cell runs.
 
-    ep = ExecutePreprocessor(timeout=1000, allow_errors=False)
-    backoff = 1
-    while backoff < 10:
+    A cell failing with a transient error is retried on the same kernel, so the
+    cells before it are not executed again. Any other cell error fails the
+    notebook immediately. If the kernel itself dies, the notebook starts over on a
+    new kernel.
+
+    `kernels` is a context manager factory yielding a started kernel manager for each attempt.
+    """
+    retries = 0
+    while True:
         try:
-            nb_out = ep.preprocess(nb_in)
-            return nb_out
-        except Exception as e:
+            with kernels() as km:
+                if kernel_env:
+                    set_kernel_env(km, kernel_env)
+                if profile:
+                    profiling.begin(km)
+                client = NotebookClient(nb_in, timeout=1000, allow_errors=False, km=km)
+                with client.setup_kernel():
+                    index = 0
+                    while index < len(nb_in.cells):
+                        try:
+                            client.execute_cell(nb_in.cells[index], index)
+                        except (CellExecutionError, CellTimeoutError) as e:
+                            if retries >= MAX_RETRIES or not _is_transient(e):
+                                raise
+                            if isinstance(e, CellTimeoutError):
+                                km.interrupt_kernel()
+                            delay = _backoff(retries)
+                            retries += 1
+                            print(
+                                f"Transient failure in cell {index} of {filename}: {e!r}."
+                                f" Resuming from that cell in {delay:.1f} seconds"
+                            )
+                            time.sleep(delay)
+                            continue
+                        index += 1
+                cells = profiling.collect(km, filename, nb_in) if profile else []
+            return nb_in, cells
+        except RuntimeError as e:
+            # The kernel died or could not be started, nothing left to resume
+            if retries >= MAX_RETRIES:
+                raise
+            delay = _backoff(retries)
+            retries += 1
             print(
-                f"Failed to run notebook {filename} with error {e}. Retrying in {backoff} seconds"
+                f"Failed to run notebook {filename} with error {e}. Restarting in {delay:.1f} seconds"
             )
-            time.sleep(backoff)
-            backoff *= 2
-            if backoff >= 10:
-                raise
+            time.sleep(delay)
 
 
 @contextlib.contextmanager
@@ -118,6 +149,106 @@ def set_env(**environ):
         os.environ.update(old_environ)
 
 
+# One pool per process: with --jobs every worker process keeps its own warm kernel.
+_KERNEL_POOL = None
+
+
+def _get_kernel_pool(env):
+    global _KERNEL_POOL
+    if _KERNEL_POOL is None:
+        _KERNEL_POOL = KernelPool(size=1, env=env)
+    return _KERNEL_POOL
+
+
+def _run_notebook_job(
+    filename,
+    env,
+    rewriter,
+    warm_kernels=False,
+    cache_dir=None,
+    profile=False,
+    standin_url=None,
+    standin_mode=None,
+):
+    """
+    Run a single notebook with its own kernel and environment, capturing the outcome
+    instead of raising so results can be reported as they finish. Notebooks that
+    already passed with identical code cells, run settings and requirements are
+    skipped.
+
+    With `standin_url` every LangSmith, hub and LLM client in the notebook is pointed
+    at that notebook's cassette on the local stand-in server.
+    """
+    kernel_env = None
+    if standin_url:
+        kernel_env = standin_env(standin_url, filename)
+        rewriter = (
+            copy.deepcopy(rewriter)
+            .register_env(
+                "LANGCHAIN_ENDPOINT", kernel_env["LANGCHAIN_ENDPOINT"], quote='"'
+            )
+            .register_env("LANGCHAIN_HUB_API_URL", kernel_env["LANGCHAIN_HUB_API_URL"])
+        )
+    start = time.perf_counter()
+    kernel_startup = []
+    kernel_factory = _get_kernel_pool(env).kernel if warm_kernels else fresh_kernel
+
+    @contextlib.contextmanager
+    def kernels():
+        with kernel_factory() as (km, startup):
+            kernel_startup.append(startup["launch"] + startup["imports"])
+            yield km
+
+    result = {"notebook": filename, "status": "passed", "error": None}
+    try:
+        nb_in = _load_notebook(filename, rewriter)
+        cache = NotebookCache(cache_dir) if cache_dir else None
+        cache_key = (
+            cache.key(
+                nb_in,
+                {"env": env, "standin": standin_mode, "kernel_env": kernel_env},
+                # The stand-in listens on a new port every run
+                volatile=(standin_url,) if standin_url else (),
+            )
+            if cache
+            else None
+        )
+        cached = cache.get(cache_key) if cache else None
+        if cached:
+            result.update(status="cached", cached_seconds=cached["seconds"])
+        else:
+            with set_env(**env):
+                _, result["cells"] = _run_notebook(
+                    filename,
+                    nb_in,
+                    kernels=kernels,
+                    profile=profile,
+                    kernel_env=kernel_env,
+                )
+    except Exception as e:
+        result.update(status="failed", error=repr(e))
+    result["seconds"] = time.perf_counter() - start
+    result["kernel_startup"] = sum(kernel_startup)
+    if cache and result["status"] == "passed":
+        cache.put(cache_key, {"notebook": filename, "seconds": result["seconds"]})
+    return result
+
+
+def _print_result(result):
+    if result["status"] == "cached":
+        print(
+            f"[SKIPPED] {result['notebook']} (unchanged since a passing run that took"
+            f" {result['cached_seconds']:.1f}s)"
+        )
+        return
+    print(
+        f"[{result['status'].upper()}] {result['notebook']} ({result['seconds']:.1f}s,"
+        f" kernel startup {result['kernel_startup']:.1f}s)"
+    )
+    if result["error"]:
+        print(f"    {result['error']}")
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-e",
@@ -140,10 +271,70 @@ parser.add_argument(
     help="Project to use for your notebook",
     default="default",
 )
-parser.add_argument("-a", "--api-key", help="API key to use")
+parser.add_argument(
+    "-a", "--api-key", help="API key to use, optional with --standin replay"
+)
 parser.add_argument("-ha", "--hub-api-key", help="Hub API key to use", default="")
 parser.add_argument("-n", "--notebook", help="Notebook to run", default="*")
 parser.add_argument("-hh", "--hub-handle", help="Hub handle", default="")
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    help="Number of notebooks to run in parallel, each in its own worker process",
+    default=1,
+)
+parser.add_argument(
+    "-w",
+    "--warm-kernels",
+    action="store_true",
+    help="Reuse pre-started kernels with common modules already imported across notebooks",
+)
+parser.add_argument(
+    "--cache-dir",
+    help="Directory for the record of notebooks that already passed",
+    default=DEFAULT_CACHE_DIR,
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Run every notebook even if it is unchanged since a passing run",
+)
+parser.add_argument(
+    "--placeholder",
+    action="append",
+    default=[],
+    metavar="PLACEHOLDER=VALUE",
+    help="Extra placeholder text to replace in code cells, may be repeated",
+)
+parser.add_argument(
+    "--report",
+    help="Write per-cell timings, memory use and HTTP call counts to this JSON file"
+    " (and a CSV next to it)",
+)
+parser.add_argument(
+    "--top", type=int, default=10, help="Number of slowest cells to list in the summary"
+)
+parser.add_argument(
+    "--baseline", help="A previous --report to compare against for regressions"
+)
+parser.add_argument(
+    "--regression-threshold",
+    type=float,
+    default=0.25,
+    help="Relative slowdown over the baseline that counts as a regression",
+)
+parser.add_argument(
+    "--standin",
+    choices=["record", "replay"],
+    help="Route LangSmith, hub and LLM traffic through a local stand-in server that"
+    " records responses to cassettes or replays them without network access",
+)
+parser.add_argument(
+    "--cassette-dir",
+    help="Directory holding the stand-in server's per-notebook cassettes",
+    default=DEFAULT_CASSETTE_DIR,
+)
 parser.add_argument(
     "-oai",
     "--openai-api-key",
@@ -151,31 +342,117 @@ parser.add_argument(
     default=os.environ.get("OPENAI_API_KEY", ""),
 )
 
-new_env = {"LANGCHAIN_TRACING_V2": "true"}
-args = parser.parse_args()
-if not args.api_key:
-    raise Exception("No API key provided")
 
-client = Client(api_url=args.endpoint, api_key=args.api_key)
-# Create project if not found
-try:
-    client.read_project(project_name=args.project)
-except Exception as e:
-    client.create_project(args.project)
+def main():
+    args = parser.parse_args()
+    # Replayed runs are answered from cassettes, which never check the key
+    if not args.api_key and args.standin != "replay":
+        raise Exception("No API key provided")
+
+    standin = None
+    if args.standin:
+        standin = StandInServer(
+            args.standin,
+            upstreams={
+                "langsmith": args.endpoint,
+                "hub": args.hub_endpoint,
+                "openai": "https://api.openai.com",
+                "anthropic": "https://api.anthropic.com",
+            },
+            cassette_dir=args.cassette_dir,
+        ).start()
+        print(f"Serving {args.standin}ed responses from {standin.url}")
 
-with set_env(**new_env):
+    # Replayed runs never reach LangSmith, so there is no project to create
+    if args.standin != "replay":
+        client = Client(api_url=args.endpoint, api_key=args.api_key)
+        # Create project if not found
+        try:
+            client.read_project(project_name=args.project)
+        except Exception as e:
+            client.create_project(args.project)
+
+    new_env = {"LANGCHAIN_TRACING_V2": "true"}
+    # Clients refuse to start without a key, so replays get a dummy one
+    api_key = args.api_key or "standin-replay"
+    rewriter = build_cookbook_rewriter(
+        api_key=api_key,
+        endpoint=args.endpoint,
+        project=args.project,
+        hub_api_key=api_key,
+        hub_api_url=args.hub_endpoint,
+        hub_handle=args.hub_handle,
+        openai_api_key=args.openai_api_key,
+        placeholders=dict(p.split("=", 1) for p in args.placeholder),
+    )
+    notebooks = []
     for file in glob.glob(f"../**/{args.notebook}.ipynb", recursive=True):
         if file.split("/")[-1] in filter_list:
             print(f"Skipping {file}")
             continue
-        print(f"Running notebook {file}")
-        output = _run_notebook(
-            file,
-            args.api_key,
-            args.endpoint,
-            args.project,
-            args.api_key,
-            args.hub_endpoint,
-            args.hub_handle,
-            args.openai_api_key,
-        )
+        notebooks.append(file)
+
+    job_kwargs = {
+        "env": new_env,
+        "rewriter": rewriter,
+        "warm_kernels": args.warm_kernels,
+        "cache_dir": None if args.no_cache else args.cache_dir,
+        "profile": bool(args.report),
+        "standin_url": standin.url if standin else None,
+        "standin_mode": args.standin,
+    }
+    start = time.perf_counter()
+    results = []
+    # Cassettes recorded before a failure are still saved
+    try:
+        if args.jobs <= 1:
+            for file in notebooks:
+                print(f"Running notebook {file}")
+                result = _run_notebook_job(file, **job_kwargs)
+                _print_result(result)
+                results.append(result)
+        else:
+            # Each worker process gets its own kernel and its own copy of os.environ,
+            # so set_env in one worker can never leak into a notebook running in
+            # another.
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                futures = {
+                    pool.submit(_run_notebook_job, file, **job_kwargs): file
+                    for file in notebooks
+                }
+                print(f"Running {len(futures)} notebooks with {args.jobs} workers")
+                for future in concurrent.futures.as_completed(futures):
+                    result = future.result()
+                    _print_result(result)
+                    results.append(result)
+    finally:
+        if standin:
+            standin.stop()
+
+    failed = [result for result in results if result["status"] == "failed"]
+    cached = [result for result in results if result["status"] == "cached"]
+    print(
+        f"Ran {len(results)} notebooks in {time.perf_counter() - start:.1f}s:"
+        f" {len(results) - len(failed) - len(cached)} passed, {len(failed)} failed,"
+        f" {len(cached)} skipped as unchanged"
+    )
+    print(
+        "Time spent starting kernels:"
+        f" {sum(result['kernel_startup'] for result in results):.1f}s"
+    )
+    if args.report:
+        report = profiling.write_report(args.report, results)
+        profiling.print_slowest(report, args.top)
+        if args.baseline:
+            regressions = profiling.find_regressions(
+                report, args.baseline, threshold=args.regression_threshold
+            )
+            print(f"{len(regressions)} regressions against {args.baseline}")
+            for regression in regressions:
+                print(f"  {regression}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
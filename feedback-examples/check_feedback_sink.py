@@ -0,0 +1,127 @@
+"""
+Check offline that FeedbackSink keeps one feedback per run and key when the same
+feedback is submitted again while its first send is still on its way, with a fake
+client whose requests take `--latency` seconds.
+
+    python check_feedback_sink.py --latency 0.3
+
+Covers a resubmission during a create that succeeds, during one that fails, and
+after the sink gave up on the feedback.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from langsmith.utils import LangSmithConflictError, LangSmithConnectionError
+
+from feedback_sink import FeedbackSink
+
+
+class FakeClient:
+    """Stores feedback by id like LangSmith, and can fail the next creates."""
+
+    def __init__(self, latency: float, fail: int = 0):
+        self.latency = latency
+        self.fail = fail
+        self.feedback = {}
+        self.creates = 0
+        self.updates = 0
+        self.sending = threading.Event()
+        self._lock = threading.Lock()
+
+    def create_feedback(self, run_id, key, feedback_id=None, **kwargs):
+        self.sending.set()
+        time.sleep(self.latency)
+        with self._lock:
+            self.creates += 1
+            if self.fail:
+                self.fail -= 1
+                raise LangSmithConnectionError("connection reset")
+            if feedback_id in self.feedback:
+                raise LangSmithConflictError(f"feedback {feedback_id} exists")
+            self.feedback[feedback_id] = {"run_id": run_id, "key": key, **kwargs}
+
+    def update_feedback(self, feedback_id, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            self.updates += 1
+            if feedback_id not in self.feedback:
+                raise ValueError(f"feedback {feedback_id} does not exist")
+            self.feedback[feedback_id].update(
+                {k: v for k, v in kwargs.items() if v is not None}
+            )
+
+
+def _resubmit_while_sending(latency: float, fail: int) -> FakeClient:
+    client = FakeClient(latency, fail=fail)
+    sink = FeedbackSink(client, batch_size=1, flush_interval=0.05, max_retries=3)
+    run_id = uuid.uuid4()
+    first = sink.submit(run_id, "thumbs", score=0, comment="first")
+    assert client.sending.wait(5), "the first submission was never sent"
+    second = sink.submit(run_id, "thumbs", score=1)
+    assert second == first, "a resubmission mid-send must reuse the feedback id"
+    # Retries back off for a couple of seconds
+    assert sink.flush(10), "the sink did not drain"
+    sink.close()
+    assert list(client.feedback) == [first], client.feedback
+    stored = client.feedback[first]
+    assert stored["score"] == 1 and stored["comment"] == "first", stored
+    return client
+
+
+def _resubmit_after_giving_up(latency: float) -> FakeClient:
+    client = FakeClient(latency, fail=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = os.path.join(tmp, "journal.jsonl")
+        sink = FeedbackSink(
+            client,
+            journal_path=journal,
+            batch_size=1,
+            flush_interval=0.05,
+            max_retries=1,
+            compact_every=2,
+        )
+        run_id = uuid.uuid4()
+        first = sink.submit(run_id, "thumbs", score=0, comment="first")
+        assert sink.flush(10), "the sink did not drain"
+        assert sink.stats()["failed"] == 1, sink.stats()
+        second = sink.submit(run_id, "thumbs", score=1)
+        assert second == first, "a resubmission must take over the failed feedback"
+        assert sink.flush(10), "the sink did not drain"
+        sink.close()
+        with open(journal) as f:
+            assert [json.loads(line) for line in f] == [], "the journal was not compacted"
+    assert list(client.feedback) == [first], client.feedback
+    stored = client.feedback[first]
+    assert stored["score"] == 1 and stored["comment"] == "first", stored
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    client = _resubmit_while_sending(args.latency, fail=0)
+    print(
+        f"resubmit during a create:        1 feedback,"
+        f" {client.creates} creates, {client.updates} updates"
+    )
+    client = _resubmit_while_sending(args.latency, fail=1)
+    print(
+        f"resubmit during a failed create: 1 feedback,"
+        f" {client.creates} creates, {client.updates} updates"
+    )
+    client = _resubmit_after_giving_up(args.latency)
+    print(
+        f"resubmit after giving up:        1 feedback,"
+        f" {client.creates} creates, {client.updates} updates"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Send user feedback to LangSmith in the background.
+
+Calling `client.create_feedback` inside a Streamlit rerun makes the page wait on an
+HTTP request. `FeedbackSink.submit` returns immediately instead: feedback is queued
+and a background thread sends it. The sink is shared by the Streamlit feedback
+examples, create it once per server process:
+
+    @st.cache_resource
+    def get_feedback_sink():
+        return FeedbackSink(Client(), journal_path=".feedback-journal.jsonl")
+
+    feedback_id = get_feedback_sink().submit(run_id, "thumbs", score=1)
+
+- Repeated submissions for the same run and key are merged into one, keeping the
+  latest score, value and comment. Once sent, later submissions update it. A
+  submission that arrives while the feedback is being sent reuses its id, and is
+  sent as an update once that send went through.
+- The queue is sent once `batch_size` items are waiting, or every `flush_interval`
+  seconds. Failed sends are retried with exponential backoff.
+- Every change is appended to the journal before it is queued, so feedback that was
+  not sent yet is sent after a restart. The journal is rewritten with only the
+  unsent feedback every `compact_every` entries.
+- Feedback that ran out of retries waits in the journal for the next start. A new
+  submission for the same run and key replaces it under the same id.
+"""
+import atexit
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from langsmith import Client
+from langsmith.utils import LangSmithConflictError
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = ("score", "value", "comment", "correction")
+
+
+class FeedbackSink:
+    """
+    Queues feedback and sends it with `client` from a background thread.
+
+    Parameters
+    ----------
+    client : Client
+        The LangSmith client to send feedback with.
+    journal_path : str, optional
+        Where to keep unsent feedback across restarts. Nothing is kept by default.
+    batch_size : int
+        Send as soon as this many items are waiting.
+    flush_interval : float
+        Otherwise, send what is waiting every this many seconds.
+    max_retries : int
+        Attempts per item before it is left in the journal for the next start.
+    concurrency : int
+        Requests sent in parallel per batch.
+    compact_every : int
+        Rewrite the journal after this many appended entries.
+    """
+
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        journal_path: Optional[str] = None,
+        batch_size: int = 20,
+        flush_interval: float = 2.0,
+        max_retries: int = 5,
+        concurrency: int = 4,
+        compact_every: int = 1000,
+    ):
+        self.client = client or Client()
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.compact_every = compact_every
+        self._journaled = 0
+        # (run_id, key) -> the merged feedback waiting to be sent
+        self._pending: "collections.OrderedDict[Tuple[str, str], dict]" = (
+            collections.OrderedDict()
+        )
+        # (run_id, key) -> feedback id, for feedback that was already created
+        self._created: "collections.OrderedDict[Tuple[str, str], str]" = (
+            collections.OrderedDict()
+        )
+        # (run_id, key) -> the feedback being sent right now
+        self._sending: Dict[Tuple[str, str], dict] = {}
+        # (run_id, key) -> feedback that ran out of retries, kept for the next start
+        self._failed: Dict[Tuple[str, str], dict] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._counts = collections.Counter()
+        self._executor = ThreadPoolExecutor(concurrency, "feedback-sink")
+        self._replay()
+        self._thread = threading.Thread(
+            target=self._run, name="feedback-sink", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _journal(self, entry: dict):
+        if self.journal_path is None:
+            return
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+        self._journaled += 1
+
+    def _replay(self):
+        """Queue the feedback a previous process journaled but did not send."""
+        if self.journal_path is None or not os.path.exists(self.journal_path):
+            return
+        pending: Dict[str, dict] = {}
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A write cut short by a crash
+                    continue
+                if entry["op"] == "put":
+                    pending[entry["item"]["feedback_id"]] = entry["item"]
+                else:
+                    pending.pop(entry["feedback_id"], None)
+        for item in pending.values():
+            self._pending[(item["run_id"], item["key"])] = {**item, "attempts": 0}
+        self._compact()
+        if pending:
+            logger.info(f"Resending {len(pending)} feedback items from the journal")
+
+    def _compact(self):
+        """Rewrite the journal with only the pending items."""
+        if self.journal_path is None:
+            return
+        tmp = f"{self.journal_path}.tmp"
+        with open(tmp, "w") as f:
+            items = [
+                *self._pending.values(),
+                *self._sending.values(),
+                *self._failed.values(),
+            ]
+            for item in items:
+                f.write(json.dumps({"op": "put", "item": _journaled(item)}) + "\n")
+        os.replace(tmp, self.journal_path)
+        self._journaled = len(items)
+
+    def submit(self, run_id: Any, key: str, **feedback: Any) -> str:
+        """
+        Queue feedback with any of `score`, `value`, `comment` and `correction`.
+        Returns the id the feedback will be stored under.
+        """
+        unknown = set(feedback) - set(_FIELDS)
+        if unknown:
+            raise TypeError(f"Unexpected feedback fields: {sorted(unknown)}")
+        slot = (str(run_id), key)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The feedback sink is closed")
+            item = self._pending.get(slot)
+            failed = self._failed.pop(slot, None) if item is None else None
+            if failed is not None:
+                # Takes over the feedback that ran out of retries, under its id, so
+                # it is not sent twice after a restart
+                item = {**failed, "attempts": 0}
+                item.pop("retry_at", None)
+                self._pending[slot] = item
+            elif item is None:
+                # While a send is on its way, keep its id: if it creates the
+                # feedback, _finish turns this item into an update of it
+                sending = self._sending.get(slot)
+                feedback_id = (
+                    self._created.get(slot)
+                    or (sending and sending["feedback_id"])
+                    or str(uuid.uuid4())
+                )
+                item = {
+                    "run_id": slot[0],
+                    "key": key,
+                    "feedback_id": feedback_id,
+                    "created": slot in self._created,
+                    "attempts": 0,
+                }
+                self._pending[slot] = item
+            else:
+                self._counts["merged"] += 1
+            item.update({k: v for k, v in feedback.items() if v is not None})
+            item["submitted_at"] = time.time()
+            self._counts["submitted"] += 1
+            self._journal({"op": "put", "item": _journaled(item)})
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+            return item["feedback_id"]
+
+    def _send(self, item: dict):
+        kwargs = {field: item.get(field) for field in _FIELDS}
+        if item["created"]:
+            self.client.update_feedback(item["feedback_id"], **kwargs)
+            return
+        try:
+            self.client.create_feedback(
+                item["run_id"], item["key"], feedback_id=item["feedback_id"], **kwargs
+            )
+        except LangSmithConflictError:
+            # Created by an earlier attempt whose response never arrived
+            self.client.update_feedback(item["feedback_id"], **kwargs)
+
+    def _due(self) -> list:
+        now = time.monotonic()
+        return [
+            item
+            for item in self._pending.values()
+            if item.get("retry_at", 0) <= now
+        ]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._due()) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._due()[: self.batch_size]
+                for item in batch:
+                    slot = (item["run_id"], item["key"])
+                    del self._pending[slot]
+                    self._sending[slot] = item
+                closed = self._closed
+            if batch:
+                results = list(self._executor.map(self._try_send, batch))
+                self._finish(batch, results)
+            if closed and not batch:
+                return
+
+    def _try_send(self, item: dict) -> Optional[Exception]:
+        try:
+            self._send(item)
+            return None
+        except Exception as e:
+            return e
+
+    def _finish(self, batch: list, errors: list):
+        with self._cond:
+            for item, error in zip(batch, errors):
+                slot = (item["run_id"], item["key"])
+                del self._sending[slot]
+                if error is None:
+                    self._counts["sent"] += 1
+                    self._created[slot] = item["feedback_id"]
+                    while len(self._created) > 10_000:
+                        self._created.popitem(last=False)
+                    if slot in self._pending:
+                        # Changed again while sending, the next send is an update
+                        self._pending[slot]["created"] = True
+                    else:
+                        self._journal({"op": "done", "feedback_id": item["feedback_id"]})
+                    continue
+                newer = self._pending.get(slot)
+                if newer is not None:
+                    # Resubmitted while sending, under the same id: the newer
+                    # submission wins and is retried in place of this one
+                    for field in _FIELDS:
+                        if newer.get(field) is None and item.get(field) is not None:
+                            newer[field] = item[field]
+                    self._journal({"op": "put", "item": _journaled(newer)})
+                    continue
+                item["attempts"] += 1
+                if item["attempts"] >= self.max_retries or self._closed:
+                    self._counts["failed"] += 1
+                    self._failed[slot] = item
+                    logger.warning(
+                        f"Giving up on feedback {item['feedback_id']} for now,"
+                        f" it stays in the journal: {error!r}"
+                    )
+                    continue
+                self._counts["retried"] += 1
+                item["retry_at"] = time.monotonic() + min(60, 2 ** item["attempts"])
+                self._pending[slot] = item
+            if self._journaled >= self.compact_every:
+                self._compact()
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Send everything waiting now. Returns False if it did not finish in time."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            for item in self._pending.values():
+                item.pop("retry_at", None)
+            self._cond.notify_all()
+            while self._pending or self._sending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "sending": len(self._sending),
+                "submitted": self._counts["submitted"],
+                "merged": self._counts["merged"],
+                "sent": self._counts["sent"],
+                "retried": self._counts["retried"],
+                "failed": self._counts["failed"],
+                "journal": self.journal_path,
+            }
+
+    def close(self, timeout: float = 10.0):
+        """Try to send what is waiting, then stop. Unsent feedback stays journaled."""
+        with self._cond:
+            if self._closed:
+                return
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        with self._cond:
+            if not self._sending:
+                self._compact()
+
+
+def _journaled(item: dict) -> dict:
+    return {k: v for k, v in item.items() if k not in ("attempts", "retry_at")}
@@ -0,0 +1,181 @@
+"""
+Build chat models and chains once per process instead of on every Streamlit rerun.
+
+Streamlit re-executes the app script on every interaction. A chat model created in
+the script therefore comes with a fresh API client each time, and every first
+request pays for a new connection and TLS handshake. `REGISTRY` lives in this
+imported module, so it survives reruns and is shared by all sessions:
+
+    llm = REGISTRY.chat_model(ChatOpenAI, temperature=0.7)
+    chain = REGISTRY.get(
+        "rag_chain",
+        {"model": "claude-instant-1.2", "system_prompt": SYSTEM_PROMPT},
+        lambda: build_chain(SYSTEM_PROMPT),
+    )
+
+Objects are keyed by a name plus a hash of their configuration, and the least
+recently used are dropped beyond `max_entries`. A cached object is shared by all
+sessions, so it must not hold per-session state: a chain that captures a
+`StreamlitChatMessageHistory` should be built per rerun, from cached models.
+
+Chat models that take separate sync and async clients (`http_client` and
+`http_async_client`) get one keep-alive httpx client for their sync calls, shared
+by all of them. Older integrations use `http_client` for their async client too, so
+they are left to build their own. The async client is never shared: an
+`httpx.AsyncClient` is bound to the event loop it first ran on, and each
+`asyncio.run` starts a new one. `REGISTRY.stats()` reports how long each object took to build, how
+often it was reused, and how many requests went out over an existing connection.
+"""
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _ConnectionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def record(self, events: set):
+        with self._lock:
+            self.counts["requests"] += 1
+            if "connection.connect_tcp.complete" in events:
+                self.counts["new_connections"] += 1
+            if "connection.start_tls.complete" in events:
+                self.counts["tls_handshakes"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            requests = self.counts["requests"]
+            reused = requests - self.counts["new_connections"]
+            return {
+                "requests": requests,
+                "new_connections": self.counts["new_connections"],
+                "tls_handshakes": self.counts["tls_handshakes"],
+                "reused_connections": reused,
+                "reuse_rate": reused / requests if requests else 0.0,
+            }
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """An httpx transport that records whether each request opened a new connection."""
+
+    def __init__(self, stats: _ConnectionStats, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        events = set()
+        outer = request.extensions.get("trace")
+
+        def trace(name: str, info: dict):
+            events.add(name)
+            if outer is not None:
+                outer(name, info)
+
+        request.extensions["trace"] = trace
+        try:
+            return super().handle_request(request)
+        finally:
+            self.stats.record(events)
+
+
+def _label(config: Dict[str, Any]) -> str:
+    """The configuration, with long values like prompts shortened to a hash."""
+
+    def short(value: Any) -> str:
+        text = value if isinstance(value, str) else json.dumps(value, default=repr)
+        if len(text) <= 40:
+            return text
+        return f"#{hashlib.sha256(text.encode()).hexdigest()[:8]}"
+
+    return ", ".join(f"{k}={short(v)}" for k, v in sorted(config.items()))
+
+
+class ModelRegistry:
+    """Objects built once per configuration, with build and reuse statistics."""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._objects: "collections.OrderedDict[str, Any]" = collections.OrderedDict()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        # Builders may get other objects from the registry, e.g. a chain its model
+        self._lock = threading.RLock()
+        self.connections = _ConnectionStats()
+        self._http_client: Optional[httpx.Client] = None
+
+    @staticmethod
+    def key(name: str, config: Dict[str, Any]) -> str:
+        serialized = json.dumps(config, sort_keys=True, default=repr)
+        return hashlib.sha256(f"{name}\0{serialized}".encode()).hexdigest()
+
+    def get(self, name: str, config: Dict[str, Any], build: Callable[[], T]) -> T:
+        """The object for `name` and `config`, calling `build` the first time."""
+        key = self.key(name, config)
+        with self._lock:
+            if key in self._objects:
+                self._objects.move_to_end(key)
+                self._stats[key]["hits"] += 1
+                return self._objects[key]
+            started = time.perf_counter()
+            obj = build()
+            seconds = time.perf_counter() - started
+            self._objects[key] = obj
+            self._stats[key] = {
+                "name": name,
+                "config": _label(config),
+                "build_ms": 1000 * seconds,
+                "hits": 0,
+            }
+            while len(self._objects) > self.max_entries:
+                evicted, _ = self._objects.popitem(last=False)
+                del self._stats[evicted]
+        logger.info(f"Built {name} ({_label(config)}) in {1000 * seconds:.1f}ms")
+        return obj
+
+    def http_client(self) -> httpx.Client:
+        """The keep-alive httpx client shared by the registry's chat models."""
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    transport=InstrumentedTransport(self.connections),
+                    timeout=httpx.Timeout(600.0, connect=5.0),
+                )
+            return self._http_client
+
+    def chat_model(self, cls: Callable[..., T], **config: Any) -> T:
+        """A chat model of class `cls` built with `config`, shared by all callers."""
+
+        def build():
+            kwargs = dict(config)
+            fields = getattr(cls, "__fields__", {})
+            if "http_client" in fields and "http_async_client" in fields:
+                kwargs.setdefault("http_client", self.http_client())
+            return cls(**kwargs)
+
+        return self.get(f"{cls.__module__}.{cls.__name__}", config, build)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "objects": [dict(stats) for stats in self._stats.values()],
+                "http": self.connections.summary(),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._stats.clear()
+
+
+REGISTRY = ModelRegistry()
@@ -0,0 +1,111 @@
+"""
+Draw a streamed response in Streamlit at a bounded frame rate, and time the stream.
+
+Redrawing the message for every chunk sends the whole, growing response to the
+browser each time, which is quadratic in its length. `StreamRenderer` redraws at
+most `fps` times a second instead, and always draws the complete text at the end:
+
+    with StreamRenderer(st.empty()) as renderer:
+        for chunk in chain.stream(inputs):
+            renderer.write(chunk.content)
+    renderer.log_feedback(get_feedback_sink(), run_id)
+
+It records when each chunk arrives, for the time to first token, the gaps between
+chunks and the total stream time. `log_feedback` sends these as numeric feedback on
+the traced run, so they can be charted in LangSmith like any other feedback key.
+"""
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+# The feedback keys `log_feedback` reports, in milliseconds unless noted
+FEEDBACK_KEYS = (
+    "ttft_ms",
+    "inter_token_p50_ms",
+    "inter_token_p95_ms",
+    "stream_ms",
+    "chars_per_second",
+)
+
+
+def _percentile(values: Sequence[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StreamRenderer:
+    """Streamed text in a Streamlit element, redrawn at most `fps` times a second."""
+
+    def __init__(self, placeholder: Any, fps: float = 15.0, cursor: str = "▌"):
+        self.placeholder = placeholder
+        self.min_interval = 1.0 / fps
+        self.cursor = cursor
+        self.frames = 0
+        self._parts: List[str] = []
+        self._arrivals: List[float] = []
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._drawn_at = float("-inf")
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def start(self):
+        """Start the clock. Call right before the stream is requested."""
+        self._started = time.perf_counter()
+        return self
+
+    def write(self, chunk: str):
+        if not chunk:
+            return
+        now = time.perf_counter()
+        if self._started is None:
+            self._started = now
+        self._parts.append(chunk)
+        self._arrivals.append(now)
+        if now - self._drawn_at >= self.min_interval:
+            self._draw(self.text + self.cursor)
+            self._drawn_at = now
+
+    def finish(self) -> str:
+        """Draw the complete text without the cursor and stop the clock."""
+        if self._finished is None:
+            self._finished = time.perf_counter()
+        self._draw(self.text)
+        return self.text
+
+    def _draw(self, text: str):
+        self.placeholder.markdown(text)
+        self.frames += 1
+
+    def __enter__(self) -> "StreamRenderer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+    def metrics(self) -> Dict[str, Optional[float]]:
+        if self._started is None or not self._arrivals:
+            return {key: None for key in FEEDBACK_KEYS}
+        end = self._finished or self._arrivals[-1]
+        gaps = [b - a for a, b in zip(self._arrivals, self._arrivals[1:])]
+        seconds = end - self._started
+        return {
+            "ttft_ms": 1000 * (self._arrivals[0] - self._started),
+            "inter_token_p50_ms": _ms(_percentile(gaps, 0.5)),
+            "inter_token_p95_ms": _ms(_percentile(gaps, 0.95)),
+            "stream_ms": 1000 * seconds,
+            "chars_per_second": len(self.text) / seconds if seconds else None,
+        }
+
+    def log_feedback(self, sink: Any, run_id: Any):
+        """Send the metrics as feedback on `run_id` through a FeedbackSink."""
+        for key, score in self.metrics().items():
+            if score is not None:
+                sink.submit(run_id, key, score=round(score, 1))
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else 1000 * seconds
@@ -0,0 +1,73 @@
+"""
+Measure the tool cache and parallel tool calls offline, with a scripted agent that
+makes several searches in its first step and a fake search backend.
+
+    python bench_tools.py --searches 4 --latency 0.5
+
+Prints the time per question of the stock AgentExecutor, of ParallelAgentExecutor,
+and of ParallelAgentExecutor with cached tools for a first user and for a second
+user asking near-identical questions.
+"""
+import argparse
+import time
+from typing import List, Union
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.runnables import RunnableLambda
+
+from tools import CachedTool, FakeSearchTool, ParallelAgentExecutor, ToolResultCache
+
+
+def _scripted_agent(queries: List[str]):
+    def plan(inputs: dict) -> Union[List[AgentAction], AgentFinish]:
+        if not inputs["intermediate_steps"]:
+            return [
+                AgentAction("duck_duck_go", {"query": q.format(**inputs)}, "")
+                for q in queries
+            ]
+        return AgentFinish({"output": "done"}, "")
+
+    return RunnableLambda(plan)
+
+
+def _time(label: str, executor: AgentExecutor, topic: str, search: FakeSearchTool):
+    calls = search.calls
+    start = time.perf_counter()
+    executor.invoke({"input": "question", "topic": topic})
+    seconds = time.perf_counter() - start
+    print(f"{label:28s} {seconds:6.2f}s  {search.calls - calls} backend calls")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--searches", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    queries = [f"{{topic}} news part {i}" for i in range(args.searches)]
+    agent = _scripted_agent(queries)
+    search = FakeSearchTool(latency=args.latency)
+    sequential = _time(
+        "sequential, no cache",
+        AgentExecutor(agent=agent, tools=[search]),
+        "LangSmith",
+        search,
+    )
+    parallel = _time(
+        "parallel, no cache",
+        ParallelAgentExecutor(agent=agent, tools=[search]),
+        "LangSmith",
+        search,
+    )
+    cache = ToolResultCache(ttl=600)
+    cached = ParallelAgentExecutor(agent=agent, tools=[CachedTool(search, cache)])
+    _time("parallel, cold cache", cached, "LangSmith", search)
+    warm = _time("parallel, near-identical", cached, "  langsmith ", search)
+    print(f"parallel speedup {sequential / parallel:.1f}x, cache {cache.stats()}")
+    assert parallel < sequential and warm < args.latency
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,17 @@
 """Example implementation of a LangChain Agent."""
 import logging
+import os
+import sys
+import threading
 from datetime import datetime
 from functools import partial
 
 import streamlit as st
-from langchain.agents import AgentExecutor
-from langchain.agents.format_scratchpad import format_to_openai_functions
-from langchain.agents.output_parsers.openai_functions import (
-    OpenAIFunctionsAgentOutputParser,
+from langchain.agents.format_scratchpad.openai_tools import (
+    format_to_openai_tool_messages,
 )
+from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
 from langchain.callbacks.streamlit import StreamlitCallbackHandler
-from langchain.memory import ConversationBufferMemory
 from langchain.pydantic_v1 import BaseModel, Field
 from langsmith import Client
 from streamlit_feedback import streamlit_feedback
@@ -18,8 +19,18 @@ from langchain_community.chat_message_histories import StreamlitChatMessageHisto
 from langchain_community.tools import DuckDuckGoSearchResults
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.tracers.context import tracing_v2_enabled
-from langchain_core.utils.function_calling import format_tool_to_openai_function
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_openai import ChatOpenAI
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from tools import CachedTool, ParallelAgentExecutor, ToolResultCache
+
+# feedback_sink.py is shared by the Streamlit feedback examples
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feedback_sink import FeedbackSink
+from model_registry import REGISTRY
+from stream_renderer import StreamRenderer
+from summary_memory import SummaryWindowMemory
+from trace_urls import TraceUrls
 
 st.set_page_config(
     page_title="Streamlit Agent with LangSmith",
@@ -33,16 +44,24 @@ client = Client()
 
 st.subheader("🦜🛠️ Ask the bot some questions")
 
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+# Built once per process, so reruns reuse its client and open connections
+llm = REGISTRY.chat_model(ChatOpenAI, model="gpt-3.5-turbo", temperature=0)
 
 
 class DDGInput(BaseModel):
     query: str = Field(description="search query to look up")
 
 
+@st.cache_resource
+def get_tool_cache() -> ToolResultCache:
+    # Shared by all sessions, so any user asking a recent search gets it for free
+    return ToolResultCache(ttl=600)
+
+
 tools = [
-    DuckDuckGoSearchResults(
-        name="duck_duck_go", args_schema=DDGInput
+    CachedTool(
+        DuckDuckGoSearchResults(name="duck_duck_go", args_schema=DDGInput),
+        get_tool_cache(),
     ),  # General internet search using DuckDuckGo
 ]
 
@@ -55,32 +74,63 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 ).partial(time=lambda: datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC"))
 
-MEMORY = ConversationBufferMemory(
+# Keeps the recent turns that fit in 1500 tokens, older ones are summarized
+MEMORY = SummaryWindowMemory(
+    llm=llm,
     chat_memory=StreamlitChatMessageHistory(key="langchain_messages"),
     return_messages=True,
     memory_key="chat_history",
+    max_token_limit=1500,
+    state=st.session_state,
 )
 agent = (
     {
         "input": lambda x: x["input"],
-        "agent_scratchpad": lambda x: format_to_openai_functions(
+        "agent_scratchpad": lambda x: format_to_openai_tool_messages(
             x["intermediate_steps"]
         ),
         "chat_history": lambda x: x.get("chat_history") or [],
     }
     | prompt
-    | llm.bind_functions(functions=[format_tool_to_openai_function(t) for t in tools])
-    | OpenAIFunctionsAgentOutputParser()
+    # With tools rather than functions, the model can make several searches at once
+    | llm.bind(tools=[convert_to_openai_tool(t) for t in tools])
+    | OpenAIToolsAgentOutputParser()
 )
 
-agent_executor = AgentExecutor(agent=agent, tools=tools, handle_parsing_errors=True)
+
+def _streamlit_context():
+    # Lets the StreamlitCallbackHandler draw from the threads running the tools
+    ctx = get_script_run_ctx()
+    return lambda: add_script_run_ctx(threading.current_thread(), ctx)
+
+
+agent_executor = ParallelAgentExecutor(
+    agent=agent,
+    tools=tools,
+    handle_parsing_errors=True,
+    thread_context=_streamlit_context,
+)
+
+
+@st.cache_resource
+def get_feedback_sink() -> FeedbackSink:
+    # Sends feedback in the background, so submitting it doesn't hold up the page
+    return FeedbackSink(client, journal_path=".feedback-journal.jsonl")
+
+
+@st.cache_resource
+def get_trace_urls() -> TraceUrls:
+    # Looks up the project once in the background, so trace links are built locally
+    trace_urls = TraceUrls(client)
+    trace_urls.prefetch("langsmith-streamlit-agent")
+    return trace_urls
 
 
 def _submit_feedback(user_response: dict, emoji=None, run_id=None):
     score = {"👍": 1, "👎": 0}.get(user_response.get("score"))
-    client.create_feedback(
-        run_id=run_id,
-        key=user_response["type"],
+    get_feedback_sink().submit(
+        run_id,
+        user_response["type"],
         score=score,
         comment=user_response.get("text"),
         value=user_response.get("score"),
@@ -125,16 +175,17 @@ for i, msg in enumerate(messages):
         )
 
 
-if st.session_state.get("run_url"):
-    st.markdown(
-        f"View trace in [🦜🛠️ LangSmith]({st.session_state.run_url})",
-        unsafe_allow_html=True,
-    )
+if st.session_state.get("trace_run"):
+    # None until the project has been looked up, the link shows on a later rerun
+    url = get_trace_urls().url(*st.session_state.trace_run)
+    if url:
+        st.markdown(
+            f"View trace in [🦜🛠️ LangSmith]({url})",
+            unsafe_allow_html=True,
+        )
 if prompt := st.chat_input(placeholder="Ask me a question!"):
     st.chat_message("user").write(prompt)
     with st.chat_message("assistant", avatar="🦜"):
-        message_placeholder = st.empty()
-        full_response = ""
         # Define the basic input structure for the chains
         input_dict = {
             "input": prompt,
@@ -142,19 +193,22 @@ if prompt := st.chat_input(placeholder="Ask me a question!"):
         input_dict.update(MEMORY.load_memory_variables({"query": prompt}))
         st_callback = StreamlitCallbackHandler(st.container())
         with tracing_v2_enabled("langsmith-streamlit-agent") as cb:
-            for chunk in agent_executor.stream(
-                input_dict,
-                config={"tags": ["Streamlit Agent"], "callbacks": [st_callback]},
-            ):
-                full_response += chunk["output"]
-                message_placeholder.markdown(full_response + "▌")
-            message_placeholder.markdown(full_response)
+            with StreamRenderer(st.empty()) as renderer:
+                for chunk in agent_executor.stream(
+                    input_dict,
+                    config={"tags": ["Streamlit Agent"], "callbacks": [st_callback]},
+                ):
+                    # Intermediate chunks carry the tool calls, not the answer
+                    renderer.write(chunk.get("output", ""))
+            full_response = renderer.text
             feedback_kwargs = {
                 "feedback_type": "thumbs",
                 "optional_text_label": "Please provide extra information",
                 "on_submit": _submit_feedback,
             }
             run = cb.latest_run
+            # Time to the answer and total time are logged as feedback on the run
+            renderer.log_feedback(get_feedback_sink(), run.id)
             MEMORY.save_context(input_dict, {"output": full_response})
             feedback_index = int(
                 (len(st.session_state.get("langchain_messages", [])) - 1) / 2
@@ -163,12 +217,9 @@ if prompt := st.chat_input(placeholder="Ask me a question!"):
             # This displays the feedback widget and saves to session state
             # It will be logged on next render
             streamlit_feedback(**feedback_kwargs, key=f"feedback_{feedback_index}")
-            try:
-                url = cb.get_run_url()
-                st.session_state.run_url = url
+            st.session_state.trace_run = (run.id, cb.project_name)
+            if url := get_trace_urls().url(run.id, cb.project_name):
                 st.markdown(
                     f"View trace in [🦜🛠️ LangSmith]({url})",
                     unsafe_allow_html=True,
                 )
-            except Exception:
-                logger.exception("Failed to get run URL.")
@@ -0,0 +1,222 @@
+"""
+Faster tool calls for the agent: a shared result cache and parallel execution.
+
+- `ToolResultCache` keeps tool results for `ttl` seconds, keyed by the tool name and
+  its normalized input, so the same search asked again (by any user, with different
+  casing or spacing) is answered without calling the backend. Punctuation is kept,
+  as it can change what a search means ("c++" and "c", "-term"). Identical calls made
+  at the same time share one backend call.
+- `CachedTool` puts a cache in front of any tool, keeping its name and schema.
+- `ParallelAgentExecutor` runs all the tool calls the model makes in one step at
+  the same time on a thread pool, instead of one after the other. It hooks into
+  private AgentExecutor methods, so importing this module fails on a langchain
+  version without them.
+- `FakeSearchTool` stands in for the search backend with a fixed latency, to measure
+  all of the above offline (see bench_tools.py).
+"""
+import collections
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentStep
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.tools import BaseTool
+
+# The AgentExecutor internals ParallelAgentExecutor overrides, present since the
+# langchain version pinned in requirements.txt
+_AGENT_EXECUTOR_HOOKS = ("_perform_agent_action", "_iter_next_step")
+
+for _hook in _AGENT_EXECUTOR_HOOKS:
+    if not callable(getattr(AgentExecutor, _hook, None)):
+        raise ImportError(
+            f"ParallelAgentExecutor needs AgentExecutor.{_hook}, which this version"
+            " of langchain does not have. Install the version in requirements.txt."
+        )
+
+
+def normalize_query(value: Any) -> str:
+    """Lowercase, without repeated whitespace, recursively for dicts."""
+    if isinstance(value, dict) and len(value) == 1:
+        # {"query": "..."} and "..." are the same input to a single argument tool
+        (value,) = value.values()
+    if isinstance(value, dict):
+        return json.dumps(
+            {k: normalize_query(v) for k, v in value.items()}, sort_keys=True
+        )
+    return " ".join(str(value).lower().split())
+
+
+class ToolResultCache:
+    """Tool results by tool and normalized input, for `ttl` seconds. Thread safe."""
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "collections.OrderedDict[str, Tuple[float, Any]]" = (
+            collections.OrderedDict()
+        )
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    @staticmethod
+    def key(tool_name: str, tool_input: Any) -> str:
+        normalized = normalize_query(tool_input)
+        return hashlib.sha256(f"{tool_name}\0{normalized}".encode()).hexdigest()
+
+    def get_or_call(self, key: str, call: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                self._stats["misses"] += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self._stats["coalesced"] += 1
+        if not owner:
+            return future.result()
+        try:
+            result = call()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self._stats.values())
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": (self._stats["hits"] + self._stats["coalesced"]) / lookups
+                if lookups
+                else 0.0,
+            }
+
+
+class CachedTool(BaseTool):
+    """`tool` with its results served from `cache` when possible."""
+
+    tool: BaseTool
+    cache: Any
+
+    def __init__(self, tool: BaseTool, cache: ToolResultCache, **kwargs):
+        super().__init__(
+            tool=tool,
+            cache=cache,
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            return_direct=tool.return_direct,
+            **kwargs,
+        )
+
+    def _run(
+        self,
+        *args: Any,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        **kwargs: Any,
+    ) -> Any:
+        tool_input = kwargs if kwargs else args[0]
+        return self.cache.get_or_call(
+            self.cache.key(self.name, tool_input),
+            lambda: self.tool.run(
+                tool_input, callbacks=run_manager.get_child() if run_manager else None
+            ),
+        )
+
+
+_TOOL_POOL = ThreadPoolExecutor(8, "agent-tools")
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """
+    An AgentExecutor that runs the tool calls of one agent step concurrently.
+
+    Tool calls run on a shared thread pool with the caller's context variables, so
+    they are traced under the agent run. Set `thread_context` to carry over anything
+    else the tools need from the calling thread: it is called in that thread and
+    returns a function that is run in the worker before the tool.
+    """
+
+    thread_context: Optional[Callable[[], Callable[[], None]]] = None
+
+    def _perform_agent_action(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        agent_action: AgentAction,
+        run_manager=None,
+    ) -> Future:
+        # Called once per action of a step by `_iter_next_step` below, so all of
+        # them are submitted before any result is waited for
+        setup = self.thread_context() if self.thread_context else None
+        perform = super()._perform_agent_action
+
+        def run() -> AgentStep:
+            if setup is not None:
+                setup()
+            return perform(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+        return _TOOL_POOL.submit(contextvars.copy_context().run, run)
+
+    def _iter_next_step(self, *args, **kwargs):
+        pending = []
+        for output in super()._iter_next_step(*args, **kwargs):
+            if isinstance(output, Future):
+                pending.append(output)
+            else:
+                yield output
+        for future in pending:
+            yield future.result()
+
+
+class SearchInput(BaseModel):
+    query: str = Field(description="search query to look up")
+
+
+class FakeSearchTool(BaseTool):
+    """Answers any query after `latency` seconds with made up, deterministic results."""
+
+    name: str = "duck_duck_go"
+    description: str = "Search the internet. Input should be a search query."
+    args_schema: Type[BaseModel] = SearchInput
+    latency: float = 0.5
+    calls: int = 0
+
+    def _run(
+        self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        digest = hashlib.sha256(query.encode()).hexdigest()
+        return ", ".join(
+            f"[snippet: Result {i} for {query}, title: {digest[i * 8 : i * 8 + 8]},"
+            f" link: https://example.com/{digest[i * 8 : i * 8 + 8]}]"
+            for i in range(3)
+        )
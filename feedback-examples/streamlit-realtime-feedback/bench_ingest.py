@@ -0,0 +1,138 @@
+"""
+Run the ingestion pipeline against a generated static site served locally, with
+fake embeddings, and check that refreshes only touch what changed.
+
+    python bench_ingest.py --pages 500 --workers 4
+
+Prints the time, peak memory and pages per second of a full build, a refresh
+with nothing changed, a refresh after editing one page and deleting another, and a
+refresh while one page fails with a server error.
+"""
+import argparse
+import functools
+import http.server
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import ingest
+
+_WORDS = "trace run dataset evaluator feedback prompt chain project token latency".split()
+
+
+def _write_site(root: str, num_pages: int, fanout: int):
+    """A tree of pages where page i links to its children fanout*i+1 .. fanout*i+fanout."""
+    rng = random.Random(0)
+    for i in range(num_pages):
+        children = range(fanout * i + 1, min(fanout * i + fanout + 1, num_pages))
+        links = "".join(f'<li><a href="/page-{c}.html">Page {c}</a></li>' for c in children)
+        body = "".join(
+            f"<p>{' '.join(rng.choices(_WORDS, k=60))}.</p>" for _ in range(20)
+        )
+        name = "index.html" if i == 0 else f"page-{i}.html"
+        with open(os.path.join(root, name), "w") as f:
+            f.write(
+                f"<html><head><title>Page {i}</title></head>"
+                f"<body><h1>Page {i}</h1>{body}<ul>{links}</ul></body></html>"
+            )
+
+
+def _depth(num_pages: int, fanout: int) -> int:
+    depth, reachable, level = 1, 1, 1
+    while reachable < num_pages:
+        level *= fanout
+        reachable += level
+        depth += 1
+    return depth
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    # Paths that answer 503, like a flaky server
+    failing = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path in self.failing:
+            self.send_error(503)
+            return
+        super().do_GET()
+
+
+def _peak_rss_mb() -> float:
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def _run(label: str, num_pages: int, **kwargs):
+    start = time.perf_counter()
+    result = ingest.refresh_index(**kwargs)
+    seconds = time.perf_counter() - start
+    print(
+        f"{label:10s} {seconds:7.2f}s {num_pages / seconds:8.1f} pages/s"
+        f" {_peak_rss_mb():7.0f}MB peak  {result['pages']}"
+        f"  {result['embeddings']['misses']} embedded"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=ingest.CRAWL_CONCURRENCY)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as site, tempfile.TemporaryDirectory() as index:
+        _write_site(site, args.pages, args.fanout)
+        server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(_QuietHandler, directory=site)
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/"
+        kwargs = dict(
+            index_dir=index,
+            url=url,
+            embeddings=DeterministicFakeEmbedding(size=256),
+            max_depth=_depth(args.pages, args.fanout),
+            concurrency=args.concurrency,
+            workers=args.workers,
+        )
+        try:
+            built = _run("build", args.pages, **kwargs)
+            assert built["pages"]["added"] == args.pages, built["pages"]
+
+            unchanged = _run("no change", args.pages, **kwargs)
+            assert unchanged["pages"]["unchanged"] == args.pages, unchanged["pages"]
+            assert unchanged["embeddings"]["misses"] == 0, unchanged["embeddings"]
+
+            with open(os.path.join(site, "page-1.html"), "a") as f:
+                f.write("<p>An edit to page one.</p>")
+            os.remove(os.path.join(site, f"page-{args.pages - 1}.html"))
+            changed = _run("1 changed", args.pages, **kwargs)
+            assert changed["pages"]["updated"] == 1, changed["pages"]
+            assert changed["pages"]["removed"] == 1, changed["pages"]
+
+            # Neither the failing page nor the pages only it links to are removed
+            _QuietHandler.failing.add("/page-1.html")
+            flaky = _run("1 failing", args.pages, **kwargs)
+            _QuietHandler.failing.clear()
+            assert flaky["pages"]["removed"] == 0, flaky["pages"]
+            assert flaky["pages"]["kept"] >= 1, flaky["pages"]
+            recovered = _run("recovered", args.pages, **kwargs)
+            assert recovered["pages"]["kept"] == 0, recovered["pages"]
+        finally:
+            server.shutdown()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
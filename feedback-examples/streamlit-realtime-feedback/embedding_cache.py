@@ -0,0 +1,163 @@
+"""
+A content-addressed cache in front of an embedding model.
+
+Vectors are keyed by a hash of the model name and the text, so unchanged chunks
+are never sent to the API again when the index is refreshed. They are stored as
+rows of a float32 file that is memory-mapped for reads, with a text file listing
+the key of each row:
+
+    <directory>/vectors.f32   row i holds the vector for line i of keys.txt
+    <directory>/keys.txt
+    <directory>/meta.json     model name, vector dimension and committed rows
+
+Both files are append-only. Each append writes and fsyncs the vectors and keys,
+then replaces meta.json with the new row count. Only committed rows are read, and
+the next append truncates whatever an interrupted write left behind, so a partial
+key or vector is never served or glued to the next one.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class MemmapEmbeddingCache(Embeddings):
+    """
+    Caches `embed_documents` results of `embeddings` in `directory`. Misses are
+    de-duplicated and embedded in batches of `batch_size` texts. Queries are not
+    cached.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        directory: str,
+        model: Optional[str] = None,
+        batch_size: int = 2048,
+    ):
+        self.embeddings = embeddings
+        self.directory = directory
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.batch_size = batch_size
+        self._rows: Optional[Dict[str, int]] = None
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self._keys_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "requests": 0, "api_seconds": 0.0}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode()).hexdigest()
+
+    def _load(self):
+        if self._rows is not None:
+            return
+        self._rows = {}
+        try:
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return
+        if meta["model"] != self.model:
+            raise ValueError(
+                f"{self.directory} caches embeddings for {meta['model']!r},"
+                f" not {self.model!r}"
+            )
+        self._dim = meta["dim"]
+        with open(self._path("keys.txt")) as f:
+            # A last line without a newline is a partially written key
+            keys = f.read().split("\n")[:-1]
+        size = os.path.getsize(self._path("vectors.f32"))
+        # Caches written before the row count was committed go by the files alone
+        num_rows = min(len(keys), size // (4 * self._dim), meta.get("rows", size))
+        keys = keys[:num_rows]
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._keys_bytes = sum(len(key.encode()) + 1 for key in keys)
+        self._map(num_rows)
+
+    def _map(self, num_rows: int):
+        self._vectors = (
+            np.memmap(
+                self._path("vectors.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(num_rows, self._dim),
+            )
+            if num_rows
+            else None
+        )
+
+    def _write_meta(self, num_rows: int):
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"model": self.model, "dim": self._dim, "rows": num_rows}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _append(self, keys: List[str], vectors: List[List[float]]):
+        array = np.asarray(vectors, dtype=np.float32)
+        os.makedirs(self.directory, exist_ok=True)
+        num_rows = len(self._rows)
+        if self._dim is None:
+            self._dim = array.shape[1]
+            self._write_meta(num_rows)
+        lines = "".join(f"{key}\n" for key in keys).encode()
+        # Drop anything past the committed rows left behind by an interrupted write
+        for name, committed, data in (
+            ("vectors.f32", num_rows * 4 * self._dim, array.tobytes()),
+            ("keys.txt", self._keys_bytes, lines),
+        ):
+            with open(self._path(name), "ab") as f:
+                f.truncate(committed)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self._write_meta(num_rows + len(keys))
+        self._keys_bytes += len(lines)
+        for key in keys:
+            self._rows[key] = len(self._rows)
+        self._map(len(self._rows))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self._load()
+            keys = [self._key(text) for text in texts]
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows:
+                    missing.setdefault(key, text)
+            self._stats["hits"] += len(texts) - len(missing)
+            self._stats["misses"] += len(missing)
+
+            missing_keys = list(missing)
+            for start in range(0, len(missing_keys), self.batch_size):
+                batch = missing_keys[start : start + self.batch_size]
+                started = time.perf_counter()
+                vectors = self.embeddings.embed_documents([missing[k] for k in batch])
+                self._stats["api_seconds"] += time.perf_counter() - started
+                self._stats["requests"] += 1
+                self._append(batch, vectors)
+
+            return [self._vectors[self._rows[key]].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        """Hit rate, plus texts embedded per second of API time for the misses."""
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["texts_per_second"] = (
+            stats["misses"] / stats["api_seconds"] if stats["api_seconds"] else 0.0
+        )
+        return stats
@@ -0,0 +1,337 @@
+"""
+Run online evaluators without ever slowing down the chat.
+
+`EvaluationService` is a drop-in replacement for `EvaluatorCallbackHandler`. When a
+traced run finishes, it is put on a bounded in-memory queue and the callback
+returns immediately. A small pool of worker threads takes runs off the queue in
+batches and grades them. An evaluator that defines
+`evaluate_runs(runs) -> List[EvaluationResult]` gets the whole batch at once, so
+it can send its grader requests together. It returns an exception in place of the
+result of a run it could not grade, and that run alone is graded again on its own.
+Otherwise the runs are graded one by one.
+
+When runs arrive faster than they can be graded, the queue fills up and the
+overload policy decides what is skipped:
+
+- "drop_newest": runs that arrive while the queue is full are skipped
+- "drop_oldest": the oldest queued run is skipped to make room for the new one
+- "sample": once the queue is more than `sample_above` full, new runs are admitted
+  with a probability that falls to 0 as it fills up
+
+Pass a `sampling.Sampler` to evaluate only a sample of the runs within a token
+budget. The sampling weight of each run is then added to its feedback. Sampled runs
+the overload policy skips or admits at random are reported back to the sampler, so
+their weights stay correct.
+
+`stats()` reports the queue depth and how long runs wait to be evaluated.
+"""
+import collections
+import logging
+import random
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Sequence, Union
+from uuid import UUID
+
+import langsmith
+from langchain_core.tracers import EvaluatorCallbackHandler
+from langchain_core.tracers.context import tracing_v2_enabled
+from langchain_core.tracers.schemas import Run
+from langsmith.evaluation.evaluator import EvaluationResult, EvaluationResults
+
+from sampling import Sampler
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_POLICIES = ("drop_newest", "drop_oldest", "sample")
+
+
+class _Job:
+    __slots__ = ("run", "enqueued_at")
+
+    def __init__(self, run: Run):
+        self.run = run
+        self.enqueued_at = time.monotonic()
+
+
+def _percentile(values: Sequence[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class EvaluationService(EvaluatorCallbackHandler):
+    """
+    An EvaluatorCallbackHandler that evaluates runs in the background.
+
+    Parameters
+    ----------
+    evaluators : Sequence[RunEvaluator]
+        The run evaluators to apply to all top level runs.
+    max_queue : int
+        How many finished runs can wait to be evaluated.
+    workers : int
+        Number of threads evaluating runs.
+    batch_size : int
+        Most runs a worker takes off the queue at once.
+    max_wait : float
+        Seconds a worker waits for a batch to fill up before evaluating it anyway.
+    overload : str
+        What to skip when the queue fills up, one of OVERLOAD_POLICIES.
+    sample_above : float
+        For the "sample" policy, the fraction of the queue after which runs are
+        sampled.
+    sampler : Sampler, optional
+        Chooses which runs to evaluate. All of them by default.
+    """
+
+    name = "evaluation_service"
+
+    def __init__(
+        self,
+        evaluators: Sequence[langsmith.RunEvaluator],
+        client: Optional[langsmith.Client] = None,
+        project_name: Optional[str] = "evaluators",
+        max_queue: int = 64,
+        workers: int = 2,
+        batch_size: int = 8,
+        max_wait: float = 0.2,
+        overload: str = "drop_oldest",
+        sample_above: float = 0.5,
+        sampler: Optional[Sampler] = None,
+        **kwargs: Any,
+    ):
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError(
+                f"Unknown overload policy {overload!r}, use one of {OVERLOAD_POLICIES}"
+            )
+        super().__init__(
+            evaluators,
+            client=client,
+            project_name=project_name,
+            max_concurrency=0,
+            **kwargs,
+        )
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.overload = overload
+        self.sample_above = sample_above
+        self.sampler = sampler
+        self._queue: Deque[_Job] = collections.deque()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._closed = False
+        self._counts = collections.Counter()
+        self._lags: Deque[float] = collections.deque(maxlen=1000)
+        self._workers = [
+            threading.Thread(
+                target=self._work, name=f"evaluation-service-{i}", daemon=True
+            )
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _persist_run(self, run: Run) -> None:
+        """Queue the run for evaluation. Never blocks."""
+        if self.skip_unfinished and not run.outputs:
+            logger.debug(f"Skipping unfinished run {run.id}")
+            return
+        run_ = run.copy()
+        run_.reference_example_id = self.example_id
+        for sampled in self.sampler.offer(run_) if self.sampler else [run_]:
+            self.submit(sampled)
+
+    def _admit(self, run: Run) -> Optional[str]:
+        """None if the new run can be queued, else the counter to charge it to."""
+        depth = len(self._queue)
+        if self._closed:
+            return "dropped"
+        if self.overload == "sample":
+            threshold = self.sample_above * self.max_queue
+            if depth >= self.max_queue:
+                return "dropped"
+            if depth > threshold:
+                admit_rate = (self.max_queue - depth) / (self.max_queue - threshold)
+                if random.random() >= admit_rate:
+                    return "sampled_out"
+                if self.sampler is not None:
+                    self.sampler.thin(run.id, admit_rate)
+            return None
+        if depth < self.max_queue:
+            return None
+        if self.overload == "drop_oldest":
+            self._skip(self._queue.popleft().run)
+            self._counts["dropped"] += 1
+            return None
+        return "dropped"
+
+    def _skip(self, run: Run):
+        if self.sampler is not None:
+            self.sampler.drop(run.id)
+
+    def submit(self, run: Run) -> bool:
+        """Queue a run, returns False if the overload policy skipped it."""
+        with self._cond:
+            self._counts["submitted"] += 1
+            skipped = self._admit(run)
+            if skipped:
+                self._counts[skipped] += 1
+                self._skip(run)
+                return False
+            self._queue.append(_Job(run))
+            self._cond.notify()
+            return True
+
+    def _release_sampled(self, flush: bool = False):
+        """Queue the runs a sampler held back once their decision is due."""
+        if self.sampler is None:
+            return
+        for run in self.sampler.flush() if flush else self.sampler.poll():
+            self.submit(run)
+
+    def _take_batch(self) -> Optional[List[_Job]]:
+        with self._cond:
+            while not self._queue and not self._closed:
+                if self.sampler is None:
+                    self._cond.wait()
+                    continue
+                self._cond.wait(1.0)
+                self._release_sampled()
+            if not self._queue:
+                return None
+            # Runs count as in flight as soon as they leave the queue, or
+            # wait_for_futures could return while a batch is still being filled
+            batch = [self._queue.popleft()]
+            self._in_flight += 1
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                if self._queue:
+                    batch.append(self._queue.popleft())
+                    self._in_flight += 1
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+            return batch
+
+    def _work(self):
+        while (batch := self._take_batch()) is not None:
+            try:
+                self._evaluate_batch([job.run for job in batch])
+            finally:
+                finished = time.monotonic()
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._counts["completed"] += len(batch)
+                    self._lags.extend(finished - job.enqueued_at for job in batch)
+                    self._cond.notify_all()
+
+    def _evaluate_batch(self, runs: List[Run]):
+        for evaluator in self.evaluators:
+            name = evaluator.__class__.__name__
+            batched = len(runs) > 1 and hasattr(evaluator, "evaluate_runs")
+            retry = runs
+            if batched:
+                try:
+                    with tracing_v2_enabled(
+                        project_name=self.project_name, tags=["eval"], client=self.client
+                    ) as cb:
+                        results = evaluator.evaluate_runs(runs)
+                    source_run_id = cb.latest_run.id if cb.latest_run else None
+                except Exception as e:
+                    logger.warning(
+                        f"Batch evaluation with {name} failed,"
+                        f" evaluating runs one by one: {e!r}"
+                    )
+                    results = [e] * len(runs)
+                    source_run_id = None
+                retry = []
+                for run, result in zip(runs, results):
+                    if isinstance(result, Exception):
+                        retry.append(run)
+                        continue
+                    try:
+                        self._log_evaluation_feedback(result, run, source_run_id)
+                    except Exception:
+                        logger.exception(f"Failed to log feedback from {name}")
+                        with self._cond:
+                            self._counts["errors"] += 1
+                # A run the batch failed on counts as one error, however its retry goes
+                with self._cond:
+                    self._counts["errors"] += len(retry)
+                    self._counts["retried"] += len(retry)
+            for run in retry:
+                try:
+                    self._evaluate_in_project(run, evaluator)
+                except Exception:
+                    # Already logged by _evaluate_in_project
+                    if not batched:
+                        with self._cond:
+                            self._counts["errors"] += 1
+
+    def _log_evaluation_feedback(
+        self,
+        evaluator_response: Union[EvaluationResult, EvaluationResults],
+        run: Run,
+        source_run_id: Optional[UUID] = None,
+    ) -> List[EvaluationResult]:
+        decision = self.sampler.decision(run.id) if self.sampler else None
+        if decision is not None:
+            sampling = {
+                "probability": decision.probability,
+                "weight": decision.weight,
+                "stratum": decision.stratum,
+            }
+            for result in self._select_eval_results(evaluator_response):
+                result.evaluator_info = {**result.evaluator_info, "sampling": sampling}
+        return super()._log_evaluation_feedback(
+            evaluator_response, run, source_run_id
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, counts and evaluation lag (seconds from run end to feedback)."""
+        with self._cond:
+            lags = list(self._lags)
+            oldest = self._queue[0].enqueued_at if self._queue else None
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "submitted": self._counts["submitted"],
+                "completed": self._counts["completed"],
+                "dropped": self._counts["dropped"],
+                "sampled_out": self._counts["sampled_out"],
+                "errors": self._counts["errors"],
+                "retried": self._counts["retried"],
+                "lag_p50": _percentile(lags, 0.5),
+                "lag_p95": _percentile(lags, 0.95),
+                "lag_max": max(lags) if lags else None,
+                "oldest_queued": time.monotonic() - oldest if oldest else 0.0,
+                **({"sampling": self.sampler.stats()} if self.sampler else {}),
+            }
+
+    def wait_for_futures(self) -> None:
+        """Wait until every queued run, and every run a sampler held back, is evaluated."""
+        self._release_sampled(flush=True)
+        with self._cond:
+            while self._queue or self._in_flight:
+                self._cond.wait()
+
+    def close(self, wait: bool = True):
+        """Stop accepting runs. With `wait`, finish the queued ones first."""
+        if wait:
+            self._release_sampled(flush=True)
+        with self._cond:
+            self._closed = True
+            if not wait:
+                self._counts["dropped"] += len(self._queue)
+                for job in self._queue:
+                    self._skip(job.run)
+                self._queue.clear()
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,456 @@
+"""
+Build and refresh the retriever index used by the chat bot.
+
+The LangSmith docs are crawled, split into parent documents and small child
+chunks, and the child chunks are embedded into an on-disk Chroma collection.
+Parent documents are kept in a file-backed docstore. A manifest records a
+content hash per page, so a refresh only re-embeds pages that were added or
+changed and deletes the chunks of pages that are gone: pages that answer 404 or
+410, or that no page links to anymore. When some pages could not be fetched for
+other reasons (timeouts, server errors), the crawl is incomplete and only pages
+known to be gone are deleted. Embeddings go through a
+content-addressed cache (see embedding_cache.py), so chunks whose text did not
+change are not sent to the API even when their page did.
+
+Ingestion is a streaming pipeline whose stages all run at the same time:
+
+    async crawler -> process pool (HTML to text, splitting) -> batched embedding
+
+The queues between the stages are bounded, so memory use depends on the batch
+size and the number of workers, not on the size of the site.
+
+Run it once before starting the app, then on a schedule (e.g. nightly cron):
+
+    python ingest.py            # incremental refresh
+    python ingest.py --rebuild  # drop the index and build it from scratch
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from langchain.retrievers.multi_vector import MultiVectorRetriever
+from langchain.storage import LocalFileStore
+from langchain.storage._lc_store import create_kv_docstore
+from langchain_community.document_transformers import Html2TextTransformer
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.utils.html import extract_sub_links
+from langchain_openai import OpenAIEmbeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TokenTextSplitter
+
+from embedding_cache import MemmapEmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+DOCS_URL = "https://docs.smith.langchain.com"
+INDEX_DIR = os.environ.get(
+    "RETRIEVER_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".retriever-index"),
+)
+COLLECTION_NAME = "full_documents"
+ID_KEY = "doc_id"
+MANIFEST_FILE = "pages.json"
+# Written once a refresh has gone through, so a failed first build is retried
+COMPLETE_FILE = "complete"
+# Child chunks of changed pages are embedded and written together in batches this big
+EMBED_BATCH_SIZE = 2048
+# Same depth and timeout as the RecursiveUrlLoader used before
+MAX_DEPTH = 2
+# Statuses that mean a page was deleted, rather than failed to load this time
+GONE_STATUSES = (404, 410)
+CRAWL_TIMEOUT = 10
+CRAWL_CONCURRENCY = 16
+
+
+def _vectorstore(index_dir: str, embeddings: Optional[Embeddings] = None) -> Chroma:
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=MemmapEmbeddingCache(
+            embeddings or OpenAIEmbeddings(), os.path.join(index_dir, "embeddings")
+        ),
+        persist_directory=os.path.join(index_dir, "chroma"),
+    )
+
+
+def load_retriever(
+    index_dir: str = INDEX_DIR, embeddings: Optional[Embeddings] = None
+) -> MultiVectorRetriever:
+    """Open the persisted index. Nothing is crawled or embedded."""
+    return MultiVectorRetriever(
+        vectorstore=_vectorstore(index_dir, embeddings),
+        docstore=create_kv_docstore(
+            LocalFileStore(os.path.join(index_dir, "docstore"))
+        ),
+        id_key=ID_KEY,
+    )
+
+
+def index_exists(index_dir: str = INDEX_DIR) -> bool:
+    """Whether a refresh of the index has completed. A partial build doesn't count."""
+    return os.path.exists(os.path.join(index_dir, COMPLETE_FILE))
+
+
+def _load_manifest(index_dir: str) -> Dict[str, dict]:
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(index_dir: str, manifest: Dict[str, dict]):
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+async def crawl(
+    url: str = DOCS_URL,
+    max_depth: int = MAX_DEPTH,
+    concurrency: int = CRAWL_CONCURRENCY,
+    timeout: float = CRAWL_TIMEOUT,
+    failed: Optional[Dict[str, Optional[int]]] = None,
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Yield `(url, html)` for every page under `url`, up to `max_depth` links away.
+
+    Up to `concurrency` pages are fetched at once over a shared connection pool.
+    Fetching pauses while the consumer is busy, so pages don't pile up in memory.
+    Pages that fail to load or return an error status are logged and skipped, and
+    added to `failed` with their status, or None if no response came back.
+    """
+    frontier: asyncio.Queue = asyncio.Queue()
+    pages: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    seen = {url}
+    frontier.put_nowait((url, 0))
+
+    async def fetch(client: httpx.AsyncClient):
+        while True:
+            page_url, depth = await frontier.get()
+            try:
+                response = await client.get(page_url)
+                response.raise_for_status()
+                if "html" not in response.headers.get("content-type", "html"):
+                    continue
+                html = response.text
+                if depth + 1 < max_depth:
+                    for link in extract_sub_links(
+                        html, page_url, base_url=url, continue_on_failure=True
+                    ):
+                        if link not in seen:
+                            seen.add(link)
+                            frontier.put_nowait((link, depth + 1))
+                await pages.put((page_url, html))
+            except Exception as e:
+                logger.warning(f"Unable to load {page_url}: {e!r}")
+                if failed is not None:
+                    response = getattr(e, "response", None)
+                    failed[page_url] = getattr(response, "status_code", None)
+            finally:
+                frontier.task_done()
+
+    async def crawl_all():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(
+            limits=limits, timeout=timeout, follow_redirects=True
+        ) as client:
+            workers = [asyncio.create_task(fetch(client)) for _ in range(concurrency)]
+            try:
+                await frontier.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+        await pages.put(None)
+
+    crawler = asyncio.create_task(crawl_all())
+    try:
+        while (page := await pages.get()) is not None:
+            yield page
+        await crawler
+    finally:
+        crawler.cancel()
+
+
+def _content_hash(page: Document) -> str:
+    return hashlib.sha256(page.page_content.encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def _splitters():
+    return (
+        TokenTextSplitter(
+            model_name="gpt-3.5-turbo",
+            chunk_size=2000,
+            chunk_overlap=200,
+        ),
+        RecursiveCharacterTextSplitter(chunk_size=400),
+    )
+
+
+def split_page(
+    page: Document, content_hash: str
+) -> Tuple[List[str], List[Document], List[str], List[Document]]:
+    """
+    Split a page into parent documents and the child chunks that get embedded.
+    Ids are derived from the page and its content, so re-indexing the same content
+    overwrites the same entries.
+    """
+    parent_splitter, child_splitter = _splitters()
+    source = page.metadata["source"]
+    parent_ids, parents, child_ids, children = [], [], [], []
+    for i, parent in enumerate(parent_splitter.split_documents([page])):
+        parent_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}#{content_hash}/{i}"))
+        parent_ids.append(parent_id)
+        parents.append(parent)
+        for j, child in enumerate(child_splitter.split_documents([parent])):
+            child.metadata[ID_KEY] = parent_id
+            child_ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"{parent_id}/{j}")))
+            children.append(child)
+    return parent_ids, parents, child_ids, children
+
+
+_TITLE_REGEX = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+
+def transform_page(source: str, html: str, previous_hash: Optional[str] = None):
+    """
+    Convert a page to text and split it, in a worker process. Pages whose text
+    still hashes to `previous_hash` are not split. Returns `(hash, split or None)`.
+    """
+    metadata = {"source": source}
+    title = _TITLE_REGEX.search(html)
+    if title:
+        metadata["title"] = title.group(1).strip()
+    page = Html2TextTransformer().transform_documents(
+        [Document(page_content=html, metadata=metadata)]
+    )[0]
+    content_hash = _content_hash(page)
+    if content_hash == previous_hash:
+        return content_hash, None
+    return content_hash, split_page(page, content_hash)
+
+
+class _IndexWriter:
+    """
+    Collects changed and removed pages and writes them to the index in batches.
+    A batch is written in a background thread while the next one fills up.
+    """
+
+    def __init__(self, retriever: MultiVectorRetriever, manifest: Dict[str, dict]):
+        self.retriever = retriever
+        self.manifest = manifest
+        self._writing: Optional[asyncio.Future] = None
+        self._reset()
+
+    def _reset(self):
+        self.removed: List[dict] = []
+        self.entries: Dict[str, Optional[dict]] = {}
+        self.parents: List[Tuple[str, Document]] = []
+        self.child_ids: List[str] = []
+        self.children: List[Document] = []
+
+    async def add(self, source: str, content_hash: str, split, previous=None):
+        parent_ids, parents, child_ids, children = split
+        if previous:
+            self.removed.append(previous)
+        self.entries[source] = {
+            "hash": content_hash,
+            "parent_ids": parent_ids,
+            "child_ids": child_ids,
+        }
+        self.parents.extend(zip(parent_ids, parents))
+        self.child_ids.extend(child_ids)
+        self.children.extend(children)
+        if len(self.children) >= EMBED_BATCH_SIZE:
+            await self.flush(wait=False)
+
+    def remove(self, source: str):
+        self.removed.append(self.manifest[source])
+        self.entries[source] = None
+
+    def _write(self, removed, entries, parents, child_ids, children):
+        vectorstore, docstore = self.retriever.vectorstore, self.retriever.docstore
+        for entry in removed:
+            if entry["child_ids"]:
+                vectorstore.delete(ids=entry["child_ids"])
+            docstore.mdelete(entry["parent_ids"])
+        if children:
+            vectorstore.add_documents(children, ids=child_ids)
+        if parents:
+            docstore.mset(parents)
+        for source, entry in entries.items():
+            if entry is None:
+                self.manifest.pop(source, None)
+            else:
+                self.manifest[source] = entry
+
+    async def flush(self, wait: bool = True):
+        """Start writing what has been collected, after the previous batch is written."""
+        if self._writing is not None:
+            await self._writing
+            self._writing = None
+        batch = (self.removed, self.entries, self.parents, self.child_ids, self.children)
+        self._reset()
+        self._writing = asyncio.get_running_loop().run_in_executor(
+            None, self._write, *batch
+        )
+        if wait:
+            await self._writing
+            self._writing = None
+
+
+async def _refresh(
+    retriever: MultiVectorRetriever,
+    manifest: Dict[str, dict],
+    url: str,
+    max_depth: int,
+    concurrency: int,
+    workers: Optional[int],
+) -> Dict[str, int]:
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "kept": 0}
+    writer = _IndexWriter(retriever, manifest)
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    # At most `workers` pages are being transformed and as many wait for the writer
+    transformed: asyncio.Queue = asyncio.Queue(maxsize=workers)
+    slots = asyncio.Semaphore(workers)
+    crawled = set()
+    failed: Dict[str, Optional[int]] = {}
+
+    async def transform(pool, source, html):
+        try:
+            previous = manifest.get(source)
+            content_hash, split = await loop.run_in_executor(
+                pool, transform_page, source, html, previous and previous["hash"]
+            )
+            await transformed.put((source, content_hash, split, previous))
+        except Exception as e:
+            await transformed.put(e)
+        finally:
+            slots.release()
+
+    async def produce(pool):
+        tasks = set()
+        async for source, html in crawl(url, max_depth, concurrency, failed=failed):
+            crawled.add(source)
+            await slots.acquire()
+            task = asyncio.create_task(transform(pool, source, html))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        await transformed.put(None)
+
+    with ProcessPoolExecutor(workers) as pool:
+        producer = asyncio.create_task(produce(pool))
+        try:
+            while (item := await transformed.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                source, content_hash, split, previous = item
+                if split is None:
+                    counts["unchanged"] += 1
+                    continue
+                await writer.add(source, content_hash, split, previous)
+                counts["updated" if previous else "added"] += 1
+            await producer
+            if not crawled:
+                # Most likely a network problem, don't wipe the index because of it
+                raise RuntimeError(f"No pages found at {url}, leaving the index as is")
+            gone = {page for page, status in failed.items() if status in GONE_STATUSES}
+            # A page that failed to load may link to pages that were not reached, so
+            # only pages known to be gone are removed after an incomplete crawl
+            incomplete = len(gone) < len(failed)
+            if incomplete:
+                logger.warning(
+                    f"{len(failed) - len(gone)} pages could not be fetched, keeping"
+                    " the indexed pages that were not reached"
+                )
+            for source in set(manifest) - crawled:
+                if incomplete and source not in gone:
+                    counts["kept"] += 1
+                    continue
+                writer.remove(source)
+                counts["removed"] += 1
+        finally:
+            producer.cancel()
+            # Keep whatever was processed, the manifest is saved by the caller
+            await writer.flush()
+    return counts
+
+
+def refresh_index(
+    index_dir: str = INDEX_DIR,
+    url: str = DOCS_URL,
+    rebuild: bool = False,
+    embeddings: Optional[Embeddings] = None,
+    max_depth: int = MAX_DEPTH,
+    concurrency: int = CRAWL_CONCURRENCY,
+    workers: Optional[int] = None,
+) -> Dict[str, dict]:
+    """
+    Bring the index up to date with the docs site. Only pages whose content hash
+    changed are split and embedded again. Returns how many pages were added,
+    updated, removed, left unchanged or kept although they could not be fetched,
+    and the embedding cache's stats.
+    """
+    if rebuild:
+        shutil.rmtree(index_dir, ignore_errors=True)
+    os.makedirs(index_dir, exist_ok=True)
+    retriever = load_retriever(index_dir, embeddings)
+    manifest = _load_manifest(index_dir)
+    try:
+        counts = asyncio.run(
+            _refresh(retriever, manifest, url, max_depth, concurrency, workers)
+        )
+    finally:
+        # Keeps the pages written so far, so the next attempt only adds the rest
+        _save_manifest(index_dir, manifest)
+    open(os.path.join(index_dir, COMPLETE_FILE), "w").close()
+    return {
+        "pages": counts,
+        "embeddings": retriever.vectorstore.embeddings.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--url", default=DOCS_URL)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Drop the index and start over"
+    )
+    parser.add_argument("--max-depth", type=int, default=MAX_DEPTH)
+    parser.add_argument(
+        "--concurrency", type=int, default=CRAWL_CONCURRENCY, help="Parallel fetches"
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Processes converting and splitting pages"
+    )
+    args = parser.parse_args()
+    result = refresh_index(
+        args.index_dir,
+        args.url,
+        rebuild=args.rebuild,
+        max_depth=args.max_depth,
+        concurrency=args.concurrency,
+        workers=args.workers,
+    )
+    print("Pages:", ", ".join(f"{n} {kind}" for kind, n in result["pages"].items()))
+    embeddings = result["embeddings"]
+    print(
+        f"Embeddings: {embeddings['hits']} cached, {embeddings['misses']} embedded"
+        f" in {embeddings['requests']} requests ({embeddings['hit_rate']:.0%} hit rate,"
+        f" {embeddings['texts_per_second']:.0f} texts/s)"
+    )
@@ -0,0 +1,234 @@
+"""
+Cheap evaluators that score a run locally, in milliseconds, without calling an LLM.
+
+- EmbeddingRelevanceEvaluator: cosine similarity between the query and the answer
+- OverlapFaithfulnessEvaluator: how well each sentence of the answer is matched by
+  some sentence of the retrieved docs (rapidfuzz token set ratio)
+
+Both score batches of runs at once with NumPy / rapidfuzz matrix operations. Their
+scores are only a rough signal, so `EscalatingEvaluator` combines one with an LLM
+grader: runs the cheap evaluator is confident about keep the local score, and only
+borderline ones are sent to the LLM. Local scores are on a different scale from the
+grader's, so they are logged under their own key, e.g. "relevance_local", and the
+grader's key only ever holds grader scores:
+
+    EscalatingEvaluator(EmbeddingRelevanceEvaluator(), RelevanceEvaluator(), (0.2, 0.6))
+
+Where the borderline band lies depends on your data. Run both tiers on a sample of
+traces and pick the band outside of which they agree.
+"""
+import collections
+import re
+import zlib
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langsmith.evaluation import EvaluationResult, RunEvaluator
+from langsmith.schemas import Example, Run
+from rapidfuzz import fuzz, process
+
+from run_tree_index import RunTreeIndex
+from sampling import TokenBudget
+
+_WORD = re.compile(r"\w+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _sentences(text: str) -> List[str]:
+    return [s for s in (s.strip() for s in _SENTENCE.split(text)) if len(s) > 3]
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local embeddings: words and word bigrams hashed into `size` buckets with
+    sublinear term frequencies. Only captures lexical similarity, pass a real
+    embedding model to the evaluators for semantic similarity.
+    """
+
+    def __init__(self, size: int = 2048):
+        self.size = size
+
+    def _embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.size), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _words(text)
+            terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for term in terms:
+                h = zlib.crc32(term.encode())
+                vectors[row, h % self.size] += 1.0 if h & 1 << 31 else -1.0
+        return np.sign(vectors) * np.log1p(np.abs(vectors))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+
+def _row_cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return np.divide(
+        np.einsum("ij,ij->i", a, b), norms, out=np.zeros(len(a)), where=norms > 0
+    )
+
+
+class EmbeddingRelevanceEvaluator(RunEvaluator):
+    """Cosine similarity between the user query and the answer, clipped to [0, 1]."""
+
+    def __init__(self, embeddings: Optional[Embeddings] = None):
+        self.embeddings = embeddings or HashingEmbeddings()
+
+    def evaluate_run(
+        self, run: Run, example: Optional[Example] = None
+    ) -> EvaluationResult:
+        return self.evaluate_runs([run])[0]
+
+    def evaluate_runs(self, runs: List[Run]) -> List[EvaluationResult]:
+        try:
+            texts = [run.inputs["query"] for run in runs]
+            texts += [run.outputs["output"] for run in runs]
+            vectors = np.asarray(self.embeddings.embed_documents(texts))
+        except Exception as e:
+            return [
+                EvaluationResult(key="relevance", score=None, comment=repr(e))
+                for _ in runs
+            ]
+        scores = np.clip(_row_cosine(vectors[: len(runs)], vectors[len(runs) :]), 0, 1)
+        return [
+            EvaluationResult(key="relevance", score=float(score), comment="cosine")
+            for score in scores
+        ]
+
+
+class OverlapFaithfulnessEvaluator(RunEvaluator):
+    """
+    The share of the answer supported by the retrieved docs. Each answer sentence is
+    supported to the degree its words appear together in one sentence of the docs
+    (rapidfuzz token set ratio), and the score is the mean over the sentences.
+    """
+
+    def __init__(self, retriever_names: Optional[Sequence[str]] = None):
+        self.retriever_names = retriever_names
+
+    def _score(self, answer: str, docs: str) -> Tuple[Optional[float], str]:
+        answer_sentences, doc_sentences = _sentences(answer), _sentences(docs)
+        if not answer_sentences:
+            return None, "empty answer"
+        if not doc_sentences:
+            return 0.0, "no retrieved docs"
+        matrix = process.cdist(
+            answer_sentences,
+            doc_sentences,
+            scorer=fuzz.token_set_ratio,
+            processor=str.lower,
+            dtype=np.uint8,
+            workers=-1,
+        )
+        support = matrix.max(axis=1) / 100
+        weakest = answer_sentences[int(support.argmin())]
+        return float(support.mean()), f"least supported: {weakest!r}"
+
+    def evaluate_run(
+        self, run: Run, example: Optional[Example] = None
+    ) -> EvaluationResult:
+        try:
+            docs = RunTreeIndex.of(run).retrieved_text(self.retriever_names)
+            score, comment = self._score(run.outputs["output"], docs)
+            return EvaluationResult(key="faithfulness", score=score, comment=comment)
+        except Exception as e:
+            return EvaluationResult(key="faithfulness", score=None, comment=repr(e))
+
+    def evaluate_runs(self, runs: List[Run]) -> List[EvaluationResult]:
+        # cdist already spreads each run over all cores
+        return [self.evaluate_run(run) for run in runs]
+
+
+class EscalatingEvaluator(RunEvaluator):
+    """
+    Scores runs with `fast` and only asks `grader` when the fast score falls inside
+    `borderline` (inclusive), or could not be computed. The feedback records which
+    tier produced it in its source info. Scores the fast tier keeps are logged under
+    `local_key`, by default the fast evaluator's key with a "_local" suffix. With a
+    `budget`, each grader call is charged to it.
+    """
+
+    def __init__(
+        self,
+        fast: RunEvaluator,
+        grader: RunEvaluator,
+        borderline: Tuple[float, float] = (0.3, 0.7),
+        budget: Optional[TokenBudget] = None,
+        local_key: Optional[str] = None,
+    ):
+        self.fast = fast
+        self.grader = grader
+        self.borderline = borderline
+        self.budget = budget
+        self.local_key = local_key
+        self.counts = collections.Counter()
+
+    def _escalate(self, result: EvaluationResult) -> bool:
+        low, high = self.borderline
+        return result.score is None or low <= result.score <= high
+
+    def _tag(self, result: EvaluationResult, tier: str, fast_score=None):
+        self.counts[tier] += 1
+        if tier == "local":
+            result.key = self.local_key or f"{result.key}_local"
+        result.evaluator_info = {
+            **result.evaluator_info,
+            "tier": tier,
+            **({"fast_score": fast_score} if tier == "llm" else {}),
+        }
+        return result
+
+    def _charge(self, runs: List[Run]):
+        if self.budget is not None:
+            for run in runs:
+                self.budget.charge_call(run)
+
+    def evaluate_run(
+        self, run: Run, example: Optional[Example] = None
+    ) -> EvaluationResult:
+        result = self.fast.evaluate_run(run, example)
+        if not self._escalate(result):
+            return self._tag(result, "local")
+        self._charge([run])
+        return self._tag(self.grader.evaluate_run(run, example), "llm", result.score)
+
+    def evaluate_runs(
+        self, runs: List[Run]
+    ) -> List[Union[EvaluationResult, Exception]]:
+        if hasattr(self.fast, "evaluate_runs"):
+            results = self.fast.evaluate_runs(runs)
+        else:
+            results = [self.fast.evaluate_run(run) for run in runs]
+        escalate = [i for i, result in enumerate(results) if self._escalate(result)]
+        self._charge([runs[i] for i in escalate])
+        if len(escalate) > 1 and hasattr(self.grader, "evaluate_runs"):
+            graded = self.grader.evaluate_runs([runs[i] for i in escalate])
+        else:
+            graded = [self.grader.evaluate_run(runs[i]) for i in escalate]
+        final = list(results)
+        for i, result in zip(escalate, graded):
+            # Runs the grader failed on keep their exception, see EvaluationService
+            if not isinstance(result, Exception):
+                result = self._tag(result, "llm", results[i].score)
+            final[i] = result
+        escalated = set(escalate)
+        return [
+            result if i in escalated else self._tag(result, "local")
+            for i, result in enumerate(final)
+        ]
+
+    def stats(self) -> dict:
+        total = self.counts["local"] + self.counts["llm"]
+        return {
+            **self.counts,
+            "escalation_rate": self.counts["llm"] / total if total else 0.0,
+        }
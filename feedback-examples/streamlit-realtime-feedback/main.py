@@ -1,9 +1,10 @@
+import asyncio
 import logging
-from typing import Optional
+import threading
+from typing import Callable, List, Optional, Sequence, Union
 
 import streamlit as st
 from langchain_core.messages import get_buffer_string
-from langchain_core.tracers import EvaluatorCallbackHandler
 from langchain_core.tracers.context import tracing_v2_enabled
 
 st.set_page_config(
@@ -12,6 +13,19 @@ st.set_page_config(
 )
 
 from chain import MEMORY, get_chain
+from evaluation_service import EvaluationService
+from local_evaluators import (
+    EmbeddingRelevanceEvaluator,
+    EscalatingEvaluator,
+    OverlapFaithfulnessEvaluator,
+)
+# Shared by the Streamlit feedback examples, on the path set up by chain.py
+from feedback_sink import FeedbackSink
+from model_registry import REGISTRY
+from stream_renderer import StreamRenderer
+from trace_urls import TraceUrls
+from run_tree_index import RunTreeIndex
+from sampling import Sampler, Stratified, TokenBudget, WindowedReservoir, by_metadata
 from langchain.evaluation import load_evaluator
 from langsmith import Client
 from langsmith.evaluation import EvaluationResult, RunEvaluator
@@ -47,32 +61,79 @@ for msg in messages:
         st.markdown(msg.content)
 
 
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """An event loop running on its own thread for as long as the process."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="grader-loop", daemon=True).start()
+    return loop
+
+
+def _score_batch(
+    evaluator,
+    key: str,
+    runs: List[Run],
+    strings: Callable[[Run], dict],
+    loop: asyncio.AbstractEventLoop,
+) -> List[Union[EvaluationResult, Exception]]:
+    """
+    Grade several runs with one concurrent batch of grader calls. A run that could
+    not be graded gets its exception in place of a result.
+
+    Every batch of a grader runs on the same `loop`: the grader's async HTTP client
+    keeps its connections on the loop it first ran on, so a new loop per batch, as
+    with `asyncio.run`, would break all batches after the first.
+    """
+
+    async def grade(run: Run) -> EvaluationResult:
+        result = await evaluator.aevaluate_strings(**strings(run))
+        return EvaluationResult(
+            **{"key": key, "comment": result.get("reasoning"), **result}
+        )
+
+    async def grade_all():
+        return await asyncio.gather(*map(grade, runs), return_exceptions=True)
+
+    return asyncio.run_coroutine_threadsafe(grade_all(), loop).result()
+
+
 class RelevanceEvaluator(RunEvaluator):
     def __init__(self):
         self.evaluator = load_evaluator(
             "score_string", criteria="relevance", normalize_by=10
         )
+        self.loop = _event_loop()
+
+    @staticmethod
+    def _strings(run: Run) -> dict:
+        text_input = (
+            get_buffer_string(run.inputs["chat_history"])
+            + f"\nhuman: {run.inputs['query']}"
+        )
+        return {"input": text_input, "prediction": run.outputs["output"]}
 
     def evaluate_run(
         self, run: Run, example: Optional[Example] = None
     ) -> EvaluationResult:
         try:
-            text_input = (
-                get_buffer_string(run.inputs["chat_history"])
-                + f"\nhuman: {run.inputs['query']}"
-            )
-            result = self.evaluator.evaluate_strings(
-                input=text_input, prediction=run.outputs["output"]
-            )
+            result = self.evaluator.evaluate_strings(**self._strings(run))
             return EvaluationResult(
                 **{"key": "relevance", "comment": result.get("reasoning"), **result}
             )
         except Exception as e:
             return EvaluationResult(key="relevance", score=None, comment=repr(e))
 
+    def evaluate_runs(
+        self, runs: List[Run]
+    ) -> List[Union[EvaluationResult, Exception]]:
+        return _score_batch(
+            self.evaluator, "relevance", runs, self._strings, self.loop
+        )
+
 
 class FaithfulnessEvaluator(RunEvaluator):
-    def __init__(self):
+    def __init__(self, retriever_names: Optional[Sequence[str]] = None):
+        # The retriever runs to check answers against, by run name. All by default.
+        self.retriever_names = retriever_names
         self.evaluator = load_evaluator(
             "labeled_score_string",
             criteria={
@@ -85,50 +146,124 @@ Score 10: The answer perfectly aligns with and is fully entailed by the referenc
             },
             normalize_by=10,
         )
+        self.loop = _event_loop()
 
-    @staticmethod
-    def _get_retrieved_docs(run: Run) -> str:
-        # This assumes there is only one retriver in your chain.
-        # To select more precisely, name your retrieval chain
-        # using with_config(name="my_unique_name") and look up
-        # by run.name
-        runs = [run]
-        while runs:
-            run = runs.pop()
-            if run.run_type == "retriever":
-                return run.outputs["documents"]
-            if run.child_runs:
-                runs.extend(run.child_runs)
-        return ""
+    def _get_retrieved_docs(self, run: Run) -> str:
+        # To select among several retrievers, name them (or the chain wrapping
+        # them) using with_config(run_name="my_unique_name") and pass the names
+        return RunTreeIndex.of(run).retrieved_text(self.retriever_names)
+
+    def _strings(self, run: Run) -> dict:
+        docs_string = self._get_retrieved_docs(run)
+        docs_string = f"Reference docs:\n<DOCS>\n{docs_string}\n</DOCS>\n\n"
+        return {
+            "input": run.inputs["query"],
+            "prediction": run.outputs["output"],
+            "reference": docs_string,
+        }
 
     def evaluate_run(
         self, run: Run, example: Optional[Example] = None
     ) -> EvaluationResult:
         try:
-            docs_string = self._get_retrieved_docs(run)
-            docs_string = f"Reference docs:\n<DOCS>\n{docs_string}\n</DOCS>\n\n"
-            input_query = run.inputs["query"]
-            prediction = run.outputs["output"]
-            result = self.evaluator.evaluate_strings(
-                input=input_query,
-                prediction=prediction,
-                reference=docs_string,
-            )
+            result = self.evaluator.evaluate_strings(**self._strings(run))
             return EvaluationResult(
                 **{"key": "faithfulness", "comment": result.get("reasoning"), **result}
             )
         except Exception as e:
             return EvaluationResult(key="faithfulness", score=None, comment=repr(e))
 
+    def evaluate_runs(
+        self, runs: List[Run]
+    ) -> List[Union[EvaluationResult, Exception]]:
+        return _score_batch(
+            self.evaluator, "faithfulness", runs, self._strings, self.loop
+        )
 
-evaluation_callback = EvaluatorCallbackHandler(
-    evaluators=[RelevanceEvaluator(), FaithfulnessEvaluator()]
-)
+
+@st.cache_resource
+def get_evaluation_service() -> EvaluationService:
+    # Created once per server process, so the queue and its workers survive reruns.
+    # Evaluate up to 5 runs a minute of each chain type, within 200k grader tokens an
+    # hour. Only escalated runs reach an LLM grader, so the graders charge the budget.
+    budget = TokenBudget(200_000, evaluators=0)
+    sampler = Sampler(
+        Stratified(by_metadata("chain_type"), lambda _: WindowedReservoir(5, 60)),
+        budget=budget,
+        log_path="sampling.jsonl",
+    )
+    # Runs are scored locally first, the LLM graders only see borderline ones
+    return EvaluationService(
+        evaluators=[
+            # Lexical cosine scores run low, hence the lower band. Tune both bands by
+            # running the local and LLM evaluators side by side on a sample of traces.
+            EscalatingEvaluator(
+                EmbeddingRelevanceEvaluator(),
+                RelevanceEvaluator(),
+                (0.05, 0.3),
+                budget=budget,
+            ),
+            EscalatingEvaluator(
+                OverlapFaithfulnessEvaluator(), FaithfulnessEvaluator(), budget=budget
+            ),
+        ],
+        client=client,
+        sampler=sampler,
+    )
+
+
+evaluation_callback = get_evaluation_service()
+
+
+@st.cache_resource
+def get_feedback_sink() -> FeedbackSink:
+    # Streaming metrics are logged as feedback without holding up the page
+    return FeedbackSink(client, journal_path=".feedback-journal.jsonl")
+
+
+@st.cache_resource
+def get_trace_urls() -> TraceUrls:
+    # Looks up the project once in the background, so trace links are built locally
+    trace_urls = TraceUrls(client)
+    trace_urls.prefetch()
+    return trace_urls
+
+
+with st.sidebar.expander("Evaluation queue"):
+    stats = evaluation_callback.stats()
+    st.metric("Waiting", f"{stats['queue_depth']} / {stats['max_queue']}")
+    if stats["lag_p50"] is not None:
+        st.metric("Lag p50 / p95", f"{stats['lag_p50']:.1f}s / {stats['lag_p95']:.1f}s")
+    st.caption(
+        f"{stats['completed']} evaluated, {stats['dropped']} dropped,"
+        f" {stats['sampled_out']} sampled out, {stats['errors']} errors"
+    )
+    sampling = stats["sampling"]
+    offered = sum(
+        sampling[k] for k in ("sampled", "not_sampled", "over_budget", "overload")
+    )
+    st.caption(
+        f"Sampled {sampling['sampled']} of {offered}"
+        f" runs, {sampling['budget_spent']:,} / {sampling['budget']:,} tokens this hour"
+    )
+with st.sidebar.expander("Model registry"):
+    registry_stats = REGISTRY.stats()
+    for obj in registry_stats["objects"]:
+        st.caption(
+            f"{obj['name'].rsplit('.', 1)[-1]} ({obj['config']}): built in"
+            f" {obj['build_ms']:.0f}ms, reused {obj['hits']} times"
+        )
+if st.session_state.get("trace_run"):
+    # None until the project has been looked up, the link shows on a later rerun
+    url = get_trace_urls().url(*st.session_state.trace_run)
+    if url:
+        st.markdown(
+            f"View trace in [🦜🛠️ LangSmith]({url})",
+            unsafe_allow_html=True,
+        )
 if prompt := st.chat_input(placeholder="Ask me a question!"):
     st.chat_message("user").write(prompt)
     with st.chat_message("assistant", avatar="🦜"):
-        message_placeholder = st.empty()
-        full_response = ""
         # Define the basic input structure for the chains
         input_dict = {
             "query": prompt,
@@ -136,23 +271,27 @@ if prompt := st.chat_input(placeholder="Ask me a question!"):
         input_dict.update(MEMORY.load_memory_variables({"query": prompt}))
 
         with tracing_v2_enabled() as cb:
-            for chunk in CHAIN.stream(
-                input_dict,
-                config={
-                    "tags": ["Streamlit Evaluation"],
-                    "callbacks": [evaluation_callback],
-                },
-            ):
-                print(chunk)
-                full_response += chunk
-                message_placeholder.markdown(full_response + "▌")
+            # Redraws a few times a second instead of for every chunk, and times
+            # the stream
+            with StreamRenderer(st.empty()) as renderer:
+                for chunk in CHAIN.stream(
+                    input_dict,
+                    config={
+                        "tags": ["Streamlit Evaluation"],
+                        "metadata": {"chain_type": chain_type},
+                        "callbacks": [evaluation_callback],
+                    },
+                ):
+                    renderer.write(chunk)
+            full_response = renderer.text
             MEMORY.save_context(input_dict, {"output": full_response})
-            try:
-                url = cb.get_run_url()
-                st.markdown(
-                    f"View trace in [🦜🛠️ LangSmith]({url})",
-                    unsafe_allow_html=True,
-                )
-            except Exception:
-                logger.exception("Failed to get run URL.")
-        message_placeholder.markdown(full_response)
+            run = cb.latest_run
+            if run is not None:
+                # Time to first token etc. are logged as feedback on the run
+                renderer.log_feedback(get_feedback_sink(), run.id)
+                st.session_state.trace_run = (run.id, cb.project_name)
+                if url := get_trace_urls().url(run.id, cb.project_name):
+                    st.markdown(
+                        f"View trace in [🦜🛠️ LangSmith]({url})",
+                        unsafe_allow_html=True,
+                    )
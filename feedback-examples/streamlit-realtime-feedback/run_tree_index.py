@@ -0,0 +1,126 @@
+"""
+Look up the child runs of a trace by type, name or tag without walking it again.
+
+Evaluators often need a particular span of the trace they grade, e.g. the
+retriever whose documents an answer should be faithful to. `RunTreeIndex.of(run)`
+walks the tree once and caches the index by run id. Every evaluator that grades
+the same run reuses the cached index:
+
+    index = RunTreeIndex.of(run)
+    index.first(run_type="retriever")
+    index.find(name="RetrieveDocs")
+    index.retrieved_documents(names=["DocsRetriever", "FAQRetriever"])
+
+Runs are returned in the order they executed (a pre-order walk of the tree).
+"""
+import collections
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from langsmith.schemas import Run
+
+
+class RunTreeIndex:
+    """Child runs of `root` (and the root itself), keyed by run_type, name and tag."""
+
+    _cache: "collections.OrderedDict[str, RunTreeIndex]" = collections.OrderedDict()
+    _cache_size = 256
+    _lock = threading.Lock()
+
+    def __init__(self, root: Run):
+        self.root = root
+        self.runs: List[Run] = []
+        self.by_type: Dict[str, List[Run]] = collections.defaultdict(list)
+        self.by_name: Dict[str, List[Run]] = collections.defaultdict(list)
+        self.by_tag: Dict[str, List[Run]] = collections.defaultdict(list)
+        self.parents: Dict[str, Run] = {}
+        stack = [root]
+        while stack:
+            run = stack.pop()
+            self.runs.append(run)
+            self.by_type[run.run_type].append(run)
+            self.by_name[run.name].append(run)
+            for tag in run.tags or []:
+                self.by_tag[tag].append(run)
+            children = run.child_runs or []
+            for child in children:
+                self.parents[str(child.id)] = run
+            stack.extend(reversed(children))
+
+    @classmethod
+    def of(cls, run: Run) -> "RunTreeIndex":
+        """The index of `run`, built on first use and shared afterwards."""
+        key = str(run.id)
+        with cls._lock:
+            index = cls._cache.get(key)
+            if index is not None and index.root is run:
+                cls._cache.move_to_end(key)
+                return index
+        index = cls(run)
+        with cls._lock:
+            cls._cache[key] = index
+            while len(cls._cache) > cls._cache_size:
+                cls._cache.popitem(last=False)
+        return index
+
+    def find(
+        self,
+        run_type: Optional[str] = None,
+        name: Optional[str] = None,
+        tag: Optional[str] = None,
+    ) -> List[Run]:
+        """Runs matching all of the given criteria, in execution order."""
+        candidates = [
+            self.by_type.get(run_type, []) if run_type is not None else None,
+            self.by_name.get(name, []) if name is not None else None,
+            self.by_tag.get(tag, []) if tag is not None else None,
+        ]
+        candidates = [runs for runs in candidates if runs is not None]
+        if not candidates:
+            return list(self.runs)
+        smallest = min(candidates, key=len)
+        others = [{id(run) for run in runs} for runs in candidates if runs is not smallest]
+        return [run for run in smallest if all(id(run) in ids for ids in others)]
+
+    def first(self, **criteria) -> Optional[Run]:
+        runs = self.find(**criteria)
+        return runs[0] if runs else None
+
+    def parent(self, run: Run) -> Optional[Run]:
+        return self.parents.get(str(run.id))
+
+    def ancestors(self, run: Run) -> Iterator[Run]:
+        while (run := self.parent(run)) is not None:
+            yield run
+
+    def retrieved_documents(
+        self, names: Optional[Sequence[str]] = None
+    ) -> Dict[str, list]:
+        """
+        The documents returned by each retriever run, keyed by run name. With `names`,
+        only those retrievers (or chains wrapping one, like a named retrieval step),
+        in that order. Otherwise every run of type "retriever".
+        """
+        if names is None:
+            runs = self.by_type.get("retriever", [])
+        else:
+            runs = [run for name in names for run in self.by_name.get(name, [])]
+        documents: Dict[str, list] = {}
+        for run in runs:
+            if not run.outputs or "documents" not in run.outputs:
+                continue
+            output = run.outputs["documents"]
+            # Retrievers return a list of documents, a chain may return them formatted
+            docs = output if isinstance(output, list) else [output]
+            documents.setdefault(run.name, []).extend(docs)
+        return documents
+
+    def retrieved_text(
+        self, names: Optional[Sequence[str]] = None, separator: str = "\n\n"
+    ) -> str:
+        """The page content of `retrieved_documents(names)`, joined into one string."""
+        return separator.join(
+            doc.get("page_content", str(doc)) if isinstance(doc, dict) else str(doc)
+            for docs in self.retrieved_documents(names).values()
+            for doc in docs
+        )
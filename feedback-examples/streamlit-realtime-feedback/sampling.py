@@ -0,0 +1,388 @@
+"""
+Decide which production runs are worth spending evaluator calls on.
+
+Grading every response with two LLM evaluators triples the LLM spend of the app.
+A `Sampler` in front of the `EvaluationService` picks a subset of runs instead:
+
+    sampler = Sampler(
+        Stratified(by_metadata("chain_type"), lambda stratum: WindowedReservoir(5, 60)),
+        budget=TokenBudget(200_000, evaluators=2),
+        log_path="sampling.jsonl",
+    )
+    service = EvaluationService(evaluators, sampler=sampler)
+
+Policies:
+
+- FixedRate(rate): every run is evaluated with probability `rate`
+- WindowedReservoir(k, window): at most `k` runs per `window` seconds, picked
+  uniformly among all the runs of the window. Runs are held until the window closes.
+- Stratified(key, make_policy): a separate policy for each stratum, e.g. per chain
+  type or tag, so rare strata are not drowned out by frequent ones
+
+A `TokenBudget` caps the estimated evaluator tokens per hour. Close to the cap it
+admits runs with a decreasing probability instead of cutting them off. Each sampled
+run is charged for `evaluators` grader calls up front. When only some runs reach an
+LLM grader, as with `EscalatingEvaluator`, pass `evaluators=0` and the same budget to
+the evaluator, which charges each grader call as it is made.
+
+Every decision records the probability with which the run was sampled, and the
+feedback of sampled runs carries a `weight` of 1 / probability. Averaging scores
+with `weighted_mean` then gives an unbiased estimate over all runs, even though
+strata and time windows are sampled at different rates. A sampled run can still be
+skipped by the `EvaluationService` when its queue is full: admitting it at random
+lowers its recorded probability, and a run dropped outright is recorded as not
+sampled with the reason "overload", so no weight is counted for a run that was never
+scored. The latest decision for a run is the one that counts.
+"""
+import abc
+import collections
+import json
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.tracers.schemas import Run
+
+# (run, probability the run was sampled with, whether it was sampled)
+Offer = Tuple[Run, float, bool]
+
+
+@dataclass
+class Decision:
+    run_id: str
+    sampled: bool
+    probability: float
+    reason: str
+    stratum: Optional[str] = None
+    decided_at: float = 0.0
+
+    @property
+    def weight(self) -> float:
+        """How many runs this one stands for in aggregate scores."""
+        return 1 / self.probability if self.sampled else 0.0
+
+
+class SamplingPolicy(abc.ABC):
+    """Decides which runs are evaluated, and with which probability."""
+
+    @abc.abstractmethod
+    def offer(self, run: Run, now: float) -> List[Offer]:
+        """Offer a finished run, returns the runs decided on so far."""
+
+    def poll(self, now: float) -> List[Offer]:
+        """Decisions that became due without a new run, e.g. a window closing."""
+        return []
+
+    def flush(self) -> List[Offer]:
+        """Decide on every run still held back."""
+        return []
+
+
+class FixedRate(SamplingPolicy):
+    def __init__(self, rate: float):
+        if not 0 < rate <= 1:
+            raise ValueError(f"rate must be in (0, 1], got {rate}")
+        self.rate = rate
+
+    def offer(self, run: Run, now: float) -> List[Offer]:
+        return [(run, self.rate, random.random() < self.rate)]
+
+
+class WindowedReservoir(SamplingPolicy):
+    """
+    Reservoir sampling over fixed time windows: each window keeps a uniform sample
+    of `k` of its runs, so every run of a window with `n` runs is sampled with
+    probability k / n. The sample is released when the window ends.
+    """
+
+    def __init__(self, k: int, window: float = 60.0):
+        self.k = k
+        self.window = window
+        self._started: Optional[float] = None
+        self._seen = 0
+        self._reservoir: List[Run] = []
+        self._evicted: List[Run] = []
+
+    def _close(self) -> List[Offer]:
+        if not self._seen:
+            return []
+        probability = min(1.0, self.k / self._seen)
+        offers = [(run, probability, True) for run in self._reservoir]
+        offers += [(run, probability, False) for run in self._evicted]
+        self._started, self._seen = None, 0
+        self._reservoir, self._evicted = [], []
+        return offers
+
+    def poll(self, now: float) -> List[Offer]:
+        if self._started is not None and now - self._started >= self.window:
+            return self._close()
+        return []
+
+    def offer(self, run: Run, now: float) -> List[Offer]:
+        offers = self.poll(now)
+        if self._started is None:
+            self._started = now
+        self._seen += 1
+        if len(self._reservoir) < self.k:
+            self._reservoir.append(run)
+        else:
+            slot = random.randrange(self._seen)
+            if slot < self.k:
+                self._evicted.append(self._reservoir[slot])
+                self._reservoir[slot] = run
+            else:
+                self._evicted.append(run)
+        return offers
+
+    def flush(self) -> List[Offer]:
+        return self._close()
+
+
+def by_metadata(name: str, default: str = "unknown") -> Callable[[Run], str]:
+    """Stratify by a metadata value passed in the run config."""
+
+    def key(run: Run) -> str:
+        return str(((run.extra or {}).get("metadata") or {}).get(name, default))
+
+    return key
+
+
+def by_tag(tags: Sequence[str], default: str = "untagged") -> Callable[[Run], str]:
+    """Stratify by the first of `tags` found on the run."""
+
+    def key(run: Run) -> str:
+        return next((tag for tag in tags if tag in (run.tags or [])), default)
+
+    return key
+
+
+class Stratified(SamplingPolicy):
+    """Samples each stratum `key(run)` with its own policy, `make_policy(stratum)`."""
+
+    def __init__(
+        self,
+        key: Callable[[Run], str],
+        make_policy: Callable[[str], SamplingPolicy],
+    ):
+        self.key = key
+        self.make_policy = make_policy
+        self.strata: Dict[str, SamplingPolicy] = {}
+
+    def offer(self, run: Run, now: float) -> List[Offer]:
+        stratum = self.key(run)
+        if stratum not in self.strata:
+            self.strata[stratum] = self.make_policy(stratum)
+        return self.strata[stratum].offer(run, now)
+
+    def poll(self, now: float) -> List[Offer]:
+        return [o for policy in self.strata.values() for o in policy.poll(now)]
+
+    def flush(self) -> List[Offer]:
+        return [o for policy in self.strata.values() for o in policy.flush()]
+
+
+def estimate_eval_tokens(run: Run, prompt_tokens: int = 500) -> int:
+    """Rough tokens of one LLM grader call: its rubric plus the run's text."""
+    text = json.dumps(run.inputs, default=str) + json.dumps(run.outputs, default=str)
+    return prompt_tokens + len(text) // 4
+
+
+class TokenBudget:
+    """
+    Caps the estimated evaluator tokens spent over the last hour. Once less than
+    `reserve` of the budget is left, runs are admitted with a probability
+    proportional to what is left, so the budget runs out gradually.
+
+    `evaluators` is the number of grader calls each sampled run is charged for when
+    it is sampled. With 0, grader calls are charged with `charge_call` as they are
+    made, and a run is admitted while there is room for one of them.
+    """
+
+    def __init__(
+        self,
+        tokens_per_hour: int,
+        evaluators: int = 1,
+        reserve: float = 0.2,
+        estimate: Callable[[Run], int] = estimate_eval_tokens,
+    ):
+        self.tokens_per_hour = tokens_per_hour
+        self.evaluators = evaluators
+        self.reserve = reserve
+        self.estimate = estimate
+        self._spent: Deque[Tuple[float, int]] = collections.deque()
+        self._total = 0
+        # Charged from the evaluation workers while the sampler checks the budget
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_cost(
+        cls, usd_per_hour: float, usd_per_1k_tokens: float, **kwargs
+    ) -> "TokenBudget":
+        return cls(int(usd_per_hour / usd_per_1k_tokens * 1000), **kwargs)
+
+    def spent(self, now: float) -> int:
+        with self._lock:
+            while self._spent and now - self._spent[0][0] >= 3600:
+                self._total -= self._spent.popleft()[1]
+            return self._total
+
+    def probability(self, tokens: int, now: float) -> float:
+        remaining = self.tokens_per_hour - self.spent(now) - tokens
+        if remaining < 0:
+            return 0.0
+        return min(1.0, remaining / (self.reserve * self.tokens_per_hour))
+
+    def charge(self, tokens: int, now: float):
+        with self._lock:
+            self._spent.append((now, tokens))
+            self._total += tokens
+
+    def charge_call(self, run: Run):
+        """Charge one grader call on `run`, when the evaluator makes it."""
+        self.charge(self.estimate(run), time.time())
+
+
+class Sampler:
+    """
+    Applies a sampling policy and an optional budget to finished runs, and records
+    every decision in memory and, with `log_path`, as JSON lines.
+    """
+
+    def __init__(
+        self,
+        policy: SamplingPolicy,
+        budget: Optional[TokenBudget] = None,
+        log_path: Optional[str] = None,
+        stratum: Optional[Callable[[Run], str]] = None,
+        max_decisions: int = 10_000,
+    ):
+        self.policy = policy
+        self.budget = budget
+        self.log_path = log_path
+        self.stratum = stratum or getattr(policy, "key", None)
+        self.decisions: Dict[str, Decision] = collections.OrderedDict()
+        self.max_decisions = max_decisions
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _decide(self, offers: List[Offer], now: float) -> List[Tuple[Run, Decision]]:
+        decided = []
+        for run, probability, sampled in offers:
+            reason = "sampled" if sampled else "not_sampled"
+            if sampled and self.budget is not None:
+                tokens = self.budget.evaluators * self.budget.estimate(run)
+                admit = self.budget.probability(
+                    tokens or self.budget.estimate(run), now
+                )
+                probability *= admit
+                if random.random() < admit:
+                    if tokens:
+                        self.budget.charge(tokens, now)
+                else:
+                    sampled, reason = False, "budget"
+            decision = Decision(
+                run_id=str(run.id),
+                sampled=sampled,
+                probability=probability,
+                reason=reason,
+                stratum=self.stratum(run) if self.stratum else None,
+                decided_at=now,
+            )
+            self._record(decision)
+            decided.append((run, decision))
+        return decided
+
+    def _record(self, decision: Decision):
+        self._counts[decision.reason] += 1
+        self.decisions[decision.run_id] = decision
+        while len(self.decisions) > self.max_decisions:
+            self.decisions.popitem(last=False)
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(asdict(decision)) + "\n")
+
+    def offer(self, run: Run) -> List[Run]:
+        """Offer a finished run, returns the runs to evaluate now."""
+        with self._lock:
+            now = time.time()
+            return self._sampled(self._decide(self.policy.offer(run, now), now))
+
+    def poll(self) -> List[Run]:
+        with self._lock:
+            now = time.time()
+            return self._sampled(self._decide(self.policy.poll(now), now))
+
+    def flush(self) -> List[Run]:
+        with self._lock:
+            now = time.time()
+            return self._sampled(self._decide(self.policy.flush(), now))
+
+    def thin(self, run_id, probability: float):
+        """
+        Record that a sampled run was kept further on only with `probability`, e.g.
+        admitted at random to a filling queue, so its weight accounts for that too.
+        """
+        with self._lock:
+            decision = self.decisions.get(str(run_id))
+            if decision is None or not decision.sampled or probability >= 1:
+                return
+            self._counts[decision.reason] -= 1
+            self._record(
+                replace(decision, probability=decision.probability * probability)
+            )
+
+    def drop(self, run_id, reason: str = "overload"):
+        """Record that a sampled run was skipped before it could be evaluated."""
+        with self._lock:
+            decision = self.decisions.get(str(run_id))
+            if decision is None or not decision.sampled:
+                return
+            self._counts[decision.reason] -= 1
+            self._record(replace(decision, sampled=False, reason=reason))
+
+    @staticmethod
+    def _sampled(decided: List[Tuple[Run, Decision]]) -> List[Run]:
+        return [run for run, decision in decided if decision.sampled]
+
+    def decision(self, run_id) -> Optional[Decision]:
+        return self.decisions.get(str(run_id))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "sampled": self._counts["sampled"],
+                "not_sampled": self._counts["not_sampled"],
+                "over_budget": self._counts["budget"],
+                "overload": self._counts["overload"],
+            }
+            if self.budget is not None:
+                stats["budget_spent"] = self.budget.spent(time.time())
+                stats["budget"] = self.budget.tokens_per_hour
+            return stats
+
+
+def load_decisions(path: str) -> Dict[str, Decision]:
+    """Read back the decisions a Sampler logged to `path`, the latest for each run."""
+    with open(path) as f:
+        return {
+            d["run_id"]: Decision(**d) for d in (json.loads(line) for line in f)
+        }
+
+
+def weighted_mean(
+    scores: Iterable[Tuple[str, float]], decisions: Dict[str, Decision]
+) -> Optional[float]:
+    """
+    Estimate the mean score over all runs from the scores of the sampled ones,
+    weighting each by 1 / probability it was sampled with.
+    """
+    total = weights = 0.0
+    for run_id, score in scores:
+        decision = decisions.get(str(run_id))
+        if decision is None or not decision.sampled or score is None:
+            continue
+        total += decision.weight * score
+        weights += decision.weight
+    return total / weights if weights else None
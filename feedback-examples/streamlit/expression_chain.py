@@ -1,12 +1,18 @@
+import os
+import sys
 from datetime import datetime
-from langchain.memory import ConversationBufferMemory
+from langchain_core.memory import BaseMemory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import Runnable, RunnableMap
 from langchain_openai import ChatOpenAI
 
+# model_registry.py is shared by the Streamlit feedback examples
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import REGISTRY
+
 
 def get_expression_chain(
-    system_prompt: str, memory: ConversationBufferMemory
+    system_prompt: str, memory: BaseMemory
 ) -> Runnable:
     """Return a chain defined primarily in LangChain Expression Language"""
     ingress = RunnableMap(
@@ -26,7 +32,8 @@ def get_expression_chain(
             ("human", "{input}"),
         ]
     )
-    llm = ChatOpenAI(temperature=0.7)
+    # Shared across reruns and sessions, along with its connection pool
+    llm = REGISTRY.chat_model(ChatOpenAI, temperature=0.7)
     chain = ingress | prompt | llm
     return chain
 
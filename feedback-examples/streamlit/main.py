@@ -1,9 +1,20 @@
+import os
+import sys
+
 import streamlit as st
 from langchain import memory as lc_memory
 from langsmith import Client
 from streamlit_feedback import streamlit_feedback
 from expression_chain import get_expression_chain
 from langchain_core.tracers.context import collect_runs
+from langchain_openai import ChatOpenAI
+
+# feedback_sink.py is shared by the Streamlit feedback examples
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feedback_sink import FeedbackSink
+from model_registry import REGISTRY
+from stream_renderer import StreamRenderer
+from summary_memory import SummaryWindowMemory
 
 client = Client()
 
@@ -14,6 +25,13 @@ st.set_page_config(
 
 st.subheader("🦜🛠️ Chatbot with Feedback in LangSmith")
 
+
+@st.cache_resource
+def get_feedback_sink() -> FeedbackSink:
+    # Sends feedback in the background, so submitting it doesn't hold up the page
+    return FeedbackSink(client, journal_path=".feedback-journal.jsonl")
+
+
 st.sidebar.info(
     """
          
@@ -39,13 +57,18 @@ system_prompt = st.sidebar.text_area(
 )
 system_prompt = system_prompt.strip().replace("{", "{{").replace("}", "}}")
 
-memory = lc_memory.ConversationBufferMemory(
+# Keeps the recent turns that fit in 1500 tokens, older ones are summarized
+memory = SummaryWindowMemory(
+    llm=REGISTRY.chat_model(ChatOpenAI, temperature=0),
     chat_memory=lc_memory.StreamlitChatMessageHistory(key="langchain_messages"),
     return_messages=True,
     memory_key="chat_history",
+    max_token_limit=1500,
+    state=st.session_state,
 )
 
-# Create Chain
+# Create Chain. It is cheap to build now, its model is reused across reruns and
+# sessions, but it reads this session's chat history so it isn't shared.
 chain = get_expression_chain(system_prompt, memory)
 
 st.sidebar.markdown("## Feedback Scale")
@@ -53,6 +76,19 @@ feedback_option = (
     "thumbs" if st.sidebar.toggle(label="`Faces` ⇄ `Thumbs`", value=False) else "faces"
 )
 
+with st.sidebar.expander("Model registry"):
+    registry_stats = REGISTRY.stats()
+    for obj in registry_stats["objects"]:
+        st.caption(
+            f"{obj['name'].rsplit('.', 1)[-1]} ({obj['config']}): built in"
+            f" {obj['build_ms']:.0f}ms, reused {obj['hits']} times"
+        )
+    http = registry_stats["http"]
+    st.caption(
+        f"{http['requests']} requests over {http['new_connections']} connections"
+        f" ({http['reuse_rate']:.0%} reused)"
+    )
+
 if st.sidebar.button("Clear message history"):
     print("Clearing message history")
     memory.clear()
@@ -66,18 +102,22 @@ for msg in st.session_state.langchain_messages:
 if prompt := st.chat_input(placeholder="Ask me a question!"):
     st.chat_message("user").write(prompt)
     with st.chat_message("assistant", avatar="🦜"):
-        message_placeholder = st.empty()
-        full_response = ""
         # Define the basic input structure for the chains
         input_dict = {"input": prompt}
 
         with collect_runs() as cb:
-            for chunk in chain.stream(input_dict, config={"tags": ["Streamlit Chat"]}):
-                full_response += chunk.content
-                message_placeholder.markdown(full_response + "▌")
+            # Redraws a few times a second instead of for every chunk, and times
+            # the stream
+            with StreamRenderer(st.empty()) as renderer:
+                for chunk in chain.stream(
+                    input_dict, config={"tags": ["Streamlit Chat"]}
+                ):
+                    renderer.write(chunk.content)
+            full_response = renderer.text
             memory.save_context(input_dict, {"output": full_response})
             st.session_state.run_id = cb.traced_runs[0].id
-        message_placeholder.markdown(full_response)
+        # Time to first token etc. are logged as feedback on the run
+        renderer.log_feedback(get_feedback_sink(), st.session_state.run_id)
 
 if st.session_state.get("run_id"):
     run_id = st.session_state.run_id
@@ -107,14 +147,14 @@ if st.session_state.get("run_id"):
 
             # Record the feedback with the formulated feedback type string
             # and optional comment
-            feedback_record = client.create_feedback(
+            feedback_id = get_feedback_sink().submit(
                 run_id,
                 feedback_type_str,
                 score=score,
                 comment=feedback.get("text"),
             )
             st.session_state.feedback = {
-                "feedback_id": str(feedback_record.id),
+                "feedback_id": feedback_id,
                 "score": score,
             }
         else:
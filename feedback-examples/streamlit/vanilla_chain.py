@@ -1,11 +1,17 @@
+import os
+import sys
 from datetime import datetime
 from langchain import LLMChain
-from langchain.memory import ConversationBufferMemory
+from langchain_core.memory import BaseMemory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 
+# model_registry.py is shared by the Streamlit feedback examples
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import REGISTRY
 
-def get_llm_chain(system_prompt: str, memory: ConversationBufferMemory) -> LLMChain:
+
+def get_llm_chain(system_prompt: str, memory: BaseMemory) -> LLMChain:
     """Return a basic LLMChain with memory."""
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -17,7 +23,8 @@ def get_llm_chain(system_prompt: str, memory: ConversationBufferMemory) -> LLMCh
             ("human", "{input}"),
         ]
     ).partial(time=lambda: str(datetime.now()))
-    llm = ChatOpenAI(temperature=0.7)
+    # Shared across reruns and sessions, along with its connection pool
+    llm = REGISTRY.chat_model(ChatOpenAI, temperature=0.7)
     chain = LLMChain(prompt=prompt, llm=llm, memory=memory)
     return chain
 
@@ -0,0 +1,164 @@
+"""
+Conversation memory with a bounded prompt size, for long chat sessions.
+
+`ConversationBufferMemory` puts the whole chat history into every prompt, so prompt
+tokens and latency grow with the length of the session. `SummaryWindowMemory`
+keeps the most recent turns that fit in `max_token_limit` tokens. Older turns are
+folded into a running summary by `llm` on a background thread, so the user never
+waits on it. It is a drop-in replacement:
+
+    memory = SummaryWindowMemory(
+        llm=ChatOpenAI(temperature=0),
+        chat_memory=StreamlitChatMessageHistory(key="langchain_messages"),
+        return_messages=True,
+        memory_key="chat_history",
+        state=st.session_state,
+    )
+
+The summary is returned as the first message of the history, or, with
+`summary_message_cls=None`, only under `summary_key` for prompts that place it
+themselves. Turns that just left the window are missing from the prompt until the
+summarizer has caught up with them, which usually happens while the user types.
+
+Token counts are cached per message content, so each message is tokenized once.
+"""
+import functools
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.pydantic_v1 import Field
+
+logger = logging.getLogger(__name__)
+
+_SUMMARIZER = ThreadPoolExecutor(2, "memory-summarizer")
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Tokens in `text` per tiktoken, or about one per four characters without it."""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class SummaryWindowMemory(BaseChatMemory):
+    """A window of recent turns within a token budget, plus a summary of the rest."""
+
+    llm: BaseLanguageModel
+    """Writes the summary of the turns that left the window."""
+    max_token_limit: int = 2000
+    """Most tokens of summary plus recent messages returned."""
+    memory_key: str = "chat_history"
+    summary_key: str = "conversation_summary"
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    summary_message_cls: Optional[Type[BaseMessage]] = SystemMessage
+    """How the summary is added to the history, None to leave it out."""
+    count_tokens: Callable[[str], int] = count_tokens
+    state: Any = Field(default_factory=dict)
+    """Where the summary of the conversation is kept, e.g. `st.session_state`."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key, self.summary_key]
+
+    def _session(self) -> Dict[str, Any]:
+        key = f"{self.memory_key}_summary"
+        if key not in self.state:
+            self.state[key] = {"text": "", "upto": 0, "job": None}
+        return self.state[key]
+
+    def _message_tokens(self, message: BaseMessage) -> int:
+        return self.count_tokens(f"{message.type}: {message.content}")
+
+    def _window_start(self, messages: List[BaseMessage], session: dict) -> int:
+        """Index of the oldest message that still fits in the budget with the summary."""
+        budget = self.max_token_limit - self.count_tokens(session["text"])
+        start = len(messages)
+        while start > session["upto"]:
+            budget -= self._message_tokens(messages[start - 1])
+            if budget < 0:
+                break
+            start -= 1
+        # Only keep whole turns, starting from a human message
+        while start < len(messages) and messages[start].type != "human":
+            start += 1
+        return start
+
+    def _collect_summary(self, session: dict, num_messages: int):
+        job: Optional[Future] = session["job"]
+        if job is None or not job.done():
+            return
+        session["job"] = None
+        try:
+            text, upto = job.result()
+        except Exception:
+            logger.exception("Failed to summarize the conversation, will retry")
+            return
+        if upto <= num_messages:
+            session["text"], session["upto"] = text, upto
+
+    def _summarize(
+        self, summary: str, messages: List[BaseMessage], upto: int
+    ) -> Tuple[str, int]:
+        new_lines = get_buffer_string(
+            messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+        )
+        chain = SUMMARY_PROMPT | self.llm | StrOutputParser()
+        return chain.invoke({"summary": summary, "new_lines": new_lines}), upto
+
+    def _compact(self) -> Tuple[List[BaseMessage], dict]:
+        """The recent messages, summarizing older ones in the background if needed."""
+        messages = self.chat_memory.messages
+        session = self._session()
+        if session["upto"] > len(messages):
+            # The history was cleared or replaced
+            session.update(text="", upto=0, job=None)
+        self._collect_summary(session, len(messages))
+        start = self._window_start(messages, session)
+        if start > session["upto"] and session["job"] is None:
+            session["job"] = _SUMMARIZER.submit(
+                self._summarize, session["text"], messages[session["upto"] : start], start
+            )
+        return messages[start:], session
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        window, session = self._compact()
+        summary = session["text"]
+        if summary and self.summary_message_cls is not None:
+            window = [self.summary_message_cls(content=summary), *window]
+        history: Any = window
+        if not self.return_messages:
+            history = get_buffer_string(
+                window, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+            )
+        return {self.memory_key: history, self.summary_key: summary}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        # Start summarizing what left the window while the user reads the answer
+        self._compact()
+
+    def clear(self) -> None:
+        super().clear()
+        self._session().update(text="", upto=0, job=None)
@@ -0,0 +1,109 @@
+"""
+Trace URLs for runs, without waiting on LangSmith.
+
+`tracer.get_run_url()` reads the project from the API every time it is called, with
+retries while the project is being created, so showing a trace link holds up the
+response. The link only depends on the project's URL and the run id, which is known
+as soon as the run starts. `TraceUrls` looks up each project once, on a background
+thread, and builds the links locally from then on:
+
+    @st.cache_resource
+    def get_trace_urls():
+        return TraceUrls(Client())
+
+    url = get_trace_urls().url(run.id, tracer.project_name)
+
+`url` never blocks. It returns None while the project is still being looked up, so
+keep the run id around and try again on the next rerun. A lookup for a run that
+failed is only started again after `cooldown` seconds, doubling with each failure in
+a row, so reruns during an outage do not each start a new round of retries. A
+prefetch that failed starts no cooldown: the project may just not exist before its
+first run, so the lookup is tried again as soon as a run's URL is asked for.
+
+tracing-examples/show-trace-url-streamlit keeps a self-contained copy of this class.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from langsmith import Client
+from langsmith.utils import get_tracer_project
+
+logger = logging.getLogger(__name__)
+
+
+class TraceUrls:
+    """Builds run URLs from project URLs that are looked up in the background."""
+
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        retries: int = 5,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+    ):
+        self.client = client or Client()
+        self.retries = retries
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._projects: Dict[str, Future] = {}
+        # project name -> (failed lookups for runs in a row, when to look it up again)
+        self._failures: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(2, "trace-urls")
+
+    def prefetch(self, project_name: Optional[str] = None) -> Future:
+        """
+        Start looking up the project's URL before any of its runs is shown, unless
+        it is known, on its way, or failed less than a cooldown ago.
+        """
+        return self._lookup(project_name, for_run=False)
+
+    def _lookup(self, project_name: Optional[str], for_run: bool) -> Future:
+        project_name = project_name or get_tracer_project()
+        with self._lock:
+            future = self._projects.get(project_name)
+            retry_at = self._failures.get(project_name, (0, 0.0))[1]
+            if future is None or (
+                future.done()
+                and future.exception() is not None
+                and time.monotonic() >= retry_at
+            ):
+                future = self._pool.submit(self._project_url, project_name, for_run)
+                self._projects[project_name] = future
+            return future
+
+    def _project_url(self, project_name: str, for_run: bool) -> str:
+        # A new project only exists once its first run has been posted
+        for attempt in range(self.retries):
+            try:
+                url = self.client.read_project(project_name=project_name).url
+            except Exception:
+                if attempt == self.retries - 1:
+                    logger.exception(f"Failed to look up project {project_name}")
+                    if not for_run:
+                        # Before the first run the project may not exist yet
+                        raise
+                    # Recorded before the future fails, so _lookup always sees it
+                    with self._lock:
+                        failures = self._failures.get(project_name, (0, 0.0))[0] + 1
+                        cooldown = self.cooldown * 2 ** (failures - 1)
+                        self._failures[project_name] = (
+                            failures,
+                            time.monotonic() + min(self.max_cooldown, cooldown),
+                        )
+                    raise
+                time.sleep(0.5 * 2**attempt)
+            else:
+                with self._lock:
+                    self._failures.pop(project_name, None)
+                return url
+
+    def url(self, run_id: Any, project_name: Optional[str] = None) -> Optional[str]:
+        """The run's URL, or None if its project hasn't been looked up yet."""
+        future = self._lookup(project_name, for_run=True)
+        if not future.done() or future.exception() is not None:
+            return None
+        return f"{future.result()}/r/{run_id}?poll=true"
@@ -0,0 +1,103 @@
+"""
+Compare accumulating a simulated conversation with plain lists (`left + right`,
+which copies the whole history every turn) against the shared MessageLog, and
+rebuilding the simulated user's role-swapped history every turn against the
+incrementally maintained one.
+
+    python bench_message_log.py --turns 100 200 500 1000
+"""
+import argparse
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from simulation_utils import (
+    MessageLog,
+    _swap_role,
+    add_messages,
+    create_chat_simulator,
+)
+
+
+def _list_add_messages(left, right):
+    if not isinstance(left, list):
+        left = [left]
+    if not isinstance(right, list):
+        right = [right]
+    return left + right
+
+
+def _accumulate(add, turns):
+    """Add one message per turn and read the history back, like the graph does."""
+    new_messages = [
+        [AIMessage(content=str(turn)) if turn % 2 else HumanMessage(content="")]
+        for turn in range(turns)
+    ]
+    messages = [HumanMessage(content="hi")]
+    start = time.perf_counter()
+    for message in new_messages:
+        messages = add(messages, message)
+        messages[-1]
+    return time.perf_counter() - start
+
+
+def _swap_views(turns, incremental):
+    """Build the simulated user's role-swapped prompt every turn."""
+    new_messages = [[AIMessage(content=str(turn))] for turn in range(turns)]
+    log = MessageLog([HumanMessage(content="hi")])
+    start = time.perf_counter()
+    for message in new_messages:
+        log = log + message
+        if incremental:
+            log.swapped().to_list()
+        else:
+            [_swap_role(m) for m in log]
+    return time.perf_counter() - start
+
+
+def _simulate(turns):
+    def assistant(messages):
+        return "ok"
+
+    def simulated_user(inputs):
+        return AIMessage(content="...")
+
+    simulator = create_chat_simulator(
+        assistant, RunnableLambda(simulated_user), input_key="input", max_turns=turns
+    )
+    start = time.perf_counter()
+    result = simulator.invoke({"input": "hi"}, {"recursion_limit": 2 * turns + 2})
+    return time.perf_counter() - start, len(result["messages"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--turns", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--simulate", action="store_true", help="Also run the graph")
+    args = parser.parse_args()
+
+    print("Accumulating messages, plain lists vs MessageLog:")
+    for turns in args.turns:
+        plain = _accumulate(_list_add_messages, turns)
+        shared = _accumulate(add_messages, turns)
+        print(
+            f"  {turns:6d} turns {plain * 1e3:9.2f}ms {shared * 1e3:9.2f}ms"
+            f" {plain / shared:6.1f}x"
+        )
+    print("Role-swapped history, rebuilt every turn vs incremental:")
+    for turns in args.turns:
+        rebuilt = _swap_views(turns, incremental=False)
+        incremental = _swap_views(turns, incremental=True)
+        print(
+            f"  {turns:6d} turns {rebuilt * 1e3:9.2f}ms {incremental * 1e3:9.2f}ms"
+            f" {rebuilt / incremental:6.1f}x"
+        )
+    if args.simulate:
+        for turns in args.turns:
+            seconds, messages = _simulate(turns)
+            print(f"simulation with {turns} turns: {messages} messages in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+A response cache for the simulated user and the assistant.
+
+Each response is keyed by what the model saw: a namespace identifying the runnable
+(its prompt and model settings) plus the conversation so far. At temperature 0 the
+early turns of a scenario come out the same on every run, so re-running a
+simulation replays them from the cache until the conversation diverges. Cache only
+the simulated user and the assistant under test keeps being called for real:
+
+    cache = ResponseCache(".simulation-cache.sqlite")
+    simulated_user = create_simulated_user(system_prompt, cache=cache)
+    simulator = create_chat_simulator(assistant, simulated_user, input_key="input")
+    ...
+    print(cache.stats())
+
+Entries live in an in-memory LRU in front of an optional SQLite file that persists
+across runs.
+"""
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.load import dumpd
+from langchain_core.messages import (
+    BaseMessage,
+    BaseMessageChunk,
+    message_chunk_to_message,
+    message_to_dict,
+    messages_from_dict,
+)
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+
+def _key_default(value: Any) -> Any:
+    if isinstance(value, BaseMessage):
+        # Leave out ids and response metadata, which differ on every run
+        return {
+            "type": value.type,
+            "content": value.content,
+            "additional_kwargs": value.additional_kwargs,
+        }
+    return repr(value)
+
+
+def _dump_value(value: Any) -> Optional[str]:
+    if isinstance(value, BaseMessageChunk):
+        value = message_chunk_to_message(value)
+    if isinstance(value, str):
+        return json.dumps({"str": value})
+    if isinstance(value, BaseMessage):
+        return json.dumps({"message": message_to_dict(value)})
+    return None
+
+
+def _load_value(dumped: str) -> Any:
+    value = json.loads(dumped)
+    if "str" in value:
+        return value["str"]
+    return messages_from_dict([value["message"]])[0]
+
+
+def default_namespace(runnable: Runnable) -> str:
+    """A hash of the runnable's serialized form, so prompt or model changes get fresh entries."""
+    serialized = json.dumps(dumpd(runnable), sort_keys=True, default=repr)
+    return hashlib.sha256(serialized.encode()).hexdigest()[:16]
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: an in-memory LRU of `max_entries` responses in front of
+    an optional SQLite database at `path`. Safe to share between threads.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._memory: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = collections.defaultdict(collections.Counter)
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses"
+                " (key TEXT PRIMARY KEY, namespace TEXT, value TEXT)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(namespace: str, input: Any) -> str:
+        serialized = json.dumps(input, sort_keys=True, default=_key_default)
+        return hashlib.sha256(f"{namespace}\0{serialized}".encode()).hexdigest()
+
+    def _remember(self, key: str, dumped: str):
+        self._memory[key] = dumped
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """The cached response, or None. Counts a hit or a miss for `namespace`."""
+        with self._lock:
+            stats = self._stats[namespace]
+            dumped = self._memory.get(key)
+            if dumped is not None:
+                self._memory.move_to_end(key)
+                stats["memory_hits"] += 1
+                return _load_value(dumped)
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    stats["disk_hits"] += 1
+                    return _load_value(row[0])
+            stats["misses"] += 1
+        return None
+
+    def put(self, namespace: str, key: str, value: Any):
+        dumped = _dump_value(value)
+        if dumped is None:
+            return
+        with self._lock:
+            self._remember(key, dumped)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                    (key, namespace, dumped),
+                )
+                self._db.commit()
+
+    def clear(self, namespace: Optional[str] = None):
+        """Drop every entry, or only the persisted ones of `namespace`. The LRU is always emptied."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                if namespace is None:
+                    self._db.execute("DELETE FROM responses")
+                else:
+                    self._db.execute(
+                        "DELETE FROM responses WHERE namespace = ?", (namespace,)
+                    )
+                self._db.commit()
+
+    def stats(self) -> dict[str, Any]:
+        """Hit and miss counts, in total and per namespace."""
+
+        def _summary(counter):
+            hits = counter["memory_hits"] + counter["disk_hits"]
+            lookups = hits + counter["misses"]
+            return {
+                "memory_hits": counter["memory_hits"],
+                "disk_hits": counter["disk_hits"],
+                "misses": counter["misses"],
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+        with self._lock:
+            total = sum(self._stats.values(), collections.Counter())
+            return {
+                **_summary(total),
+                "entries_in_memory": len(self._memory),
+                "by_namespace": {
+                    namespace: _summary(counter)
+                    for namespace, counter in self._stats.items()
+                },
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CachedRunnable(Runnable):
+    """
+    Serves a runnable's responses from a ResponseCache.
+
+    Misses call the wrapped runnable and store its output. When streaming, a miss is
+    passed through chunk by chunk and only stored if the stream ran to completion,
+    a hit is returned as a single chunk.
+    """
+
+    def __init__(
+        self, runnable: Any, cache: ResponseCache, namespace: Optional[str] = None
+    ):
+        self.runnable = (
+            runnable if isinstance(runnable, Runnable) else RunnableLambda(runnable)
+        )
+        self.cache = cache
+        self.namespace = namespace or default_namespace(self.runnable)
+
+    @property
+    def InputType(self):
+        return self.runnable.InputType
+
+    @property
+    def OutputType(self):
+        return self.runnable.OutputType
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs):
+        key = self.cache.key(self.namespace, input)
+        cached = self.cache.get(self.namespace, key)
+        if cached is not None:
+            return cached
+        output = self.runnable.invoke(input, config, **kwargs)
+        self.cache.put(self.namespace, key, output)
+        return output
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ):
+        key = self.cache.key(self.namespace, input)
+        cached = self.cache.get(self.namespace, key)
+        if cached is not None:
+            return cached
+        output = await self.runnable.ainvoke(input, config, **kwargs)
+        self.cache.put(self.namespace, key, output)
+        return output
+
+    def stream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> Iterator[Any]:
+        key = self.cache.key(self.namespace, input)
+        cached = self.cache.get(self.namespace, key)
+        if cached is not None:
+            yield cached
+            return
+        output = None
+        for chunk in self.runnable.stream(input, config, **kwargs):
+            output = _accumulate(output, chunk)
+            yield chunk
+        self.cache.put(self.namespace, key, output)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> AsyncIterator[Any]:
+        key = self.cache.key(self.namespace, input)
+        cached = self.cache.get(self.namespace, key)
+        if cached is not None:
+            yield cached
+            return
+        output = None
+        async for chunk in self.runnable.astream(input, config, **kwargs):
+            output = _accumulate(output, chunk)
+            yield chunk
+        self.cache.put(self.namespace, key, output)
+
+
+def _accumulate(output: Any, chunk: Any) -> Any:
+    if output is None or not isinstance(chunk, (str, BaseMessageChunk)):
+        return chunk
+    return output + chunk
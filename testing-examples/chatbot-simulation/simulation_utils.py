@@ -1,9 +1,38 @@
+import asyncio
+import contextlib
+import copy
 import functools
-from typing import Annotated, Any, Callable, Dict, List, Optional, Union
-
-from langchain_core.messages import AIMessage, AnyMessage, BaseMessage, HumanMessage
+import itertools
+import threading
+import time
+from collections.abc import Sequence as SequenceABC
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from langchain_core.messages import (
+    AIMessage,
+    AnyMessage,
+    BaseMessage,
+    BaseMessageChunk,
+    HumanMessage,
+    message_chunk_to_message,
+)
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables import (
+    Runnable,
+    RunnableConfig,
+    RunnableGenerator,
+    RunnableLambda,
+)
 from langchain_core.runnables import chain as as_runnable
 from langchain_openai import ChatOpenAI
 from typing_extensions import TypedDict
@@ -11,6 +40,16 @@ from typing_extensions import TypedDict
 from langgraph.graph import END, StateGraph
 from langchain_community.adapters.openai import convert_message_to_dict
 
+from response_cache import CachedRunnable, ResponseCache
+from stop_criteria import (
+    ROLES,
+    KeywordStop,
+    MaxTurns,
+    StopCriterion,
+    Turn,
+    count_tokens,
+)
+
 
 def langchain_to_openai_messages(messages: List[BaseMessage]):
     """
@@ -29,8 +68,46 @@ def langchain_to_openai_messages(messages: List[BaseMessage]):
     ]
 
 
+class RateLimiter:
+    """
+    Paces calls to at most `requests_per_second`, shared across threads and
+    asyncio tasks.
+
+    Each caller reserves the next free slot and then waits for it outside the lock,
+    so concurrent simulations are admitted in order without busy-waiting.
+    """
+
+    def __init__(self, requests_per_second: float):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be positive.")
+        self.interval = 1.0 / requests_per_second
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    def acquire(self) -> None:
+        """Block until the caller may make its request."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        """Wait, without blocking the event loop, until the caller may make its request."""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
 def create_simulated_user(
-    system_prompt: str, llm: Runnable | None = None
+    system_prompt: str,
+    llm: Runnable | None = None,
+    cache: Optional[ResponseCache] = None,
 ) -> Runnable[Dict, AIMessage]:
     """
     Creates a simulated user for chatbot simulation.
@@ -39,11 +116,13 @@ def create_simulated_user(
         system_prompt (str): The system prompt to be used by the simulated user.
         llm (Runnable | None, optional): The language model to be used for the simulation.
             Defaults to gpt-3.5-turbo.
+        cache (ResponseCache | None, optional): Replay the simulated user's responses
+            to conversations it has already seen from this cache.
 
     Returns:
         Runnable[Dict, AIMessage]: The simulated user for chatbot simulation.
     """
-    return ChatPromptTemplate.from_messages(
+    simulated_user = ChatPromptTemplate.from_messages(
         [
             ("system", system_prompt),
             MessagesPlaceholder(variable_name="messages"),
@@ -51,15 +130,129 @@ def create_simulated_user(
     ) | (llm or ChatOpenAI(model="gpt-3.5-turbo")).with_config(
         run_name="simulated_user"
     )
+    if cache is not None:
+        return CachedRunnable(simulated_user, cache)
+    return simulated_user
+
+
+class _SharedMessages:
+    __slots__ = ("items", "swapped", "lock")
+
+    def __init__(
+        self, items: List[AnyMessage], swapped: Optional[List[AnyMessage]] = None
+    ):
+        self.items = items
+        # Role-swapped copies of items[: len(swapped)], extended as they are needed.
+        self.swapped = swapped or []
+        self.lock = threading.Lock()
+
+    def swapped_prefix(self, length: int) -> List[AnyMessage]:
+        with self.lock:
+            if len(self.swapped) < length:
+                self.swapped.extend(
+                    map(_swap_role, self.items[len(self.swapped) : length])
+                )
+            return self.swapped[:length]
+
+
+class MessageLog(SequenceABC):
+    """
+    An append-only message history whose versions share storage.
+
+    A MessageLog is an immutable view of the first `len(log)` messages of a shared
+    list. Adding messages to the newest version appends to the shared list in place
+    and returns a longer view, so growing a conversation by one turn costs O(1)
+    amortized instead of copying the whole history. Adding to an older version
+    (for example when a conversation is forked) copies its prefix once.
+
+    It behaves like a read-only sequence of messages. Use `to_list()` where an
+    actual list is needed, such as prompt templates.
+    """
+
+    __slots__ = ("_shared", "_length")
+
+    def __init__(self, messages: Sequence[AnyMessage] = ()):
+        self._shared = _SharedMessages(list(messages))
+        self._length = len(self._shared.items)
+
+    @classmethod
+    def _view(cls, shared: _SharedMessages, length: int) -> "MessageLog":
+        log = cls.__new__(cls)
+        log._shared = shared
+        log._length = length
+        return log
+
+    def __add__(self, messages: Sequence[AnyMessage]) -> "MessageLog":
+        shared = self._shared
+        with shared.lock:
+            if self._length == len(shared.items):
+                shared.items.extend(messages)
+                return MessageLog._view(shared, len(shared.items))
+        log = MessageLog(list(itertools.chain(self, messages)))
+        log._shared.swapped = shared.swapped_prefix(self._length)
+        return log
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._shared.items[i] for i in range(self._length)[index]]
+        return self._shared.items[range(self._length)[index]]
+
+    def __iter__(self) -> Iterator[AnyMessage]:
+        return itertools.islice(self._shared.items, self._length)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (MessageLog, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"MessageLog({self.to_list()!r})"
 
+    def to_list(self) -> List[AnyMessage]:
+        return list(self)
 
-Messages = Union[list[AnyMessage], AnyMessage]
+    def swapped(self) -> "SwappedMessages":
+        """A view of the log as seen by the simulated user, with roles reversed."""
+        return SwappedMessages(self)
 
 
-def add_messages(left: Messages, right: Messages) -> Messages:
-    if not isinstance(left, list):
-        left = [left]
-    if not isinstance(right, list):
+class SwappedMessages(SequenceABC):
+    """
+    A view of a MessageLog with AI and human messages swapped.
+
+    Swapped messages are cached alongside the log's shared storage, so turning a
+    conversation of n messages into the simulated user's prompt on every turn only
+    converts the messages added since the previous turn.
+    """
+
+    __slots__ = ("_log",)
+
+    def __init__(self, log: MessageLog):
+        self._log = log
+
+    def __len__(self) -> int:
+        return len(self._log)
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __iter__(self) -> Iterator[AnyMessage]:
+        return iter(self.to_list())
+
+    def to_list(self) -> List[AnyMessage]:
+        return self._log._shared.swapped_prefix(len(self._log))
+
+
+Messages = Union[list[AnyMessage], MessageLog, AnyMessage]
+
+
+def add_messages(left: Messages, right: Messages) -> MessageLog:
+    if not isinstance(left, MessageLog):
+        left = MessageLog(left if isinstance(left, list) else [left])
+    if not isinstance(right, (list, MessageLog)):
         right = [right]
     return left + right
 
@@ -69,12 +262,17 @@ class SimulationState(TypedDict):
     Represents the state of a simulation.
 
     Attributes:
-        messages (List[AnyMessage]): A list of messages in the simulation.
+        messages (List[AnyMessage]): The messages in the simulation. Inside the
+            graph these are kept in a MessageLog.
         inputs (Optional[dict[str, Any]]): Optional inputs for the simulation.
+        stop (Optional[dict[str, Any]]): When stop criteria are used, per role
+            turn, token and time counts and, once a criterion fires, why the
+            simulation stopped and an estimate of what that saved.
     """
 
     messages: Annotated[List[AnyMessage], add_messages]
     inputs: Optional[dict[str, Any]]
+    stop: Optional[dict[str, Any]]
 
 
 def create_chat_simulator(
@@ -87,6 +285,8 @@ def create_chat_simulator(
     input_key: str,
     max_turns: int = 6,
     should_continue: Optional[Callable[[SimulationState], str]] = None,
+    stop_criteria: Optional[Sequence[StopCriterion]] = None,
+    assistant_cache: Optional[ResponseCache] = None,
 ):
     """Creates a chat simulator for evaluating a chatbot.
 
@@ -97,36 +297,156 @@ def create_chat_simulator(
         max_turns: The maximum number of turns in the chat simulation. Default is 6.
         should_continue: Optional function to determine if the simulation should continue.
             If not provided, a default function will be used.
+        stop_criteria: Optional list of StopCriterion (see stop_criteria.py). When given,
+            both sides of the conversation are streamed and the simulation ends as soon
+            as one of them fires, cutting the current turn off if needed. max_turns is
+            still enforced, and so is the simulated user saying "FINISHED" unless
+            should_continue or a KeywordStop is given. The output then includes a
+            "stop" report.
+        assistant_cache: Optional ResponseCache to replay the assistant's responses
+            from. Leave it out while iterating on the assistant. To cache the
+            simulated user, pass a cache to create_simulated_user instead.
 
     Returns:
         The compiled chat simulation graph.
 
     """
+    if assistant_cache is not None:
+        assistant = CachedRunnable(assistant, assistant_cache)
     graph_builder = StateGraph(SimulationState)
-    graph_builder.add_node(
-        "user",
-        _create_simulated_user_node(simulated_user),
-    )
-    graph_builder.add_node(
-        "assistant", _fetch_messages | assistant | _coerce_to_message
-    )
-    graph_builder.add_edge("assistant", "user")
-    graph_builder.add_conditional_edges(
-        "user",
-        should_continue or functools.partial(_should_continue, max_turns=max_turns),
-    )
+    if stop_criteria is not None:
+        criteria = list(stop_criteria)
+        if not any(isinstance(criterion, MaxTurns) for criterion in criteria):
+            criteria.append(MaxTurns(max_turns))
+        if should_continue is None and not any(
+            isinstance(criterion, KeywordStop) for criterion in criteria
+        ):
+            criteria.append(KeywordStop(["FINISHED"], roles=("user",)))
+        for role, runnable, next_role in (
+            ("user", simulated_user, "assistant"),
+            ("assistant", assistant, "user"),
+        ):
+            graph_builder.add_node(
+                role,
+                _throttle
+                | RunnableLambda(_stream_turn, afunc=_astream_turn).bind(
+                    runnable=runnable, role=role, criteria=criteria
+                ),
+            )
+            graph_builder.add_conditional_edges(
+                role,
+                functools.partial(
+                    _stop_or_continue,
+                    next_role=next_role,
+                    should_continue=should_continue if role == "user" else None,
+                ),
+            )
+    else:
+        graph_builder.add_node(
+            "user",
+            _create_simulated_user_node(simulated_user),
+        )
+        graph_builder.add_node(
+            "assistant", _throttle | _fetch_messages | assistant | _coerce_to_message
+        )
+        graph_builder.add_edge("assistant", "user")
+        graph_builder.add_conditional_edges(
+            "user",
+            should_continue or functools.partial(_should_continue, max_turns=max_turns),
+        )
     # If your dataset has a 'leading question/input', then we route first to the assistant, otherwise, we let the user take the lead.
     graph_builder.set_entry_point("assistant" if input_key is not None else "user")
 
     return (
         RunnableLambda(_prepare_example).bind(input_key=input_key)
         | graph_builder.compile()
+        | RunnableGenerator(_messages_to_lists, _amessages_to_lists)
+    )
+
+
+def simulate_many(
+    simulator: Runnable,
+    examples: Sequence[dict[str, Any]],
+    *,
+    max_concurrency: int = 10,
+    requests_per_second: Optional[float] = None,
+    return_exceptions: bool = True,
+) -> List[Union[dict, Exception]]:
+    """Runs many simulated conversations concurrently on a thread pool.
+
+    Args:
+        simulator: The graph returned by `create_chat_simulator`.
+        examples: The example inputs, one per conversation.
+        max_concurrency: The maximum number of conversations in flight at once.
+        requests_per_second: Optional cap on the combined rate of simulated user
+            and assistant turns across all conversations.
+        return_exceptions: Whether to return a failed conversation's exception in
+            its place instead of raising it. Default is True.
+
+    Returns:
+        The final state of each conversation, in the same order as `examples`.
+    """
+    return simulator.batch(
+        list(examples),
+        _simulation_config(max_concurrency, requests_per_second),
+        return_exceptions=return_exceptions,
+    )
+
+
+async def asimulate_many(
+    simulator: Runnable,
+    examples: Sequence[dict[str, Any]],
+    *,
+    max_concurrency: int = 10,
+    requests_per_second: Optional[float] = None,
+    return_exceptions: bool = True,
+) -> List[Union[dict, Exception]]:
+    """Async version of `simulate_many`, running conversations as asyncio tasks.
+
+    Assistants and simulated users that support `ainvoke` (or are async functions)
+    run natively on the event loop; synchronous ones fall back to a thread pool.
+    """
+    return await simulator.abatch(
+        list(examples),
+        _simulation_config(max_concurrency, requests_per_second),
+        return_exceptions=return_exceptions,
     )
 
 
 ## Private methods
 
 
+def _simulation_config(
+    max_concurrency: int, requests_per_second: Optional[float]
+) -> RunnableConfig:
+    config: RunnableConfig = {"max_concurrency": max_concurrency}
+    if requests_per_second is not None:
+        config["configurable"] = {"rate_limiter": RateLimiter(requests_per_second)}
+    return config
+
+
+def _get_rate_limiter(config: RunnableConfig) -> Optional[RateLimiter]:
+    return (config.get("configurable") or {}).get("rate_limiter")
+
+
+def _wait_for_rate_limit(state: SimulationState, config: RunnableConfig):
+    """Wait for the shared rate limiter, if any, before taking a turn."""
+    rate_limiter = _get_rate_limiter(config)
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    return state
+
+
+async def _await_rate_limit(state: SimulationState, config: RunnableConfig):
+    rate_limiter = _get_rate_limiter(config)
+    if rate_limiter is not None:
+        await rate_limiter.aacquire()
+    return state
+
+
+_throttle = RunnableLambda(_wait_for_rate_limit, afunc=_await_rate_limit)
+
+
 def _prepare_example(inputs: dict[str, Any], input_key: Optional[str] = None):
     if input_key is not None:
         if input_key not in inputs:
@@ -148,28 +468,60 @@ def _invoke_simulated_user(state: SimulationState, simulated_user: Runnable):
         if isinstance(simulated_user, Runnable)
         else RunnableLambda(simulated_user)
     )
-    inputs = state.get("inputs", {})
-    inputs["messages"] = state["messages"]
-    return runnable.invoke(inputs)
+    return runnable.invoke({**state.get("inputs", {}), "messages": state["messages"]})
+
+
+async def _ainvoke_simulated_user(state: SimulationState, simulated_user: Runnable):
+    runnable = (
+        simulated_user
+        if isinstance(simulated_user, Runnable)
+        else RunnableLambda(simulated_user)
+    )
+    return await runnable.ainvoke(
+        {**state.get("inputs", {}), "messages": state["messages"]}
+    )
+
+
+def _swap_role(message: AnyMessage) -> AnyMessage:
+    if isinstance(message, AIMessage):
+        return HumanMessage(content=message.content)
+    return AIMessage(content=message.content)
 
 
 def _swap_roles(state: SimulationState):
-    new_messages = []
-    for m in state["messages"]:
-        if isinstance(m, AIMessage):
-            new_messages.append(HumanMessage(content=m.content))
-        else:
-            new_messages.append(AIMessage(content=m.content))
+    messages = state["messages"]
+    if not isinstance(messages, MessageLog):
+        messages = MessageLog(messages)
     return {
         "inputs": state.get("inputs", {}),
-        "messages": new_messages,
+        "messages": messages.swapped().to_list(),
     }
 
 
 @as_runnable
 def _fetch_messages(state: SimulationState):
     """Invoke the simulated user node."""
-    return state["messages"]
+    messages = state["messages"]
+    return messages.to_list() if isinstance(messages, MessageLog) else messages
+
+
+def _to_plain_messages(chunk: Any) -> Any:
+    """Replace MessageLogs in graph output with lists so it traces and serializes as before."""
+    if isinstance(chunk, MessageLog):
+        return chunk.to_list()
+    if isinstance(chunk, dict):
+        return {key: _to_plain_messages(value) for key, value in chunk.items()}
+    return chunk
+
+
+def _messages_to_lists(chunks: Iterator[Any]) -> Iterator[Any]:
+    for chunk in chunks:
+        yield _to_plain_messages(chunk)
+
+
+async def _amessages_to_lists(chunks):
+    async for chunk in chunks:
+        yield _to_plain_messages(chunk)
 
 
 def _convert_to_human_message(message: BaseMessage):
@@ -179,8 +531,11 @@ def _convert_to_human_message(message: BaseMessage):
 def _create_simulated_user_node(simulated_user: Runnable):
     """Simulated user accepts a {"messages": [...]} argument and returns a single message."""
     return (
-        _swap_roles
-        | RunnableLambda(_invoke_simulated_user).bind(simulated_user=simulated_user)
+        _throttle
+        | _swap_roles
+        | RunnableLambda(
+            _invoke_simulated_user, afunc=_ainvoke_simulated_user
+        ).bind(simulated_user=simulated_user)
         | _convert_to_human_message
     )
 
@@ -194,10 +549,205 @@ def _coerce_to_message(assistant_output: str | BaseMessage):
 
 def _should_continue(state: SimulationState, max_turns: int = 6):
     messages = state["messages"]
-    # TODO support other stop criteria
+    # Pass stop_criteria to create_chat_simulator for other stop criteria
     if len(messages) > max_turns:
         return END
     elif messages[-1].content.strip() == "FINISHED":
         return END
     else:
         return "assistant"
+
+
+def _chunk_text(chunk: Any) -> str:
+    if isinstance(chunk, str):
+        return chunk
+    content = getattr(chunk, "content", "")
+    return content if isinstance(content, str) else ""
+
+
+def _new_stop_report() -> dict[str, Any]:
+    return {
+        "reason": None,
+        "criterion": None,
+        "role": None,
+        "cut_mid_turn": False,
+        "turns": 0,
+        "tokens": 0,
+        "seconds": 0.0,
+        "tokens_saved": 0,
+        "seconds_saved": 0.0,
+        "by_role": {role: {"turns": 0, "tokens": 0, "seconds": 0.0} for role in ROLES},
+    }
+
+
+def _average(by_role: dict, role: str, key: str) -> float:
+    stats = by_role[role]
+    if stats["turns"]:
+        return stats[key] / stats["turns"]
+    turns = sum(other["turns"] for other in by_role.values())
+    return sum(other[key] for other in by_role.values()) / turns if turns else 0.0
+
+
+class _TurnStream:
+    """
+    One streamed turn: accumulates chunks, runs the stop criteria on each of them
+    and turns the result into a state update.
+    """
+
+    def __init__(self, state: SimulationState, role: str, criteria: List[StopCriterion]):
+        self.role = role
+        self.criteria = criteria
+        self.messages = state["messages"]
+        self.report = copy.deepcopy(state.get("stop") or _new_stop_report())
+        self.output = None
+        self.pieces: List[str] = []
+        self.tokens = 0
+        self.stopped_by = None
+        self.started = time.perf_counter()
+
+    def runnable_input(self, state: SimulationState) -> Any:
+        if self.role == "assistant":
+            return list(self.messages)
+        return {**state.get("inputs", {}), "messages": _swap_roles(state)["messages"]}
+
+    def _turn(self, chunk: str) -> Turn:
+        return Turn(
+            role=self.role,
+            text="".join(self.pieces),
+            chunk=chunk,
+            tokens=self.tokens,
+            conversation_tokens=self.report["tokens"] + self.tokens,
+            messages=self.messages,
+        )
+
+    def add(self, chunk: Any) -> bool:
+        """Add a chunk, returns True when the turn should be cut off."""
+        if self.output is None or isinstance(chunk, (str, BaseMessageChunk)):
+            self.output = chunk if self.output is None else self.output + chunk
+        else:
+            self.output = chunk
+        text = _chunk_text(chunk)
+        self.pieces.append(text)
+        self.tokens += count_tokens(text)
+        turn = self._turn(text)
+        for criterion in self.criteria:
+            reason = criterion.check_stream(turn)
+            if reason:
+                self.stopped_by = (criterion, reason, True)
+                return True
+        return False
+
+    def _message(self) -> AnyMessage:
+        text = "".join(self.pieces)
+        if self.role == "user":
+            return HumanMessage(content=text)
+        cut_mid_turn = self.stopped_by is not None and self.stopped_by[2]
+        if cut_mid_turn or not isinstance(self.output, BaseMessage):
+            return AIMessage(content=text)
+        if isinstance(self.output, BaseMessageChunk):
+            return message_chunk_to_message(self.output)
+        return self.output
+
+    def finish(self) -> dict[str, Any]:
+        seconds = time.perf_counter() - self.started
+        if self.stopped_by is None:
+            turn = self._turn("")
+            for criterion in self.criteria:
+                reason = criterion.check_turn(turn)
+                if reason:
+                    self.stopped_by = (criterion, reason, False)
+                    break
+
+        report = self.report
+        if self.stopped_by is not None:
+            self._estimate_savings(seconds)
+        stats = report["by_role"][self.role]
+        stats["turns"] += 1
+        stats["tokens"] += self.tokens
+        stats["seconds"] += seconds
+        report["turns"] += 1
+        report["tokens"] += self.tokens
+        report["seconds"] += seconds
+        return {"messages": [self._message()], "stop": report}
+
+    def _estimate_savings(self, seconds: float):
+        """
+        Estimate what stopping saved against running to max_turns, from the average
+        tokens and time per turn of each role so far.
+        """
+        criterion, reason, cut_mid_turn = self.stopped_by
+        report = self.report
+        by_role = report["by_role"]
+        tokens_saved = seconds_saved = 0.0
+        if cut_mid_turn:
+            expected_tokens = _average(by_role, self.role, "tokens")
+            if expected_tokens > self.tokens:
+                tokens_saved = expected_tokens - self.tokens
+                seconds_saved = tokens_saved * seconds / max(self.tokens, 1)
+        max_turns = next((c for c in self.criteria if isinstance(c, MaxTurns)), None)
+        remaining = max_turns.remaining(len(self.messages) + 1) if max_turns else 0
+        role = self.role
+        for _ in range(remaining):
+            role = "user" if role == "assistant" else "assistant"
+            tokens_saved += _average(by_role, role, "tokens") or self.tokens
+            seconds_saved += _average(by_role, role, "seconds") or seconds
+        report.update(
+            reason=reason,
+            criterion=type(criterion).__name__,
+            role=self.role,
+            cut_mid_turn=cut_mid_turn,
+            tokens_saved=round(tokens_saved),
+            seconds_saved=seconds_saved,
+        )
+
+
+def _as_runnable(runnable: Any) -> Runnable:
+    return runnable if isinstance(runnable, Runnable) else RunnableLambda(runnable)
+
+
+def _stream_turn(
+    state: SimulationState,
+    runnable: Runnable,
+    role: str,
+    criteria: List[StopCriterion],
+    config: RunnableConfig,
+):
+    turn = _TurnStream(state, role, criteria)
+    # Closing the stream early stops the underlying generation
+    with contextlib.closing(
+        _as_runnable(runnable).stream(turn.runnable_input(state), config)
+    ) as chunks:
+        for chunk in chunks:
+            if turn.add(chunk):
+                break
+    return turn.finish()
+
+
+async def _astream_turn(
+    state: SimulationState,
+    runnable: Runnable,
+    role: str,
+    criteria: List[StopCriterion],
+    config: RunnableConfig,
+):
+    turn = _TurnStream(state, role, criteria)
+    chunks = _as_runnable(runnable).astream(turn.runnable_input(state), config)
+    try:
+        async for chunk in chunks:
+            if turn.add(chunk):
+                break
+    finally:
+        await chunks.aclose()
+    return turn.finish()
+
+
+def _stop_or_continue(
+    state: SimulationState,
+    next_role: str,
+    should_continue: Optional[Callable[[SimulationState], str]] = None,
+):
+    if (state.get("stop") or {}).get("reason"):
+        return END
+    if should_continue is not None:
+        return should_continue(state)
+    return next_role
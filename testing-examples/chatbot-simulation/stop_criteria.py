@@ -0,0 +1,299 @@
+"""
+Stop criteria for chat simulations.
+
+Pass a list of criteria to `create_chat_simulator(..., stop_criteria=[...])` and each
+turn of the simulated user and the assistant is streamed. Every criterion sees the
+turn as chunks arrive and can cut it off mid-generation, and sees it again once it
+is complete. As soon as one criterion fires the conversation ends, and the
+simulation's output gets a "stop" report with the reason and an estimate of the
+tokens and wall time saved compared with running to `max_turns`.
+
+    simulator = create_chat_simulator(
+        assistant,
+        simulated_user,
+        input_key="input",
+        max_turns=10,
+        stop_criteria=[
+            KeywordStop(r"\\bFINISHED\\b"),
+            TokenBudget(4000),
+            ClassifierStop(),
+            RepetitionStop(),
+        ],
+    )
+"""
+import dataclasses
+import difflib
+import functools
+import math
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from langchain_core.messages import AIMessage, AnyMessage
+
+ROLES = ("assistant", "user")
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in `text` with tiktoken's cl100k_base, or about 4 characters a token without it."""
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_role(message: AnyMessage) -> str:
+    """The simulation role that produced a message in the simulator's history."""
+    return "assistant" if isinstance(message, AIMessage) else "user"
+
+
+@dataclasses.dataclass
+class Turn:
+    """
+    A turn being generated, as seen by the stop criteria.
+
+    Attributes:
+        role: "assistant" or "user".
+        text: The text generated so far, or the full text once the turn is complete.
+        chunk: The text of the latest chunk.
+        tokens: Tokens generated in this turn so far.
+        conversation_tokens: Tokens in the whole conversation, including this turn.
+        messages: The conversation before this turn.
+    """
+
+    role: str
+    text: str
+    chunk: str
+    tokens: int
+    conversation_tokens: int
+    messages: Sequence[AnyMessage]
+
+
+class StopCriterion:
+    """
+    Decides when a simulated conversation is over.
+
+    `check_stream` is called each time a chunk of a turn arrives, `check_turn` once
+    the turn is complete. Both return a short reason to stop the conversation, or
+    None to keep going. They should be cheap: `check_stream` runs for every token.
+    """
+
+    def check_stream(self, turn: Turn) -> Optional[str]:
+        return None
+
+    def check_turn(self, turn: Turn) -> Optional[str]:
+        return None
+
+
+class MaxTurns(StopCriterion):
+    """
+    Stops once the conversation has more than `max_turns` messages after a turn of
+    one of `roles`. Like the simulator without stop criteria, it only counts after
+    the simulated user's turns by default, so both end on the same turn.
+    """
+
+    def __init__(self, max_turns: int, roles: Sequence[str] = ("user",)):
+        self.max_turns = max_turns
+        self.roles = roles
+
+    def remaining(self, num_messages: int) -> int:
+        """How many more messages the conversation could have had."""
+        return max(0, self.max_turns + 1 - num_messages)
+
+    def check_turn(self, turn: Turn) -> Optional[str]:
+        if turn.role in self.roles and len(turn.messages) + 1 > self.max_turns:
+            return f"reached {self.max_turns} turns"
+        return None
+
+
+class KeywordStop(StopCriterion):
+    """
+    Stops when a regex matches a turn, or when any of a list of keywords appears in it
+    as a whole word. Only the end of the text is searched for each chunk, so `window`
+    should be at least as long as the longest match.
+    """
+
+    def __init__(
+        self,
+        pattern: Union[str, Sequence[str]],
+        roles: Sequence[str] = ("user",),
+        flags: int = 0,
+        window: int = 256,
+    ):
+        if not isinstance(pattern, str):
+            pattern = "|".join(rf"\b{re.escape(keyword)}\b" for keyword in pattern)
+        self.pattern = re.compile(pattern, flags)
+        self.roles = roles
+        self.window = window
+
+    def check_stream(self, turn: Turn) -> Optional[str]:
+        if turn.role not in self.roles:
+            return None
+        start = max(0, len(turn.text) - len(turn.chunk) - self.window)
+        match = self.pattern.search(turn.text, start)
+        return f"matched {match.group(0)!r}" if match else None
+
+
+class TokenBudget(StopCriterion):
+    """Stops once the conversation has used `max_tokens` tokens, mid-turn if needed."""
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+
+    def check_stream(self, turn: Turn) -> Optional[str]:
+        if turn.conversation_tokens >= self.max_tokens:
+            return f"used {turn.conversation_tokens} of {self.max_tokens} tokens"
+        return None
+
+
+_FAREWELL_FEATURES = [
+    (re.compile(r"\b(good ?bye|bye|farewell|take care)\b", re.IGNORECASE), 3.0),
+    (re.compile(r"\b(thanks|thank you|appreciate it)\b", re.IGNORECASE), 1.5),
+    (re.compile(r"\bthat'?s (all|it|everything)\b", re.IGNORECASE), 2.0),
+    (re.compile(r"\bhave a (great|nice|good|wonderful) (day|one|evening)\b", re.IGNORECASE), 2.5),
+    (re.compile(r"\bno (further|more|other) questions\b", re.IGNORECASE), 2.5),
+    (re.compile(r"\b(i'?ll|i will) (go|leave|look elsewhere)\b", re.IGNORECASE), 1.5),
+    (re.compile(r"\?"), -2.0),
+]
+_FAREWELL_BIAS = -2.5
+
+
+def farewell_score(text: str) -> float:
+    """
+    A tiny logistic model scoring how likely `text` is to close a conversation,
+    from a handful of phrases near its end. No model calls, microseconds per call.
+    """
+    tail = text[-300:]
+    z = _FAREWELL_BIAS + sum(
+        weight for pattern, weight in _FAREWELL_FEATURES if pattern.search(tail)
+    )
+    return 1 / (1 + math.exp(-z))
+
+
+_SENTENCE_END = re.compile(r"[.!?\n]")
+
+
+class ClassifierStop(StopCriterion):
+    """
+    Stops when a local classifier scores a turn as the end of the conversation.
+
+    `classify` maps text to a probability and defaults to `farewell_score`. While
+    streaming it is only run when a chunk ends a sentence.
+    """
+
+    def __init__(
+        self,
+        classify: Optional[Callable[[str], float]] = None,
+        threshold: float = 0.5,
+        roles: Sequence[str] = ("user",),
+    ):
+        self.classify = classify or farewell_score
+        self.threshold = threshold
+        self.roles = roles
+
+    def _check(self, text: str) -> Optional[str]:
+        score = self.classify(text)
+        if score >= self.threshold:
+            return f"classified as finished ({score:.2f})"
+        return None
+
+    def check_stream(self, turn: Turn) -> Optional[str]:
+        if turn.role in self.roles and _SENTENCE_END.search(turn.chunk):
+            return self._check(turn.text)
+        return None
+
+    def check_turn(self, turn: Turn) -> Optional[str]:
+        return self._check(turn.text) if turn.role in self.roles else None
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+class RepetitionStop(StopCriterion):
+    """
+    Stops when a turn repeats one of the same role's recent turns.
+
+    While streaming, the turn is cut as soon as its first `min_chars` characters
+    or more are the start of one of the last `window` turns of the same role.
+    Complete turns count as repeats when their similarity to one of those turns is
+    at least `similarity`.
+    """
+
+    def __init__(
+        self,
+        similarity: float = 0.9,
+        window: int = 3,
+        min_chars: int = 80,
+        roles: Sequence[str] = ROLES,
+    ):
+        self.similarity = similarity
+        self.window = window
+        self.min_chars = min_chars
+        self.roles = roles
+
+    def _previous(self, turn: Turn) -> List[str]:
+        return [
+            _normalize(message.content)
+            for message in turn.messages[-2 * self.window :]
+            if message_role(message) == turn.role and isinstance(message.content, str)
+        ]
+
+    def check_stream(self, turn: Turn) -> Optional[str]:
+        if (
+            turn.role not in self.roles
+            or len(turn.text) < self.min_chars
+            or not turn.chunk[-1:].isspace()
+        ):
+            return None
+        text = _normalize(turn.text)
+        if any(previous.startswith(text) for previous in self._previous(turn)):
+            return "repeating an earlier turn"
+        return None
+
+    def check_turn(self, turn: Turn) -> Optional[str]:
+        if turn.role not in self.roles:
+            return None
+        text = _normalize(turn.text)
+        for previous in self._previous(turn):
+            matcher = difflib.SequenceMatcher(None, text, previous, autojunk=False)
+            if (
+                matcher.real_quick_ratio() >= self.similarity
+                and matcher.ratio() >= self.similarity
+            ):
+                return "repeated an earlier turn"
+        return None
+
+
+def summarize_stops(results: Sequence[Any]) -> Dict[str, Any]:
+    """
+    Aggregate the "stop" reports of several simulations, e.g. from `simulate_many`.
+    Results that are exceptions or have no report are skipped.
+    """
+    reports = [
+        result["stop"]
+        for result in results
+        if isinstance(result, dict) and result.get("stop")
+    ]
+    by_criterion: Dict[str, int] = {}
+    for report in reports:
+        criterion = report["criterion"] or "none"
+        by_criterion[criterion] = by_criterion.get(criterion, 0) + 1
+    return {
+        "runs": len(reports),
+        "stopped_mid_turn": sum(report["cut_mid_turn"] for report in reports),
+        "by_criterion": by_criterion,
+        "tokens": sum(report["tokens"] for report in reports),
+        "tokens_saved": sum(report["tokens_saved"] for report in reports),
+        "seconds": sum(report["seconds"] for report in reports),
+        "seconds_saved": sum(report["seconds_saved"] for report in reports),
+    }
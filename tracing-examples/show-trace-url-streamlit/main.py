@@ -1,11 +1,17 @@
 import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
 
 import langsmith
 import streamlit as st
 from langchain import callbacks, chat_models
 from langchain_core.prompts import ChatPromptTemplate
+from langsmith.utils import get_tracer_project
 
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 st.set_page_config(
     page_title="LangSmith Trace Tutor",
@@ -18,6 +24,97 @@ Have a chat! When you're done, click the 🛠️ button to see the trace URL."""
 client = langsmith.Client()
 
 
+class TraceUrls:
+    """
+    Builds run URLs from project URLs that are looked up in the background.
+
+    A copy of TraceUrls from feedback-examples/trace_urls.py, so this example runs
+    on its own. See there for how failed lookups are retried.
+    """
+
+    def __init__(
+        self,
+        client: Optional[langsmith.Client] = None,
+        retries: int = 5,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+    ):
+        self.client = client or langsmith.Client()
+        self.retries = retries
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._projects: Dict[str, Future] = {}
+        # project name -> (failed lookups for runs in a row, when to look it up again)
+        self._failures: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(2, "trace-urls")
+
+    def prefetch(self, project_name: Optional[str] = None) -> Future:
+        """
+        Start looking up the project's URL before any of its runs is shown, unless
+        it is known, on its way, or failed less than a cooldown ago.
+        """
+        return self._lookup(project_name, for_run=False)
+
+    def _lookup(self, project_name: Optional[str], for_run: bool) -> Future:
+        project_name = project_name or get_tracer_project()
+        with self._lock:
+            future = self._projects.get(project_name)
+            retry_at = self._failures.get(project_name, (0, 0.0))[1]
+            if future is None or (
+                future.done()
+                and future.exception() is not None
+                and time.monotonic() >= retry_at
+            ):
+                future = self._pool.submit(self._project_url, project_name, for_run)
+                self._projects[project_name] = future
+            return future
+
+    def _project_url(self, project_name: str, for_run: bool) -> str:
+        # A new project only exists once its first run has been posted
+        for attempt in range(self.retries):
+            try:
+                url = self.client.read_project(project_name=project_name).url
+            except Exception:
+                if attempt == self.retries - 1:
+                    logger.exception(f"Failed to look up project {project_name}")
+                    if not for_run:
+                        # Before the first run the project may not exist yet
+                        raise
+                    # Recorded before the future fails, so _lookup always sees it
+                    with self._lock:
+                        failures = self._failures.get(project_name, (0, 0.0))[0] + 1
+                        cooldown = self.cooldown * 2 ** (failures - 1)
+                        self._failures[project_name] = (
+                            failures,
+                            time.monotonic() + min(self.max_cooldown, cooldown),
+                        )
+                    raise
+                time.sleep(0.5 * 2**attempt)
+            else:
+                with self._lock:
+                    self._failures.pop(project_name, None)
+                return url
+
+    def url(self, run_id: Any, project_name: Optional[str] = None) -> Optional[str]:
+        """The run's URL, or None if its project hasn't been looked up yet."""
+        future = self._lookup(project_name, for_run=True)
+        if not future.done() or future.exception() is not None:
+            return None
+        return f"{future.result()}/r/{run_id}?poll=true"
+
+
+@st.cache_resource
+def get_trace_urls() -> TraceUrls:
+    # Starts looking up the project runs are traced to before the first message
+    trace_urls = TraceUrls(client)
+    trace_urls.prefetch(get_tracer_project())
+    return trace_urls
+
+
+get_trace_urls()
+
+
 #### Define Chain
 chain = (
     ChatPromptTemplate.from_messages(
@@ -35,17 +132,26 @@ if user_input := st.chat_input(placeholder="Ask me a question!"):
     with st.chat_message("assistant", avatar="🦜"):
         message_placeholder = st.empty()
         full_response = ""
+        drawn_at = 0.0
         with callbacks.tracing_v2_enabled() as cb:
             for chunk in chain.stream(
                 {"input": user_input}, config={"tags": ["share-trace-url-demo"]}
             ):
                 full_response += chunk.content
-                message_placeholder.markdown(full_response + "▌")
+                # Redrawing for every chunk resends the whole response each time
+                if time.monotonic() - drawn_at > 1 / 15:
+                    message_placeholder.markdown(full_response + "▌")
+                    drawn_at = time.monotonic()
             message_placeholder.markdown(full_response)
-            url = cb.get_run_url()
+            st.session_state.trace_run = (cb.latest_run.id, cb.project_name)
+
+if st.session_state.get("trace_run"):
     # Useful for when you want to debug or annotating runs
-    # for eval/training while you're developing
-    st.markdown(
-        f'<a href="{url}" target="_blank">Latest Trace: 🛠️</a>',
-        unsafe_allow_html=True,
-    )
+    # for eval/training while you're developing.
+    # The first link may only show up on the next rerun, while the project is
+    # looked up, instead of holding up the response.
+    if url := get_trace_urls().url(*st.session_state.trace_run):
+        st.markdown(
+            f'<a href="{url}" target="_blank">Latest Trace: 🛠️</a>',
+            unsafe_allow_html=True,
+        )